@@ -3,15 +3,27 @@
 Script to compare Flightradar24 airport counts with our airports.json data
 """
 
+import argparse
+import concurrent.futures
+import email.message
+import email.utils
+import hashlib
 import json
+import os
 import sys
+import threading
 import time
-from collections import Counter
-from typing import Dict, List, Tuple, Optional
+from collections import Counter, namedtuple
+from typing import Callable, Dict, List, Tuple, Optional
+import urllib.parse
 import urllib.request
 import urllib.error
 from html.parser import HTMLParser
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+import metrics  # noqa: E402
+import tracing  # noqa: E402
+
 
 # Minimum fraction of a subdivisioned country's airports its state pages must
 # cover before we trust them for airport-level detail. FR24 rolls the state
@@ -21,6 +33,95 @@ from html.parser import HTMLParser
 # ~1.0, with small timing skew between the index and country-page fetches.
 STATE_COVERAGE_MIN = 0.9
 
+# Politeness budget for flightradar24.com, shared by every worker: the old
+# serial loop (a page, then a 5 s or 2 s sleep) came to roughly this many
+# requests a minute. Wall time is bounded by the budget, not by the workers,
+# which only overlap the latency of in-flight pages.
+FR24_REQUESTS_PER_MINUTE = float(os.environ.get("FR24_REQUESTS_PER_MINUTE", "12"))
+FR24_BURST = 2
+FR24_WORKERS = int(os.environ.get("FR24_WORKERS", "4"))
+
+# Backoff before each retry, by kind of failure (see _classify), so a kind
+# gets one attempt more than it has delays. A throttled response's Retry-After
+# replaces the delay. The longest Retry-After we are willing to honour.
+RETRY_DELAYS = {
+    'permanent': (),  # 404/410: a bad slug stays bad
+    'throttled': (15, 30, 60),  # 429/503
+    'challenge': (60,),  # Cloudflare interstitial: one retry after a pause
+    'transient': (10, 15, 20),  # resets, timeouts, other errors
+}
+RETRY_AFTER_MAX = 300
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Inertia protocol: with these headers (and the app's current asset version)
+# FR24 answers with the page's JSON payload itself instead of an HTML shell
+# that embeds it. A stale version gets 409 Conflict.
+INERTIA_HEADERS = {
+    'X-Inertia': 'true',
+    'X-Requested-With': 'XMLHttpRequest',
+    'Accept': 'text/html, application/xhtml+xml',
+}
+
+# Asset version from the last payload we parsed; None until one is seen (the
+# first page is then fetched as HTML, which carries it).
+_inertia_version: Optional[str] = None
+
+# Response cache for FR24 pages (see PageCache): FR24_CACHE_DIR, else fr24/
+# on the pipeline's REPO_CACHE_DIR volume; off when neither is set.
+FR24_CACHE_DIR = os.environ.get("FR24_CACHE_DIR") or (
+    os.path.join(os.environ["REPO_CACHE_DIR"], "fr24")
+    if os.environ.get("REPO_CACHE_DIR") else None)
+FR24_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Seconds a cached page is used without asking FR24 at all; after that it is
+# revalidated with a conditional request. The index decides which countries
+# are compared, so it is always revalidated. State pages are only fetched when
+# the country page's total for them differs from ours.
+PAGE_TTLS = {'index': 0, 'country': 60 * 60, 'state': 3 * 60 * 60}
+# Seconds a country or state page's 404/410 is remembered: the URL is not
+# requested again before then.
+NOT_FOUND_TTL = 7 * 24 * 60 * 60
+
+# Comparison state kept between runs (fingerprints): COMPARE_STATE_DIR, else
+# compare/ on REPO_CACHE_DIR; off when neither is set.
+COMPARE_STATE_DIR = os.environ.get("COMPARE_STATE_DIR") or (
+    os.path.join(os.environ["REPO_CACHE_DIR"], "compare")
+    if os.environ.get("REPO_CACHE_DIR") else None)
+DIFFERENCES_FILE = "airport_differences.json"
+FINGERPRINTS_FILE = "fingerprints.json"
+CHECKPOINT_FILE = "checkpoint.jsonl"
+SCHEDULE_FILE = "schedule.json"
+RUN_FILE = "run.json"
+
+# Time budget for a whole run (the CronJobs' activeDeadlineSeconds is 600 and
+# also covers the fetch before and the publish after). No request is started
+# within DEADLINE_MARGIN_SECONDS (the urlopen timeout) of the end.
+COMPARE_BUDGET_SECONDS = float(os.environ.get("COMPARE_BUDGET_SECONDS", "420"))
+DEADLINE_MARGIN_SECONDS = 30
+# A country left out of this many runs in a row goes ahead of everything else,
+# and a record older than RECORD_MAX_AGE_SECONDS is re-verified against FR24
+# even when its fingerprint still matches.
+MAX_DEFERRALS = 3
+RECORD_MAX_AGE_SECONDS = 24 * 60 * 60
+
+DEADLINE_ERROR = "deadline reached"
+
+# Exit status when neither FR24's index nor our airports changed since the last
+# clean run: nothing was compared and no output written (see --force).
+EXIT_UNCHANGED = 3
+
+# Monotonic time after which no FR24 request may start; None means no limit.
+_deadline: Optional[float] = None
+
+
+class DeadlineReached(Exception):
+    """No FR24 request can go out before the run's deadline."""
+
+
+class ChallengePage(Exception):
+    """A response without an Inertia payload, e.g. a Cloudflare challenge."""
+
 
 def create_country_mapping() -> Dict[str, str]:
     """Create mapping from country names to ISO codes"""
@@ -349,22 +450,45 @@ def _normalize_country_name(name: str) -> str:
 
 
 def _extract_data_page(html_content: str) -> Dict:
-    """Extract and parse the Inertia `data-page` JSON payload from a FR24 page.
+    """Extract and parse the Inertia page payload from a FR24 response.
 
-    Raises ValueError if the payload is missing or malformed (e.g. a Cloudflare
-    challenge interstitial), so callers can distinguish a failed fetch from a
-    genuinely empty result.
+    Accepts either an Inertia JSON response or an HTML page, from whose
+    `data-page` attribute the payload is read. Raises ValueError if the payload
+    is missing or malformed (e.g. a Cloudflare challenge interstitial), so
+    callers can distinguish a failed fetch from a genuinely empty result.
     """
-    parser = AppDataPageParser()
-    parser.feed(html_content)
+    global _inertia_version
+    if html_content.lstrip().startswith('{'):
+        try:
+            payload = json.loads(html_content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"could not parse Inertia JSON: {e}")
+    else:
+        parser = AppDataPageParser()
+        parser.feed(html_content)
 
-    if not parser.data_page:
-        raise ValueError("could not find Inertia data-page payload")
+        if not parser.data_page:
+            raise ValueError("could not find Inertia data-page payload")
 
-    try:
-        return json.loads(parser.data_page)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"could not parse data-page JSON: {e}")
+        try:
+            payload = json.loads(parser.data_page)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"could not parse data-page JSON: {e}")
+
+    if not isinstance(payload, dict):
+        raise ValueError("Inertia payload is not an object")
+    if payload.get('version') is not None:
+        _inertia_version = str(payload['version'])
+    return payload
+
+
+def _request_headers() -> Dict[str, str]:
+    """Headers for a FR24 page: Inertia JSON once the asset version is known."""
+    headers = {'User-Agent': USER_AGENT}
+    if _inertia_version is not None:
+        headers.update(INERTIA_HEADERS)
+        headers['X-Inertia-Version'] = _inertia_version
+    return headers
 
 
 def _airports_from_props(props: Dict, state_code: Optional[str] = None) -> List[Dict]:
@@ -420,17 +544,9 @@ def scrape_flightradar24() -> Dict[str, int]:
     url = "https://www.flightradar24.com/data/airports"
 
     try:
-        # Create request with headers
-        req = urllib.request.Request(
-            url,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-        )
-
         # Fetch the page
-        with urllib.request.urlopen(req, timeout=30) as response:
-            html_content = response.read().decode('utf-8')
+        with tracing.span("fr24.index", url=url) as sp:
+            html_content = _get_page(url, sp)
 
         return parse_airports_by_country(html_content)
 
@@ -483,37 +599,313 @@ def parse_states(html_content: str) -> List[Dict]:
     return states
 
 
+class RateLimiter:
+    """Per-host token buckets shared by the worker threads.
+
+    Each host gets `per_minute` requests a minute, in bursts of at most
+    `burst`. defer() holds every request to a host until a point in time,
+    which is how a 429's Retry-After (or a retry backoff) slows all workers
+    at once rather than just the one that was refused.
+    """
+
+    def __init__(self, per_minute: float, burst: int = 1, clock=None, sleep=None):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        # Looked up at call time by default so tests can patch time.sleep.
+        self._clock = clock or (lambda: time.monotonic())
+        self._sleep = sleep or (lambda seconds: time.sleep(seconds))
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, List[float]] = {}  # host -> [tokens, stamp, not_before]
+
+    def _bucket(self, host: str, now: float) -> List[float]:
+        bucket = self._hosts.setdefault(host, [float(self.burst), now, 0.0])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        return bucket
+
+    def wait(self, url: str, until: Optional[float] = None) -> Optional[float]:
+        """Block until a request to url's host may go out; returns seconds waited.
+
+        Returns None at once, without taking a token, if that would be after
+        `until` (on the limiter's clock).
+        """
+        host = urllib.parse.urlsplit(url).hostname or ''
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                bucket = self._bucket(host, now)
+                if now >= bucket[2] and bucket[0] >= 1:
+                    bucket[0] -= 1
+                    return waited
+                delay = max(bucket[2] - now, (1 - bucket[0]) / self.rate)
+                if until is not None and now + delay > until:
+                    return None
+            self._sleep(delay)
+            waited += delay
+
+    def defer(self, url: str, seconds: float) -> None:
+        """Send nothing more to url's host for the next `seconds`."""
+        host = urllib.parse.urlsplit(url).hostname or ''
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            bucket[2] = max(bucket[2], now + seconds)
+
+
+_limiter = RateLimiter(FR24_REQUESTS_PER_MINUTE, FR24_BURST)
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        seconds = when.timestamp() - time.time()
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX)
+
+
+def _classify(error: Exception) -> str:
+    """The RETRY_DELAYS kind of a failed fetch."""
+    if isinstance(error, ChallengePage):
+        return 'challenge'
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code in (404, 410):
+            return 'permanent'
+        if error.code in (429, 503):
+            return 'throttled'
+        if error.headers and error.headers.get('cf-mitigated') == 'challenge':
+            return 'challenge'
+    return 'transient'
+
+
+def _is_permanent(error: str) -> bool:
+    """Whether a fetch error (as _fetch_html words it) is worth no retry."""
+    return "(permanent)" in error
+
+
+def _has_payload(body: str) -> bool:
+    """Whether a response can carry an Inertia payload (JSON or data-page)."""
+    return body.lstrip().startswith('{') or 'data-page=' in body
+
+
 def _fetch_html(url: str, label: str) -> Tuple[Optional[str], Optional[str]]:
     """Fetch a FR24 page with retries. Returns (html, error_message)."""
-    retry_delays = [10, 15, 20]  # Retry delays in seconds
-    last_error = None
+    with tracing.span("fr24.page", url=url) as sp:
+        html, error, kind = _fetch_html_with_retries(url, label, sp)
+        sp.set(ok=error is None)
+        metrics.inc("skycards_fr24_pages_total", result=kind or "ok")
+        return html, error
 
-    for attempt in range(4):  # 1 initial attempt + 3 retries
-        try:
-            if attempt == 0:
-                print(f"  Fetching {label} from {url}")
-            else:
-                delay = retry_delays[attempt - 1]
-                print(f"  Retry {attempt}/3 for {label} after {delay}s delay...")
-                time.sleep(delay)
 
-            req = urllib.request.Request(
-                url,
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-            )
+def _fetch_html_with_retries(url: str, label: str, sp) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """(html, error_message, kind of the last failure)."""
+    last_error = kind = None
 
-            with urllib.request.urlopen(req, timeout=30) as response:
-                return response.read().decode('utf-8'), None
+    for attempt in range(1 + max(map(len, RETRY_DELAYS.values()))):
+        if attempt == 0:
+            print(f"  Fetching {label} from {url}")
+        else:
+            print(f"  Retry {attempt} for {label} ({kind})...")
+            sp.add("retries")
+            metrics.inc("skycards_fr24_page_retries_total")
 
+        retry_after = None
+        try:
+            html = _get_page(url, sp)
+            if not _has_payload(html):
+                raise ChallengePage("no Inertia payload in the response")
+            return html, None, None
+
+        except DeadlineReached:
+            print(f"  Out of time before fetching {label}")
+            return None, DEADLINE_ERROR, 'deadline'
         except Exception as e:
-            last_error = str(e)
-            print(f"  Error fetching {label} (attempt {attempt + 1}/4): {e}")
-
-    error_msg = f"Failed after 4 attempts. Last error: {last_error}"
+            last_error, kind = str(e), _classify(e)
+            if kind == 'throttled':
+                retry_after = _retry_after(e.headers.get('Retry-After'))
+            print(f"  Error fetching {label} (attempt {attempt + 1}, {kind}): {e}")
+
+        delays = RETRY_DELAYS[kind]
+        if attempt >= len(delays):
+            break
+        delay = delays[attempt] if retry_after is None else retry_after
+        sp.add("backoff_s", delay)
+        # Held for the whole host: a throttle or challenge applies to every worker.
+        _limiter.defer(url, delay)
+
+    error_msg = f"Failed after {attempt + 1} attempt(s) ({kind}). Last error: {last_error}"
     print(f"  ❌ {error_msg}")
-    return None, error_msg
+    return None, error_msg, kind
+
+
+class PageCache:
+    """FR24 responses on disk, one JSON file per URL.
+
+    Each entry keeps the body, its validators (ETag / Last-Modified) and when
+    it was last confirmed current. A file's mtime is its last use: once the
+    directory outgrows max_bytes the least recently used pages are dropped.
+    A page that answered 404/410 is kept as its status alone (put_not_found).
+    Writes go through a temp file and os.replace, so a killed run or a second
+    process never sees a torn entry.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = FR24_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.directory,
+                            hashlib.sha256(url.encode()).hexdigest()[:32] + ".json")
+
+    def get(self, url: str) -> Optional[Dict]:
+        path = self._path(url)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('url') == url else None
+
+    def put(self, url: str, body: str, etag: Optional[str],
+            last_modified: Optional[str]) -> None:
+        self._write({'url': url, 'etag': etag, 'last_modified': last_modified,
+                     'fetched_at': time.time(), 'body': body})
+
+    def put_not_found(self, url: str, status: int) -> None:
+        """Remember that url answered 404/410 (an entry with no body)."""
+        self._write({'url': url, 'status': status, 'fetched_at': time.time()})
+
+    def _write(self, entry: Dict) -> None:
+        url = entry['url']
+        path = self._path(url)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"  Warning: could not cache {url}: {e}")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until under max_bytes."""
+        with self._lock:
+            entries, total = [], 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+_cache = PageCache(FR24_CACHE_DIR) if FR24_CACHE_DIR else None
+
+
+def _page_kind(url: str) -> str:
+    """'index', 'country' or 'state', from the depth below /data/airports."""
+    path = urllib.parse.urlsplit(url).path.rstrip('/')
+    depth = path[len('/data/airports'):].count('/')
+    return ('index', 'country', 'state')[min(depth, 2)]
+
+
+def _get_page(url: str, sp) -> str:
+    """GET one page, as Inertia JSON when possible, else as HTML.
+
+    With the cache on, a page younger than its PAGE_TTLS entry is served
+    without a request, and an older one is revalidated (a 304 serves the
+    cached body). A country or state page that answered 404/410 raises the
+    same HTTPError again, without a request, for NOT_FOUND_TTL.
+    """
+    global _inertia_version
+    cached = _cache.get(url) if _cache else None
+    if cached and 'status' in cached:
+        if time.time() - cached['fetched_at'] < NOT_FOUND_TTL:
+            sp.set(cache='not_found')
+            metrics.inc("skycards_fr24_cache_total", result="not_found")
+            raise urllib.error.HTTPError(url, cached['status'], "Not Found (cached)",
+                                         email.message.Message(), None)
+        cached = None
+    if cached and time.time() - cached['fetched_at'] < PAGE_TTLS[_page_kind(url)]:
+        sp.set(cache='hit')
+        metrics.inc("skycards_fr24_cache_total", result="hit")
+        return cached['body']
+
+    headers = _request_headers()
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    if cached and cached.get('last_modified'):
+        headers['If-Modified-Since'] = cached['last_modified']
+    # Every request, retries included, spends from the host's budget.
+    _wait_for_slot(url, sp)
+    try:
+        body, validators = _read(url, headers, sp)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached:
+            _cache.put(url, cached['body'], cached.get('etag'), cached.get('last_modified'))
+            sp.set(cache='revalidated')
+            metrics.inc("skycards_fr24_cache_total", result="revalidated")
+            return cached['body']
+        if e.code in (404, 410) and _cache and _page_kind(url) != 'index':
+            _cache.put_not_found(url, e.code)
+        if e.code != 409 or 'X-Inertia' not in headers:
+            raise
+        # FR24 deployed new assets: fetch the HTML, which carries the new version.
+        print(f"  Inertia version {_inertia_version} is stale; falling back to HTML")
+        _inertia_version = None
+        _wait_for_slot(url, sp)
+        body, validators = _read(url, {'User-Agent': USER_AGENT}, sp)
+    sp.set(inertia=body.lstrip().startswith('{'))
+    if _cache:
+        metrics.inc("skycards_fr24_cache_total", result="miss")
+        # Never keep a challenge page or error shell: only Inertia payloads.
+        if _has_payload(body):
+            _cache.put(url, body, *validators)
+    return body
+
+
+def _wait_for_slot(url: str, sp) -> None:
+    """Take a rate-limit token for url, or raise DeadlineReached."""
+    until = None if _deadline is None else _deadline - DEADLINE_MARGIN_SECONDS
+    if until is not None and time.monotonic() >= until:
+        raise DeadlineReached()
+    waited = _limiter.wait(url, until)
+    if waited is None:
+        raise DeadlineReached()
+    sp.add("rate_wait_s", round(waited, 3))
+
+
+def _read(url: str, headers: Dict[str, str], sp) -> Tuple[str, Tuple[Optional[str], Optional[str]]]:
+    """(body, (etag, last_modified)) for one GET."""
+    req = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(req, timeout=30) as response:
+        raw = response.read()
+        sp.set(bytes=len(raw))
+        return raw.decode('utf-8'), (response.headers.get('ETag'),
+                                     response.headers.get('Last-Modified'))
 
 
 def _country_url(country_name: str) -> str:
@@ -533,56 +925,56 @@ def _our_airport_record(airport: Dict) -> Dict:
     }
 
 
-def get_country_airports_from_our_data(airports_data: Dict, country_code: str) -> List[Dict]:
-    """Extract airports for a specific country from our airports.json data.
+# Our airports grouped for the comparison, built in one pass over the rows by
+# index_airports(): by_country maps an ISO code to its airports (any
+# placeCode under it), by_place an exact placeCode ("US-PA") to its airports,
+# and state_counts an ISO code to {state code: count}. IATA-less airports
+# are left out throughout, as FR24 doesn't list them.
+AirportIndex = namedtuple("AirportIndex", "by_country by_place state_counts")
+
+
+def index_airports(airports_data: Dict) -> AirportIndex:
+    """Index airports.json rows by country and by placeCode."""
+    by_country: Dict[str, List[Dict]] = {}
+    by_place: Dict[str, List[Dict]] = {}
+    state_counts: Dict[str, Dict[str, int]] = {}
+    for airport in airports_data.get('rows', []):
+        place_code = airport.get('placeCode', '')
+        iata = airport.get('iata')
+        if not place_code or iata is None or iata == '':
+            continue
+        record = _our_airport_record(airport)
+        country_code, sep, state_code = place_code.partition('-')
+        by_country.setdefault(country_code, []).append(record)
+        by_place.setdefault(place_code, []).append(record)
+        if sep:
+            counts = state_counts.setdefault(country_code, {})
+            counts[state_code] = counts.get(state_code, 0) + 1
+    return AirportIndex(by_country, by_place, state_counts)
+
+
+def get_country_airports_from_our_data(index: AirportIndex, country_code: str) -> List[Dict]:
+    """Our airports for a specific country.
 
     Keeps the full placeCode (e.g. "US-PA") so downstream rendering can nest
     airports by state/region.
     """
-    country_airports = []
-    for airport in airports_data.get('rows', []):
-        place_code = airport.get('placeCode', '')
-        if place_code and place_code.split('-')[0] == country_code:
-            iata = airport.get('iata')
-            if iata is None or iata == '':
-                continue
-            country_airports.append(_our_airport_record(airport))
-    return country_airports
+    return list(index.by_country.get(country_code, ()))
 
 
-def get_state_airports_from_our_data(airports_data: Dict, country_code: str,
+def get_state_airports_from_our_data(index: AirportIndex, country_code: str,
                                      state_code: str) -> List[Dict]:
-    """Extract our airports for one subdivision (placeCode == "US-PA")."""
-    target = f"{country_code}-{state_code}"
-    state_airports = []
-    for airport in airports_data.get('rows', []):
-        if airport.get('placeCode', '') != target:
-            continue
-        iata = airport.get('iata')
-        if iata is None or iata == '':
-            continue
-        state_airports.append(_our_airport_record(airport))
-    return state_airports
+    """Our airports for one subdivision (placeCode == "US-PA")."""
+    return list(index.by_place.get(f"{country_code}-{state_code}", ()))
 
 
-def get_our_state_counts(airports_data: Dict, country_code: str) -> Dict[str, int]:
+def get_our_state_counts(index: AirportIndex, country_code: str) -> Dict[str, int]:
     """Our airport counts per subdivision for a country, keyed by state code.
 
     Mirrors the country-level counting (IATA-less airports excluded) so the
     per-state totals line up with FR24's state totals.
     """
-    counts: Dict[str, int] = {}
-    prefix = f"{country_code}-"
-    for airport in airports_data.get('rows', []):
-        place_code = airport.get('placeCode', '')
-        if not place_code.startswith(prefix):
-            continue
-        iata = airport.get('iata')
-        if iata is None or iata == '':
-            continue
-        state_code = place_code.split('-', 1)[1]
-        counts[state_code] = counts.get(state_code, 0) + 1
-    return counts
+    return dict(index.state_counts.get(country_code, {}))
 
 
 def compare_country_airports(fr24_airports: List[Dict], our_airports: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
@@ -669,13 +1061,13 @@ def _country_record(country_name: str, iso_code: str, fr24_count: int,
 
 
 def _diff_flat_country(iso_code: str, country_name: str, fr24_count: int,
-                       our_count: int, html: str, airports_data: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+                       our_count: int, html: str, index: AirportIndex) -> Tuple[Optional[Dict], Optional[str]]:
     """Compare a flat country (airports listed directly on its page)."""
     try:
         fr24_airports = parse_country_airports(html)
     except ValueError as e:
         return None, str(e)
-    our_airports = get_country_airports_from_our_data(airports_data, iso_code)
+    our_airports = get_country_airports_from_our_data(index, iso_code)
     added, removed = compare_country_airports(fr24_airports, our_airports)
     for ap in added:  # tag FR24-added airports with the country placeCode
         ap.setdefault('placeCode', iso_code)
@@ -689,6 +1081,8 @@ def _fetch_all_state_airports(country_name: str, states: List[Dict]) -> Tuple[Op
     for state in states:
         state_url = f"https://www.flightradar24.com{state['url']}"
         state_html, error = _fetch_html(state_url, f"{country_name} / {state['name']} ({state['code']})")
+        if error == DEADLINE_ERROR:
+            return None, error
         if error:
             return None, f"state {state['code']} fetch failed: {error}"
         try:
@@ -696,13 +1090,12 @@ def _fetch_all_state_airports(country_name: str, states: List[Dict]) -> Tuple[Op
                 _extract_data_page(state_html).get('props', {}), state_code=state['code']))
         except ValueError as e:
             return None, f"state {state['code']} parse failed: {e}"
-        time.sleep(2)  # be polite between state fetches
     return airports, None
 
 
 def _diff_states_as_flat(iso_code: str, country_name: str, fr24_count: int,
                          our_count: int, states: List[Dict],
-                         airports_data: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+                         index: AirportIndex) -> Tuple[Optional[Dict], Optional[str]]:
     """Fallback when FR24 splits a country into states but our data doesn't.
 
     We can't gate per state (our data has no per-state counts to compare), so
@@ -713,7 +1106,7 @@ def _diff_states_as_flat(iso_code: str, country_name: str, fr24_count: int,
     fr24_airports, error = _fetch_all_state_airports(country_name, states)
     if error:
         return None, error
-    our_airports = get_country_airports_from_our_data(airports_data, iso_code)
+    our_airports = get_country_airports_from_our_data(index, iso_code)
     added, removed = compare_country_airports(fr24_airports, our_airports)
     for ap in added:
         ap.setdefault('placeCode', f"{iso_code}-{ap['state']}" if ap.get('state') else iso_code)
@@ -722,14 +1115,20 @@ def _diff_states_as_flat(iso_code: str, country_name: str, fr24_count: int,
 
 
 def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: int,
-                                our_count: int, states: List[Dict],
-                                airports_data: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+                                our_count: int, states: List[Dict], index: AirportIndex,
+                                reuse_states: Optional[Dict] = None,
+                                on_state: Optional[Callable] = None) -> Tuple[Optional[Dict], Optional[str]]:
     """Compare a subdivisioned country (US, Canada, ...) state by state.
 
     FR24's country page already carries each state's total, and our data has
     per-state counts (placeCode "US-PA"), so we only fetch the state pages
     whose counts actually differ — mirroring the country-level count gate.
+    reuse_states maps a state code to (fingerprint, breakdown) from the last
+    comparison; a state whose fingerprint still matches keeps its breakdown
+    instead of being fetched. on_state(code, fingerprint, breakdown) is called
+    for each state fetched.
     """
+    reuse_states = reuse_states or {}
     # FR24 rolls the state feature out gradually, so a freshly-split country can
     # have many airports not yet assigned to any state — the state pages then
     # enumerate only a fraction of the country total and every unreachable
@@ -745,13 +1144,13 @@ def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: in
         record['state_coverage'] = coverage
         return record, None
 
-    our_state_counts = get_our_state_counts(airports_data, iso_code)
+    our_state_counts = get_our_state_counts(index, iso_code)
     if not our_state_counts:
         # FR24 subdivides this country but our data doesn't yet (or we have no
         # airports there). Per-state matching would falsely flag everything as
         # added, so fall back to a country-level comparison.
         return _diff_states_as_flat(iso_code, country_name, fr24_count,
-                                    our_count, states, airports_data)
+                                    our_count, states, index)
 
     fr24_by_code = {s['code']: s for s in states}
 
@@ -763,9 +1162,21 @@ def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: in
     states_breakdown = {}
     for code in changed:
         state = fr24_by_code.get(code)
+        our_state_airports = get_state_airports_from_our_data(index, iso_code, code)
+        fingerprint = _fingerprint(int(state['total']), our_state_airports) if state else None
+        reuse = reuse_states.get(code)
+        if state and reuse and reuse[0] == fingerprint:
+            print(f"  {code} unchanged since the last comparison")
+            states_breakdown[code] = reuse[1]
+            all_added.extend(reuse[1]['added_airports'])
+            all_removed.extend(reuse[1]['removed_airports'])
+            continue
         if state:  # state present on FR24 -> fetch its airports
             state_url = f"https://www.flightradar24.com{state['url']}"
             state_html, state_error = _fetch_html(state_url, f"{country_name} / {state['name']} ({code})")
+            if state_error == DEADLINE_ERROR:
+                # Out of time, not a failure: the country is carried over.
+                return None, state_error
             if state_error:
                 # Abort the whole country on any state failure — a partial list
                 # would look like a mass removal downstream.
@@ -775,11 +1186,9 @@ def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: in
                     _extract_data_page(state_html).get('props', {}), state_code=code)
             except ValueError as e:
                 return None, f"state {code} parse failed: {e}"
-            time.sleep(2)  # be polite between state fetches
         else:  # state gone from FR24 -> everything we have there is "removed"
             fr24_state_airports = []
 
-        our_state_airports = get_state_airports_from_our_data(airports_data, iso_code, code)
         added, removed = compare_country_airports(fr24_state_airports, our_state_airports)
         for ap in added:
             ap.setdefault('placeCode', f"{iso_code}-{code}")
@@ -797,6 +1206,8 @@ def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: in
             'added_count': len(added),
             'removed_count': len(removed),
         }
+        if state and on_state:
+            on_state(code, fingerprint, states_breakdown[code])
 
     record = _country_record(country_name, iso_code, fr24_count, our_count, all_added, all_removed)
     record['states'] = states_breakdown
@@ -804,8 +1215,9 @@ def _diff_subdivisioned_country(iso_code: str, country_name: str, fr24_count: in
     return record, None
 
 
-def _diff_one_country(iso_code: str, country_name: str, fr24_count: int,
-                      our_count: int, airports_data: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+def _diff_one_country(iso_code: str, country_name: str, fr24_count: int, our_count: int,
+                      index: AirportIndex, reuse_states: Optional[Dict] = None,
+                      on_state: Optional[Callable] = None) -> Tuple[Optional[Dict], Optional[str]]:
     """Fetch a country's page and compare it, handling flat and state splits."""
     html, error = _fetch_html(_country_url(country_name), country_name)
     if error:
@@ -816,20 +1228,297 @@ def _diff_one_country(iso_code: str, country_name: str, fr24_count: int,
         return None, str(e)
     if states:
         return _diff_subdivisioned_country(iso_code, country_name, fr24_count,
-                                           our_count, states, airports_data)
-    return _diff_flat_country(iso_code, country_name, fr24_count, our_count, html, airports_data)
+                                           our_count, states, index, reuse_states, on_state)
+    return _diff_flat_country(iso_code, country_name, fr24_count, our_count, html, index)
+
+
+def _fingerprint(fr24_count: int, our_airports: List[Dict]) -> str:
+    """Hash of FR24's total and our identifier set for a country or state."""
+    ids = sorted(a.get('iata') or a.get('icao') or '' for a in our_airports)
+    return hashlib.sha256(json.dumps([fr24_count, ids]).encode()).hexdigest()[:16]
+
+
+def _record_hash(record: Dict) -> str:
+    return hashlib.sha256(json.dumps(record, sort_keys=True, ensure_ascii=False)
+                          .encode()).hexdigest()[:16]
+
+
+def _fingerprint_entry(record: Dict, fr24_count: int, index: AirportIndex) -> Dict:
+    """What a country's record was computed from, and the record itself."""
+    iso_code = record['iso_code']
+    return {
+        'fingerprint': _fingerprint(fr24_count, get_country_airports_from_our_data(index, iso_code)),
+        'record': _record_hash(record),
+        'states': {code: _fingerprint(s['fr24_count'],
+                                      get_state_airports_from_our_data(index, iso_code, code))
+                   for code, s in record.get('states', {}).items()},
+    }
+
+
+def load_fingerprints(state_dir: str) -> Dict:
+    try:
+        with open(os.path.join(state_dir, FINGERPRINTS_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_fingerprints(state_dir: str, fingerprints: Dict) -> None:
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, FINGERPRINTS_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f)
+    os.replace(path + ".tmp", path)
+
+
+class Checkpoint:
+    """Append-only log of the countries and states a run has finished.
+
+    Every finished country record and fetched state breakdown is appended as
+    one JSON line together with its fingerprint, so a run killed partway
+    (job deadline, pod eviction) loses at most the page in flight. With
+    resume, the entries of the previous run are loaded and reused wherever
+    their fingerprint still matches; a torn last line is ignored. Otherwise
+    the log starts empty. finish() deletes it once the results are saved, but
+    for the states of countries carried over to the next run.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.countries: Dict[str, Tuple[str, Dict]] = {}
+        self.states: Dict[str, Dict[str, Tuple[str, Dict]]] = {}
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+        else:
+            self.finish()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'state' in entry:
+                self.states.setdefault(entry['iso'], {})[entry['state']] = (
+                    entry['fingerprint'], entry['breakdown'])
+            else:
+                self.countries[entry['iso']] = (entry['fingerprint'], entry['record'])
+        print(f"Resuming: {len(self.countries)} countries and "
+              f"{sum(map(len, self.states.values()))} states checkpointed")
+
+    def _append(self, entry: Dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def country_done(self, iso_code: str, fingerprint: str, record: Dict) -> None:
+        self.countries[iso_code] = (fingerprint, record)
+        self._append({'iso': iso_code, 'fingerprint': fingerprint, 'record': record})
+
+    def state_done(self, iso_code: str, code: str, fingerprint: str, breakdown: Dict) -> None:
+        with self._lock:
+            self.states.setdefault(iso_code, {})[code] = (fingerprint, breakdown)
+        self._append({'iso': iso_code, 'state': code, 'fingerprint': fingerprint,
+                      'breakdown': breakdown})
+
+    def finish(self, keep: Tuple[str, ...] = ()) -> None:
+        """Delete the log, keeping only the finished states of the countries in keep."""
+        lines = [json.dumps({'iso': iso_code, 'state': code, 'fingerprint': fp,
+                             'breakdown': breakdown}, ensure_ascii=False) + "\n"
+                 for iso_code in keep
+                 for code, (fp, breakdown) in self.states.get(iso_code, {}).items()]
+        with self._lock:
+            if lines:
+                with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                    f.writelines(lines)
+                os.replace(self.path + ".tmp", self.path)
+                return
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def load_schedule(state_dir: str) -> Dict:
+    try:
+        with open(os.path.join(state_dir, SCHEDULE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_schedule(state_dir: str, schedule: Dict) -> None:
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, SCHEDULE_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(schedule, f)
+    os.replace(path + ".tmp", path)
+
+
+def _run_fingerprint(fr24_counts: Dict[str, int], country_mapping: Dict[str, str],
+                     index: AirportIndex) -> str:
+    """Hash of everything a whole comparison depends on: FR24's index totals,
+    the name mapping, and our identifiers per placeCode (so every country's and
+    state's count and identifier set)."""
+    ours = {place: sorted(a.get('iata') or a.get('icao') or '' for a in airports)
+            for place, airports in index.by_place.items()}
+    blob = json.dumps([fr24_counts, country_mapping, ours], sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
+
+
+def _file_hash(path: str) -> Optional[str]:
+    """sha256 of the file at path, or None if it can't be read."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def load_run(state_dir: str) -> Dict:
+    """The last clean run's {fingerprint, output, finished_at}, or {}."""
+    try:
+        with open(os.path.join(state_dir, RUN_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_run(state_dir: str, fingerprint: Optional[str], output: Optional[str] = None) -> None:
+    """Record a clean run's fingerprint and the hash of the output it wrote;
+    a fingerprint of None forgets the last run."""
+    path = os.path.join(state_dir, RUN_FILE)
+    if fingerprint is None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    os.makedirs(state_dir, exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({'fingerprint': fingerprint, 'output': output,
+                   'finished_at': time.time()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _prioritize(todo: List[Tuple], existing_differences: Dict, schedule: Dict) -> List[Tuple]:
+    """Order countries by what a fetch is worth, for when the budget runs out.
+
+    Countries deferred MAX_DEFERRALS runs in a row come first (longest wait
+    first), so the backlog rotates and each country is refreshed within a
+    bounded number of runs. The rest go by largest count gap, then those
+    never detailed (no record, or only a failed one), then the oldest record.
+    """
+    def key(item):
+        iso_code, _, fr24_count, our_count = item
+        entry = schedule.get(iso_code, {})
+        deferred = entry.get('deferred', 0)
+        record = existing_differences.get(iso_code)
+        detailed = record is not None and 'fetch_error' not in record
+        if deferred >= MAX_DEFERRALS:
+            return (0, -deferred, 0, False, 0, iso_code)
+        return (1, 0, -abs(fr24_count - our_count), detailed,
+                entry.get('detailed_at', 0), iso_code)
+    return sorted(todo, key=key)
+
+
+def shard_of(iso_code: str, shard_count: int) -> int:
+    """The shard (0..shard_count-1) a country belongs to in a sharded run.
+
+    A hash of the ISO code, so every pod agrees on the split without
+    coordinating; hash() is salted per process and would not do.
+    """
+    return int(hashlib.sha1(iso_code.encode()).hexdigest(), 16) % shard_count
+
+
+def _diff_country_traced(iso_code: str, country_name: str, fr24_count: int, our_count: int,
+                         index: AirportIndex, previous: Optional[Tuple[Dict, Dict]] = None,
+                         checkpoint: Optional[Checkpoint] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    """_diff_one_country, unless a checkpoint of this run or previous
+    (fingerprint entry, record) from the last comparison still matches."""
+    print(f"\nProcessing {country_name} ({iso_code}): FR24={fr24_count}, Ours={our_count}")
+    with tracing.span("fr24.country", country=iso_code) as sp:
+        fingerprint = _fingerprint(fr24_count, get_country_airports_from_our_data(index, iso_code))
+        done = checkpoint.countries.get(iso_code) if checkpoint else None
+        if done and done[0] == fingerprint:
+            print("  Already done before the restart; keeping its record")
+            sp.set(resumed=True)
+            return done[1], None
+
+        reuse_states = {}
+        if previous:
+            entry, record = previous
+            # Airports can move between a country's states with its total
+            # unchanged; only the country page has FR24's per-state totals, so
+            # the state fingerprints below decide for a split country.
+            if entry.get('fingerprint') == fingerprint and not record.get('states'):
+                print("  Unchanged since the last comparison; keeping its record")
+                sp.set(reused=True)
+                return record, None
+            stored = entry.get('states', {})
+            reuse_states = {code: (stored[code], breakdown)
+                            for code, breakdown in record.get('states', {}).items()
+                            if code in stored}
+        on_state = None
+        if checkpoint:
+            reuse_states.update(checkpoint.states.get(iso_code, {}))
+
+            def on_state(code, fp, breakdown):
+                checkpoint.state_done(iso_code, code, fp, breakdown)
+
+        record, error = _diff_one_country(iso_code, country_name, fr24_count, our_count,
+                                          index, reuse_states, on_state)
+        if checkpoint and record is not None:
+            checkpoint.country_done(iso_code, fingerprint, record)
+        return record, error
 
 
 def analyze_country_differences(fr24_counts: Dict[str, int], our_counts: Dict[str, int],
                               country_mapping: Dict[str, str], airports_data: Dict,
-                              existing_differences: Optional[Dict] = None) -> Dict:
+                              existing_differences: Optional[Dict] = None,
+                              fingerprints: Optional[Dict] = None,
+                              checkpoint: Optional[Checkpoint] = None,
+                              deadline: Optional[float] = None,
+                              schedule: Optional[Dict] = None,
+                              shard: Optional[Tuple[int, int]] = None,
+                              index: Optional[AirportIndex] = None) -> Dict:
     """Analyze detailed differences for countries with mismatched airport counts
 
     Args:
         existing_differences: Optional existing differences data to preserve on fetch failures
+        fingerprints: Optional fingerprint store from the last run, updated in
+            place. A flat country whose FR24 total and our identifiers are
+            unchanged keeps its existing record without a fetch. A country split
+            into states has its page read again (usually from the page cache),
+            and only the states whose FR24 total or our identifiers moved are
+            fetched again.
+        checkpoint: Optional Checkpoint recording each finished country and
+            state, and holding those of an interrupted run when resuming.
+        deadline: Optional time.monotonic() value. Countries are worked on in
+            _prioritize order and no request starts near the deadline; the
+            countries left over keep their existing record and are carried
+            over to later runs.
+        schedule: Optional per-country backlog state from the last run
+            (deferred run count, when last detailed, whether the last fetch
+            failed in a way worth a retry), updated in place.
+        shard: Optional (index, count); only the countries shard_of() assigns
+            to index are analyzed.
+        index: Optional index_airports(airports_data), when already built.
     """
+    global _deadline
     if existing_differences is None:
         existing_differences = {}
+    if fingerprints is None:
+        fingerprints = {}
+    if schedule is None:
+        schedule = {}
 
     # Find countries with differences
     fr24_iso_counts = {}
@@ -854,18 +1543,68 @@ def analyze_country_differences(fr24_counts: Dict[str, int], our_counts: Dict[st
 
     print(f"\nAnalyzing detailed differences for {len(countries_with_diffs)} countries...")
 
-    for iso_code, country_name, fr24_count, our_count in countries_with_diffs:
+    # One pass over our rows serves every country and state below.
+    if index is None:
+        index = index_airports(airports_data)
+    todo = []
+    for iso_code, country_name, fr24_count, our_count in sorted(countries_with_diffs):
         if not country_name or country_name == iso_code:
             print(f"Skipping {iso_code} - no country name mapping")
             continue
-
-        print(f"\nProcessing {country_name} ({iso_code}): FR24={fr24_count}, Ours={our_count}")
-
-        record, fetch_error = _diff_one_country(iso_code, country_name, fr24_count,
-                                                our_count, airports_data)
-
+        todo.append((iso_code, country_name, fr24_count, our_count))
+
+    if shard:
+        todo = [entry for entry in todo if shard_of(entry[0], shard[1]) == shard[0]]
+        print(f"Shard {shard[0]}/{shard[1]}: {len(todo)} of them")
+
+    # Countries that match again have nothing left to schedule.
+    for iso_code in set(schedule) - {entry[0] for entry in todo}:
+        del schedule[iso_code]
+    todo = _prioritize(todo, existing_differences, schedule)
+    now = time.time()
+
+    # A record is only reused if it is still the one the fingerprints describe,
+    # and not so old that it is due to be checked against FR24 again.
+    previous = {}
+    for iso_code, *_ in todo:
+        entry, record = fingerprints.get(iso_code), existing_differences.get(iso_code)
+        detailed_at = schedule.get(iso_code, {}).get('detailed_at', now)
+        if (entry and record and entry.get('record') == _record_hash(record)
+                and now - detailed_at < RECORD_MAX_AGE_SECONDS):
+            previous[iso_code] = (entry, record)
+
+    # Countries are fetched by a bounded pool, in priority order; the shared
+    # rate limiter, not per-country sleeps, keeps the request rate to FR24
+    # within budget.
+    _deadline = deadline
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, FR24_WORKERS)) as pool:
+            futures = [pool.submit(tracing.propagate(_diff_country_traced), iso_code, country_name,
+                                   fr24_count, our_count, index, previous.get(iso_code), checkpoint)
+                       for iso_code, country_name, fr24_count, our_count in todo]
+            results = [f.result() for f in futures]
+    finally:
+        _deadline = None
+
+    old_fingerprints = dict(fingerprints)
+    fingerprints.clear()
+    old_schedule = dict(schedule)
+    schedule.clear()
+    carried = []
+    for (iso_code, country_name, fr24_count, _), (record, fetch_error) in zip(todo, results):
+        entry = old_schedule.get(iso_code, {})
+        if fetch_error == DEADLINE_ERROR:
+            # Not a failure: this country is next run's business.
+            carried.append(iso_code)
+            schedule[iso_code] = dict(entry, deferred=entry.get('deferred', 0) + 1)
+            if iso_code in existing_differences:
+                differences[iso_code] = existing_differences[iso_code]
+                if iso_code in old_fingerprints:
+                    fingerprints[iso_code] = old_fingerprints[iso_code]
+            continue
         if fetch_error:
             # Failed to fetch new data
+            schedule[iso_code] = dict(entry, deferred=0, failed=not _is_permanent(fetch_error))
             if iso_code in existing_differences:
                 # Preserve existing data - straight copy
                 print(f"  ⚠️  Fetch failed, preserving existing data for {country_name}")
@@ -876,10 +1615,14 @@ def analyze_country_differences(fr24_counts: Dict[str, int], our_counts: Dict[st
                 print(f"  ⚠️  Fetch failed and no existing data - skipping {country_name}")
         elif record is not None:
             differences[iso_code] = record
-
-        # Add delay to be respectful to the server and avoid 429 errors
-        time.sleep(5)
-
+            fingerprints[iso_code] = _fingerprint_entry(record, fr24_count, index)
+            reused = previous.get(iso_code, (None, None))[1] is record
+            schedule[iso_code] = {'deferred': 0,
+                                  'detailed_at': entry.get('detailed_at', now) if reused else now}
+
+    if carried:
+        print(f"\n⏱️  Out of time: {len(carried)} countries carried over to the next run: "
+              f"{', '.join(carried)}")
     return differences
 
 
@@ -963,8 +1706,91 @@ def compare_counts(fr24_counts: Dict[str, int], our_counts: Dict[str, int], coun
         print(f"Countries only in our data: {', '.join(sorted(only_ours))}")
 
 
-def main():
+def _parse_shard(value: str) -> Tuple[int, int]:
+    """argparse type for --shard I/N."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"expected 0 <= I < N, got {value!r}")
+    return index, count
+
+
+def write_differences(output_file: str, differences: Dict,
+                      shard: Optional[Tuple[int, int]] = None) -> Dict:
+    """Write the differences document (a shard's partial one if shard is given)."""
+    output_data = {
+        'summary': {
+            'total_countries_with_differences': len(differences),
+            'total_added_airports': sum(diff['added_count'] for diff in differences.values()),
+            'total_removed_airports': sum(diff['removed_count'] for diff in differences.values())
+        },
+        'countries': dict(sorted(differences.items()))
+    }
+    if shard:
+        output_data['shard'] = {'index': shard[0], 'count': shard[1]}
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(output_data, f, indent=2, ensure_ascii=False)
+
+    print(f"\n✅ Detailed differences saved to {output_file}")
+    print(f"📊 Summary:")
+    print(f"   • {output_data['summary']['total_countries_with_differences']} countries with differences")
+    print(f"   • {output_data['summary']['total_added_airports']} airports added (in FR24 but not in our data)")
+    print(f"   • {output_data['summary']['total_removed_airports']} airports removed (in our data but not in FR24)")
+    return output_data
+
+
+def merge_partials(paths: List[str]) -> Dict:
+    """Combine the partial results of a sharded run into one differences dict.
+
+    Raises ValueError unless the partials are exactly shards 0..N-1 of one
+    run split N ways, so a missing or stray shard never gets published.
+    """
+    differences = {}
+    shards = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        shard = data.get('shard') or {}
+        shards.append((shard.get('index'), shard.get('count')))
+        differences.update(data.get('countries', {}))
+    expected = [(i, len(paths)) for i in range(len(paths))]
+    if Counter(shards) != Counter(expected):
+        raise ValueError(f"expected shards 0..{len(paths) - 1} of {len(paths)}, "
+                         f"got {shards}")
+    return differences
+
+
+def main(argv: Optional[List[str]] = None):
     """Main function"""
+    started = time.monotonic()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the countries and states an interrupted run finished")
+    parser.add_argument("--budget", type=float, default=COMPARE_BUDGET_SECONDS,
+                        help="seconds the whole run may take (default %(default)s)")
+    parser.add_argument("--shard", type=_parse_shard, metavar="I/N",
+                        help="compare only the countries of shard I of N and write a partial result")
+    parser.add_argument("--merge", nargs="+", metavar="PARTIAL",
+                        help="combine the partial results of all shards instead of comparing")
+    parser.add_argument("--output", default=DIFFERENCES_FILE,
+                        help="where to write the result (default %(default)s)")
+    parser.add_argument("--force", action="store_true",
+                        help="compare even if nothing changed since the last run")
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        try:
+            differences = merge_partials(args.merge)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot merge shards: {e}")
+            sys.exit(1)
+        print(f"Merged {len(args.merge)} shards")
+        write_differences(args.output, differences)
+        return
+
     print("Starting airport comparison...")
 
     # Get country mapping
@@ -990,6 +1816,23 @@ def main():
 
     print(f"Found {len(our_counts)} countries in our data")
 
+    state_dir = COMPARE_STATE_DIR
+    if state_dir and args.shard:
+        # Each shard compares its own countries, so keeps its own state.
+        state_dir = os.path.join(state_dir, "shard-%d-of-%d" % args.shard)
+
+    # Nothing on either side moved since the last clean run, and its output is
+    # the one checked out (so it was published): that output stands.
+    index = index_airports(airports_data)
+    run_fingerprint = _run_fingerprint(fr24_counts, country_mapping, index)
+    last_run = load_run(state_dir) if state_dir and not args.shard else {}
+    if (not args.force and last_run.get('fingerprint') == run_fingerprint
+            and time.time() - last_run.get('finished_at', 0) < RECORD_MAX_AGE_SECONDS
+            and last_run.get('output') is not None
+            and last_run['output'] == _file_hash(args.output)):
+        print("FR24 index and our airports unchanged since the last comparison; nothing to do")
+        sys.exit(EXIT_UNCHANGED)
+
     # Compare counts
     compare_counts(fr24_counts, our_counts, country_mapping)
 
@@ -1000,9 +1843,8 @@ def main():
 
     # Load existing differences data if it exists
     existing_differences = {}
-    output_file = 'airport_differences.json'
     try:
-        with open(output_file, 'r', encoding='utf-8') as f:
+        with open(DIFFERENCES_FILE, 'r', encoding='utf-8') as f:
             existing_data = json.load(f)
             existing_differences = existing_data.get('countries', {})
         print(f"Loaded existing differences data for {len(existing_differences)} countries")
@@ -1011,36 +1853,44 @@ def main():
     except Exception as e:
         print(f"Warning: Could not load existing differences file: {e}")
 
-    differences = analyze_country_differences(fr24_counts, our_counts, country_mapping, airports_data, existing_differences)
+    fingerprints = load_fingerprints(state_dir) if state_dir else {}
+    schedule = load_schedule(state_dir) if state_dir else {}
+    checkpoint = None
+    if state_dir:
+        checkpoint = Checkpoint(os.path.join(state_dir, CHECKPOINT_FILE), args.resume)
+    elif args.resume:
+        print("Warning: --resume needs COMPARE_STATE_DIR or REPO_CACHE_DIR; starting over")
+    differences = analyze_country_differences(fr24_counts, our_counts, country_mapping, airports_data,
+                                              existing_differences, fingerprints, checkpoint,
+                                              deadline=started + args.budget, schedule=schedule,
+                                              shard=args.shard, index=index)
 
     # Save differences output even when there are no mismatches so downstream
     # consumers always get a consistent JSON structure.
-    sorted_countries = dict(sorted(differences.items()))
-    output_data = {
-        'summary': {
-            'total_countries_with_differences': len(differences),
-            'total_added_airports': sum(diff['added_count'] for diff in differences.values()),
-            'total_removed_airports': sum(diff['removed_count'] for diff in differences.values())
-        },
-        'countries': sorted_countries
-    }
-
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(output_data, f, indent=2, ensure_ascii=False)
-
-        print(f"\n✅ Detailed differences saved to {output_file}")
-        print(f"📊 Summary:")
-        print(f"   • {output_data['summary']['total_countries_with_differences']} countries with differences")
-        print(f"   • {output_data['summary']['total_added_airports']} airports added (in FR24 but not in our data)")
-        print(f"   • {output_data['summary']['total_removed_airports']} airports removed (in our data but not in FR24)")
+        write_differences(args.output, differences, args.shard)
 
         if not differences:
             print("✅ No detailed analysis needed - all countries match!")
 
+        if state_dir:
+            save_fingerprints(state_dir, fingerprints)
+            save_schedule(state_dir, schedule)
+        if state_dir and not args.shard:
+            # Only a run that left nothing to catch up on may stand in for the
+            # next one: no country carried over, no failure worth a retry.
+            clean = not any(entry.get('deferred') or entry.get('failed')
+                            for entry in schedule.values())
+            save_run(state_dir, run_fingerprint if clean else None, _file_hash(args.output))
+        if checkpoint:
+            checkpoint.finish(keep=tuple(iso for iso, entry in schedule.items()
+                                         if entry.get('deferred')))
+
     except Exception as e:
         print(f"❌ Error saving differences to file: {e}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with metrics.run("compare_airports", unchanged_code=EXIT_UNCHANGED), \
+            tracing.span("compare_airports"):
+        main()
\ No newline at end of file
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""End-to-end pipeline benchmark against local stand-ins (stdlib only).
+
+    python scripts/benchmark.py [--cycles 20] [--mode fetch|fetch-all]
+                                [--warm] [--sparse]
+                                [--pattern change,updatedat,same]
+                                [--payloads DIR] [--json OUT]
+                                [--baseline OLD.json [--tolerance 0.25]]
+
+Nothing leaves the machine. Three local stand-ins replace the real services:
+
+- a replay server serving recorded airports/models/airlines payloads (the
+  committed snapshots, or DIR/<name>.json), with ETag / 304 support;
+- a bare git repo seeded with the same payloads, used as the remote through
+  GIT_REMOTE_URL;
+- a webhook sink that records every Discord post.
+
+pipeline.main then runs in-process for N cycles. Before each cycle every
+source advances one step through --pattern: "change" renames one row,
+"updatedat" bumps only updatedAt, "same" serves the previous body again.
+The report gives p50/p95 wall time per traced phase (see tracing.py), the
+per-cycle wall time, webhook posts and peak RSS. --json saves it; with
+--baseline the run exits 1 if a phase's p95 grew by more than --tolerance.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import http.server
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import jq_format
+import pipeline
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SOURCE_NAMES = ("airports", "models", "airlines")
+PATTERN_STEPS = ("change", "updatedat", "same")
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of values (q in 0-100); 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+def _rows(doc):
+    return doc["rows"] if isinstance(doc, dict) else doc
+
+
+def mutate(doc, step, cycle):
+    """Apply one synthetic pattern step to a parsed payload in place."""
+    if step == "change":
+        rows = _rows(doc)
+        row = rows[cycle % len(rows)]
+        row["name"] = f"{str(row.get('name') or '').split(' (bench ')[0]} (bench {cycle})"
+    elif step == "updatedat" and isinstance(doc, dict) and "updatedAt" in doc:
+        doc["updatedAt"] = int(doc["updatedAt"]) + 1000
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@contextlib.contextmanager
+def _serving(handler):
+    server = _Server(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """Serves server.bodies[name] at /<name>, honoring If-None-Match."""
+
+    def do_GET(self):
+        path = self.path.split("?")[0].strip("/")
+        if path == "airlines/timestamp":
+            self._reply(200, str(int(time.time() * 1000)).encode(), "text/plain")
+            return
+        body = self.server.bodies.get(path)
+        if body is None:
+            self._reply(404, b"not found", "text/plain")
+            return
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, b"", None, etag)
+            return
+        self._reply(200, body, "application/json", etag)
+
+    def _reply(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SinkHandler(http.server.BaseHTTPRequestHandler):
+    """Records every webhook post as (path, body bytes) and answers 204."""
+
+    def do_POST(self):
+        size = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(size)
+        self.server.posts.append((self.path, size))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _git(args, cwd=None):
+    subprocess.run(["git", "-c", "user.name=bench", "-c", "user.email=bench@local",
+                    *args], cwd=cwd, check=True, capture_output=True)
+
+
+def seed_remote(path, payloads):
+    """Create a bare repo at path whose main holds the payload files."""
+    _git(["init", "--bare", "-b", "main", path])
+    _git(["config", "uploadpack.allowFilter", "true"], cwd=path)
+    with tempfile.TemporaryDirectory() as work:
+        _git(["init", "-b", "main", work])
+        for name, text in payloads.items():
+            with open(os.path.join(work, f"{name}.json"), "w", encoding="utf-8") as fh:
+                fh.write(text)
+        _git(["add", "."], cwd=work)
+        _git(["commit", "-m", "seed"], cwd=work)
+        _git(["push", path, "main"], cwd=work)
+
+
+def load_recordings(directory):
+    payloads = {}
+    for name in SOURCE_NAMES:
+        with open(os.path.join(directory, f"{name}.json"), encoding="utf-8") as fh:
+            payloads[name] = fh.read()
+    return payloads
+
+
+def _set_env(values):
+    saved = {k: os.environ.get(k) for k in values}
+    os.environ.update({k: v for k, v in values.items() if v is not None})
+    for k, v in values.items():
+        if v is None:
+            os.environ.pop(k, None)
+    return saved
+
+
+def _fetch_argv(name, base_url):
+    source = pipeline.SOURCES[name]
+    argv = ["fetch", "--data-name", name, "--api-url", f"{base_url}/{name}",
+            "--output-file", source["output_file"],
+            "--timestamp-param", source["timestamp_param"]]
+    if source["timestamp_url"]:
+        argv += ["--timestamp-url", f"{base_url}/{name}/timestamp"]
+    return argv
+
+
+def _run_main(argv):
+    try:
+        pipeline.main(argv)
+    except SystemExit as e:
+        if e.code:
+            print(f"pipeline {argv[0]} exited: {e.code}")
+
+
+def run_benchmark(cycles, mode="fetch", warm=False, pattern=PATTERN_STEPS,
+                  recordings=REPO_ROOT, sparse=False):
+    """Run the pipeline for cycles rounds on local stand-ins; return a report."""
+    payloads = load_recordings(recordings)
+    docs = {name: jq_format.loads(text) for name, text in payloads.items()}
+    with tempfile.TemporaryDirectory() as tmp, \
+            _serving(ReplayHandler) as upstream, _serving(SinkHandler) as sink:
+        remote = os.path.join(tmp, "remote.git")
+        seed_remote(remote, payloads)
+        upstream.bodies = {name: text.encode() for name, text in payloads.items()}
+        sink.posts = []
+        trace_file = os.path.join(tmp, "trace.jsonl")
+        saved = _set_env({
+            "GIT_TOKEN": "bench",
+            "GIT_REMOTE_URL": f"file://{remote}",
+            "TRACE_FILE": trace_file,
+            "TRACE_PARENT": None,
+            "REPO_CACHE_DIR": os.path.join(tmp, "cache") if warm else None,
+            "SPARSE_WORKTREE": "1" if sparse else None,
+            "METRICS_TEXTFILE_DIR": None,
+            "METRICS_PUSHGATEWAY_URL": None,
+            "WEBHOOKS_CONFIG": json.dumps({t: [{"webhook": "sink"}] for t in
+                                           (*SOURCE_NAMES, "misc")}),
+            "WEBHOOK_URLS": json.dumps({"sink": f"{sink.base_url}/webhook"}),
+        })
+        saved_sources = {name: dict(s) for name, s in pipeline.SOURCES.items()}
+        cycle_times = []
+        try:
+            for name in SOURCE_NAMES:
+                pipeline.SOURCES[name]["api_url"] = f"{upstream.base_url}/{name}"
+                if pipeline.SOURCES[name]["timestamp_url"]:
+                    pipeline.SOURCES[name]["timestamp_url"] = (
+                        f"{upstream.base_url}/{name}/timestamp")
+            for cycle in range(cycles):
+                step = pattern[cycle % len(pattern)]
+                for name in SOURCE_NAMES:
+                    mutate(docs[name], step, cycle)
+                    upstream.bodies[name] = jq_format.dumps(docs[name]).encode()
+                t0 = time.perf_counter()
+                if mode == "fetch-all":
+                    _run_main(["fetch-all"])
+                else:
+                    for name in SOURCE_NAMES:
+                        _run_main(_fetch_argv(name, upstream.base_url))
+                cycle_times.append(time.perf_counter() - t0)
+                print(f"cycle {cycle + 1}/{cycles} ({step}): "
+                      f"{cycle_times[-1]:.2f}s")
+        finally:
+            pipeline.SOURCES.update(saved_sources)
+            _set_env(saved)
+        return build_report(trace_file, cycle_times, len(sink.posts),
+                            dict(cycles=cycles, mode=mode, warm=warm,
+                                 sparse=sparse,
+                                 pattern=list(pattern)))
+
+
+def build_report(trace_file, cycle_times, posts, config):
+    phases = {}
+    with open(trace_file, encoding="utf-8") as fh:
+        for line in fh:
+            span = json.loads(line)
+            phases.setdefault(span["name"], []).append(span["duration_ms"])
+    return {
+        "config": config,
+        "cycle_ms": _stats([t * 1000 for t in cycle_times]),
+        "phases": {name: _stats(values) for name, values in sorted(phases.items())},
+        "webhook_posts": posts,
+        # ru_maxrss is in KiB on Linux. Children are left out: a forked git
+        # is charged the parent's pages until it execs.
+        "peak_rss_mib": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _stats(values):
+    return {"count": len(values), "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "total": round(sum(values), 3)}
+
+
+def regressions(report, baseline, tolerance):
+    """Phases whose p95 grew by more than tolerance (a fraction) vs baseline."""
+    found = []
+    for name, stats in report["phases"].items():
+        old = baseline.get("phases", {}).get(name)
+        # Sub-millisecond phases are all noise.
+        if old and old["p95"] >= 1 and stats["p95"] > old["p95"] * (1 + tolerance):
+            found.append((name, old["p95"], stats["p95"]))
+    return found
+
+
+def print_report(report):
+    print(f"\n{'phase':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'total ms':>12}")
+    rows = sorted(report["phases"].items(), key=lambda kv: -kv[1]["total"])
+    for name, s in [("cycle", report["cycle_ms"]), *rows]:
+        print(f"{name:<28}{s['count']:>7}{s['p50']:>11.1f}{s['p95']:>11.1f}"
+              f"{s['total']:>12.1f}")
+    print(f"\nwebhook posts: {report['webhook_posts']}")
+    print(f"peak RSS: {report['peak_rss_mib']} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline locally.")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--mode", choices=["fetch", "fetch-all"], default="fetch")
+    parser.add_argument("--warm", action="store_true",
+                        help="keep a warm working copy (REPO_CACHE_DIR)")
+    parser.add_argument("--sparse", action="store_true",
+                        help="check out nothing but the updated files "
+                             "(SPARSE_WORKTREE)")
+    parser.add_argument("--pattern", default=",".join(PATTERN_STEPS),
+                        help=f"comma-separated steps from {', '.join(PATTERN_STEPS)}")
+    parser.add_argument("--payloads", default=REPO_ROOT,
+                        help="directory with airports/models/airlines.json")
+    parser.add_argument("--json", dest="json_out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    pattern = args.pattern.split(",")
+    unknown = set(pattern) - set(PATTERN_STEPS)
+    if unknown:
+        parser.error(f"unknown pattern steps: {', '.join(sorted(unknown))}")
+    if not shutil.which("git"):
+        parser.error("git is required")
+
+    report = run_benchmark(args.cycles, args.mode, args.warm, pattern,
+                           args.payloads, args.sparse)
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            found = regressions(report, json.load(fh), args.tolerance)
+        for name, old, new in found:
+            print(f"REGRESSION {name}: p95 {old:.1f} ms -> {new:.1f} ms")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
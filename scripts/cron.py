@@ -0,0 +1,77 @@
+"""Five-field cron expressions for the daemon's scheduler (stdlib only).
+
+Supports `*`, numbers, ranges `a-b`, steps `*/n` / `a-b/n` and comma lists,
+evaluated in UTC like the CronJobs. As in Vixie cron, when both day-of-month
+and day-of-week are restricted a day matching either one is due. Day-of-week
+is 0-6 from Sunday; 7 is accepted as Sunday too.
+"""
+
+import collections
+import datetime
+
+# (low, high) per field: minute, hour, day of month, month, day of week.
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+Cron = collections.namedtuple(
+    "Cron", "expr minutes hours days months weekdays any_day any_weekday")
+
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        spec, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (int(v) for v in spec.split("-", 1))
+        else:
+            start = end = int(spec)
+            if step != 1:
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"cron field {text!r} out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+def parse(expr):
+    """Parse "m h dom mon dow" into a Cron; raises ValueError if malformed."""
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+    try:
+        minutes, hours, days, months, weekdays = (
+            _parse_field(text, low, high)
+            for text, (low, high) in zip(fields, FIELDS))
+    except ValueError as e:
+        raise ValueError(f"bad cron expression {expr!r}: {e}") from None
+    weekdays = frozenset(d % 7 for d in weekdays)
+    return Cron(expr, minutes, hours, days, months, weekdays,
+                fields[2] == "*", fields[4] == "*")
+
+
+def _day_matches(cron, day):
+    if day.month not in cron.months:
+        return False
+    in_days = day.day in cron.days
+    # isoweekday(): Monday=1 .. Sunday=7 -> cron's Sunday=0.
+    in_weekdays = day.isoweekday() % 7 in cron.weekdays
+    if cron.any_day or cron.any_weekday:
+        return in_days and in_weekdays
+    return in_days or in_weekdays
+
+
+def next_time(cron, after):
+    """First matching minute strictly after the datetime `after`."""
+    t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    # Four years covers every satisfiable day/month combination (Feb 29).
+    for _ in range(366 * 4):
+        if _day_matches(cron, t):
+            for hour in sorted(h for h in cron.hours if h >= t.hour):
+                start = t.minute if hour == t.hour else 0
+                minute = next((m for m in sorted(cron.minutes) if m >= start), None)
+                if minute is not None:
+                    return t.replace(hour=hour, minute=minute)
+        t = (t + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+    raise ValueError(f"cron expression never matches: {cron.expr!r}")
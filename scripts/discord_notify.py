@@ -12,6 +12,9 @@ import re
 
 import requests
 
+import metrics
+import tracing
+
 AVATAR = "https://avatars.githubusercontent.com/u/224248835?s=256"
 LIMIT = 1900
 VALID_TYPES = ("airports", "models", "airlines", "comparison", "misc")
@@ -67,14 +70,21 @@ def build_attachment_content(file_title, body, link, mention):
 
 def send_discord(message_file, tldr, link, username, routing_key, caption="",
                  routes=None, session=None):
-    routes = load_webhook_routes() if routes is None else routes
-    session = requests.Session() if session is None else session
-
     try:
         with open(message_file, encoding="utf-8") as fh:
             message = fh.read()
     except FileNotFoundError:
         message = ""
+    send_message(message, tldr, link, username, routing_key, caption=caption,
+                 routes=routes, session=session)
+
+
+def send_message(message, tldr, link, username, routing_key, caption="",
+                 routes=None, session=None):
+    """Post an in-memory Markdown message to every subscriber of routing_key."""
+    routes = load_webhook_routes() if routes is None else routes
+    session = requests.Session() if session is None else session
+
     if not message:
         print("No message file or empty message; nothing to send.")
         return
@@ -91,18 +101,25 @@ def send_discord(message_file, tldr, link, username, routing_key, caption="",
         body = caption or tldr
 
     for name, url, mention in subscribers:
-        if not long_message:
-            payload = build_inline_payload(message, username, mention)
-            r = session.post(url, json=payload)
-            r.raise_for_status()
-        else:
-            content = build_attachment_content(file_title, body, link, mention)
-            payload = {"content": content, "username": username,
-                       "avatar_url": AVATAR,
-                       "attachments": [{"id": 0, "filename": "changes.md"}]}
-            r = session.post(
-                url,
-                data={"payload_json": json.dumps(payload)},
-                files={"files[0]": ("changes.md", attach, "text/markdown")},
-            )
+        with tracing.span("discord.post", webhook=name,
+                          attachment=long_message) as sp, \
+                metrics.timer("skycards_webhook_post_duration_seconds",
+                              webhook=name):
+            if not long_message:
+                payload = build_inline_payload(message, username, mention)
+                r = session.post(url, json=payload)
+            else:
+                content = build_attachment_content(file_title, body, link, mention)
+                payload = {"content": content, "username": username,
+                           "avatar_url": AVATAR,
+                           "attachments": [{"id": 0, "filename": "changes.md"}]}
+                r = session.post(
+                    url,
+                    data={"payload_json": json.dumps(payload)},
+                    files={"files[0]": ("changes.md", attach, "text/markdown")},
+                )
+            sp.set(status=r.status_code, bytes=len(json.dumps(payload))
+                   + (len(attach.encode()) if long_message else 0))
+            metrics.inc("skycards_webhook_posts_total", webhook=name,
+                        status=r.status_code)
             r.raise_for_status()
@@ -1,10 +1,12 @@
 """Format Skycards data changes into Markdown Discord messages (stdlib only)."""
 
 import argparse
+import collections
 import json
 import sys
 
 import country_data as cd
+import tracing
 
 ARROW = "→"  # right arrow used in "old -> new"
 HEADER_EMOJI = "\U0001F6A8"  # rotating light
@@ -36,6 +38,16 @@ def diff(old_list, new_list, key, fields):
     return added, updated, removed
 
 
+def _narrow(old_rows, new_rows, changes):
+    """Only the rows a structural comparison (json_diff.Changes) found added,
+    removed or updated; every other row is identical on both sides, so it
+    can't show up in a diff. Without changes the rows pass through."""
+    if changes is None:
+        return old_rows, new_rows
+    return ([*changes.removed, *(o for o, _, _ in changes.updated)],
+            [*changes.added, *(n for _, n, _ in changes.updated)])
+
+
 def _rarity(r):
     rn = r.get("rareness")
     return f"{rn / 100:.2f} ({r.get('xp')} xp)" if rn else "N/A"
@@ -128,8 +140,9 @@ def is_misc_tldr(tldr):
     return tldr.endswith(MISC_TLDR_SUFFIX)
 
 
-def format_models(old_rows, new_rows, link):
-    added, updated, removed = diff(old_rows, new_rows, "id", MODEL_CHANGE_FIELDS)
+def format_models(old_rows, new_rows, link, changes=None):
+    added, updated, removed = diff(*_narrow(old_rows, new_rows, changes), "id",
+                                   MODEL_CHANGE_FIELDS)
     if not (added or updated or removed):
         return _misc_message("aircraft", link)
 
@@ -293,32 +306,36 @@ def _capped_codes(codes):
     return body
 
 
-def _summary_parts(msg_type, old_rows, new_rows):
+def _summary_parts(msg_type, old_rows, new_rows, changes=None):
     """(added_codes, removed_codes, total_count, total_label) for a gameplay
     type, reusing each formatter's diff key, filtering, and identifier."""
+    old_changed, new_changed = _narrow(old_rows, new_rows, changes)
     if msg_type == "airports":
-        old = [r for r in old_rows if r.get("iata")]
-        new = [r for r in new_rows if r.get("iata")]
+        old = [r for r in old_changed if r.get("iata")]
+        new = [r for r in new_changed if r.get("iata")]
         added, _, removed = diff(old, new, "id", AIRPORT_CHANGE_FIELDS)
-        return _iata_codes(added), _iata_codes(removed), len(new), "airports"
+        total = sum(1 for r in new_rows if r.get("iata"))
+        return _iata_codes(added), _iata_codes(removed), total, "airports"
     if msg_type == "airlines":
-        old = [r for r in old_rows if _aircraft_count(r)]
-        new = [r for r in new_rows if _aircraft_count(r)]
+        old = [r for r in old_changed if _aircraft_count(r)]
+        new = [r for r in new_changed if _aircraft_count(r)]
         added, _, removed = diff(old, new, "id", FLEET_CHANGE_FIELDS)
         icaos = lambda recs: sorted(r["icao"] for r in recs if r.get("icao"))
-        return icaos(added), icaos(removed), len(new), "fleets"
-    added, _, removed = diff(old_rows, new_rows, "id", MODEL_CHANGE_FIELDS)
+        total = sum(1 for r in new_rows if _aircraft_count(r))
+        return icaos(added), icaos(removed), total, "fleets"
+    added, _, removed = diff(old_changed, new_changed, "id", MODEL_CHANGE_FIELDS)
     ids = lambda recs: sorted(r["id"] for r in recs)
     return ids(added), ids(removed), len(new_rows), "aircraft"
 
 
-def attachment_summary(msg_type, old_rows, new_rows, tldr):
+def attachment_summary(msg_type, old_rows, new_rows, tldr, changes=None):
     """Rich Discord file-attachment body: tldr + Added/Removed code lists + total.
 
     Updated is intentionally omitted — it rarely matters and a large updated list
     would re-blow the content limit that forced the file attachment in the first
     place. Codes are capped per line via _capped_codes."""
-    added, removed, total, label = _summary_parts(msg_type, old_rows, new_rows)
+    added, removed, total, label = _summary_parts(msg_type, old_rows, new_rows,
+                                                  changes)
     return "\n".join([
         tldr,
         "",
@@ -329,11 +346,13 @@ def attachment_summary(msg_type, old_rows, new_rows, tldr):
     ])
 
 
-def format_airports(old_rows, new_rows, link):
+def format_airports(old_rows, new_rows, link, changes=None):
     # Upstream never deletes airports; it nulls their iata/icao while keeping
     # the id row. An airport without an iata is not a real (playable) airport
     # (see compare_airports.py, which skips them), so drop those before diffing
     # — a row that loses its iata then reads as a removal instead of vanishing.
+    total_airports = sum(1 for r in new_rows if r.get("iata"))
+    old_rows, new_rows = _narrow(old_rows, new_rows, changes)
     old_rows = [r for r in old_rows if r.get("iata")]
     new_rows = [r for r in new_rows if r.get("iata")]
     added, updated, removed = diff(old_rows, new_rows, "id", AIRPORT_CHANGE_FIELDS)
@@ -371,7 +390,7 @@ def format_airports(old_rows, new_rows, link):
     if became_major or became_minor:
         total += "\n\n" + _unlockable_block(became_major, became_minor)
     msg = _assemble("airports", sections, total, link,
-                    footer=f"Total airports: {len(new_rows):,}")
+                    footer=f"Total airports: {total_airports:,}")
     return msg, _tldr("Airports", added, updated, removed)
 
 
@@ -584,10 +603,12 @@ FLEET_CHANGE_FIELDS = [
 ]
 
 
-def format_fleets(old_list, new_list, link):
+def format_fleets(old_list, new_list, link, changes=None):
     # A fleet with no aircraft isn't a real (playable) fleet, mirroring how
     # iata-less airports are handled. Drop empty fleets before diffing so a
     # fleet emptying out reads as a removal, and one refilling reads as added.
+    total_fleets = sum(1 for r in new_list if _aircraft_count(r))
+    old_list, new_list = _narrow(old_list, new_list, changes)
     old_list = [r for r in old_list if _aircraft_count(r)]
     new_list = [r for r in new_list if _aircraft_count(r)]
     added, updated, removed = diff(old_list, new_list, "id", FLEET_CHANGE_FIELDS)
@@ -629,7 +650,7 @@ def format_fleets(old_list, new_list, link):
     ]
     total = _total_block(icaos(added), icaos([n for _, n in updated]), icaos(removed))
     msg = _assemble("fleets", sections, total, link,
-                    footer=f"Total fleets: {len(new_list):,}")
+                    footer=f"Total fleets: {total_fleets:,}")
     return msg, _tldr("Fleets", added, updated, removed)
 
 
@@ -660,6 +681,54 @@ FORMATTERS = {
 FIRST_RUN_LABEL = {"models": "Aircraft", "airports": "Airports", "airlines": "Fleets"}
 
 
+Summary = collections.namedtuple("Summary", "message tldr caption is_misc")
+
+
+def summarize(msg_type, old, new, link, old_airports=None, airports=None,
+              changes=None):
+    """Summarize a change from already-parsed documents.
+
+    old/new are the previous and current snapshots (old None = first run);
+    for "comparison" they are the differences documents and old_airports /
+    airports the airports snapshots each comparison was made against.
+    Returns a Summary of the Discord message, the one-line tldr, the file
+    attachment caption and whether it is a misc (non-gameplay) notice.
+    changes, the json_diff.Changes of old vs new when the caller already has
+    it, limits the formatters to the rows it names.
+    """
+    with tracing.span("format_changes", type=msg_type) as sp:
+        summary = _summarize(msg_type, old, new, link, old_airports, airports,
+                             changes)
+        sp.set(message_chars=len(summary.message), is_misc=summary.is_misc)
+        return summary
+
+
+def _summarize(msg_type, old, new, link, old_airports, airports, changes):
+    if msg_type == "comparison":
+        new_diffs = new or {"countries": {}}
+        msg, tldr = format_comparison(old, new_diffs, _airport_idents(old_airports),
+                                      _airport_idents(airports), link)
+        return Summary(msg, tldr, tldr, is_misc_tldr(tldr))
+
+    new_rows = _rows(new) or []
+    if old is None:
+        label = FIRST_RUN_LABEL[msg_type]
+        msg = (f"## {HEADER_EMOJI} Airpedia {label.lower()} data published\n\n"
+               f"For all changes see [commit](<{link}>)")
+        tldr = f"{label} data published"
+        return Summary(msg, tldr, tldr, is_misc_tldr(tldr))
+
+    old_rows = _rows(old) or []
+    msg, tldr = FORMATTERS[msg_type](old_rows, new_rows, link, changes)
+    is_misc = is_misc_tldr(tldr)
+    # Gameplay changes get a rich attachment summary (tldr + Added/Removed
+    # codes + total) for the Discord file message; the commit body keeps the
+    # one-line tldr. Misc notices have no diff to break out, so they reuse it.
+    caption = tldr if is_misc else attachment_summary(msg_type, old_rows,
+                                                      new_rows, tldr, changes)
+    return Summary(msg, tldr, caption, is_misc)
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description="Format Skycards data changes.")
     parser.add_argument("--type", required=True,
@@ -677,41 +746,19 @@ def main(argv=None):
                              "code breakdown for airports; falls back to the tldr)")
     args = parser.parse_args(argv)
 
-    if args.type == "comparison":
-        old_diffs = _load(args.old)
-        new_diffs = _load(args.new) or {"countries": {}}
-        old_iatas = _airport_idents(_load(args.old_airports))
-        new_iatas = _airport_idents(_load(args.airports))
-        msg, tldr = format_comparison(old_diffs, new_diffs, old_iatas, new_iatas, args.link)
-    else:
-        old_data = _load(args.old)
-        new_rows = _rows(_load(args.new)) or []
-        if old_data is None:
-            label = FIRST_RUN_LABEL[args.type]
-            msg = (f"## {HEADER_EMOJI} Airpedia {label.lower()} data published\n\n"
-                   f"For all changes see [commit](<{args.link}>)")
-            tldr = f"{label} data published"
-        else:
-            msg, tldr = FORMATTERS[args.type](_rows(old_data) or [], new_rows, args.link)
+    summary = summarize(args.type, _load(args.old), _load(args.new), args.link,
+                        old_airports=_load(args.old_airports),
+                        airports=_load(args.airports))
 
     with open(args.out, "w", encoding="utf-8") as fh:
-        fh.write(msg)
+        fh.write(summary.message)
     if args.meta_out:
         with open(args.meta_out, "w", encoding="utf-8") as fh:
-            fh.write("true" if is_misc_tldr(tldr) else "false")
+            fh.write("true" if summary.is_misc else "false")
     if args.caption_out:
-        # Gameplay changes get a rich attachment summary (tldr + Added/Removed
-        # codes + total) for the Discord file message; the commit body keeps the
-        # one-line tldr. Misc/first-run/comparison notices have no diff to break
-        # out, so they reuse the tldr.
-        if (args.type in ("airports", "airlines", "models")
-                and old_data is not None and not is_misc_tldr(tldr)):
-            caption = attachment_summary(args.type, _rows(old_data) or [], new_rows, tldr)
-        else:
-            caption = tldr
         with open(args.caption_out, "w", encoding="utf-8") as fh:
-            fh.write(caption + "\n")
-    print(tldr)
+            fh.write(summary.caption + "\n")
+    print(summary.tldr)
     return 0
 
 
@@ -0,0 +1,234 @@
+"""jq-compatible JSON pretty-printer (stdlib only).
+
+Reproduces `jq .` byte for byte: two-space indentation, `[]`/`{}` for empty
+containers, key order as parsed, raw UTF-8 with only `"`, `\\`, control
+characters and DEL escaped. Numbers follow jq 1.7, which the committed
+snapshots were written with: a parsed number keeps its source literal (in
+decNumber's canonical spelling, e.g. `0.000029204718417047183` stays as is,
+`1e3` becomes `1E+3`), and only computed doubles go through jq's dtoa
+rendering. Parse with loads()/load() so literals survive the round trip.
+
+    python jq_format.py --verify-history [snapshot ...]
+
+re-formats every historical version of the snapshots in git and reports any
+that differ from what was committed.
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+from json.encoder import encode_basestring
+
+SNAPSHOTS = ("airports.json", "models.json", "airlines.json")
+_DBL_MAX = sys.float_info.max
+_CHUNK = 1 << 16
+_LITERAL = re.compile(r"(-?)(\d+)(?:\.(\d+))?(?:[eE]([+-]?\d+))?")
+
+
+class Number(float):
+    """A parsed JSON number that remembers its source literal."""
+
+    __slots__ = ("literal",)
+
+    def __new__(cls, literal):
+        self = super().__new__(cls, literal)
+        self.literal = literal
+        return self
+
+
+def _parse_int(literal):
+    # int() would drop the sign of "-0", which jq prints back verbatim.
+    return Number(literal) if literal == "-0" else int(literal)
+
+
+def loads(text):
+    return json.loads(text, parse_float=Number, parse_int=_parse_int)
+
+
+def load(fh):
+    return json.load(fh, parse_float=Number, parse_int=_parse_int)
+
+
+def format_literal(literal):
+    """Canonicalize a JSON number literal the way decNumber (jq 1.7) does."""
+    sign, whole, frac, exp = _LITERAL.fullmatch(literal).groups()
+    frac = frac or ""
+    coeff = (whole + frac).lstrip("0") or "0"
+    e = int(exp or 0) - len(frac)
+    adjusted = e + len(coeff) - 1
+    if e <= 0 and adjusted >= -6:
+        point = len(coeff) + e
+        if e == 0:
+            body = coeff
+        elif point > 0:
+            body = f"{coeff[:point]}.{coeff[point:]}"
+        else:
+            body = f"0.{'0' * -point}{coeff}"
+    else:
+        body = (coeff[0] + ("." + coeff[1:] if len(coeff) > 1 else "")
+                + f"E{'+' if adjusted >= 0 else '-'}{abs(adjusted)}")
+    return sign + body
+
+
+def format_number(x):
+    """Render a computed double the way jq's dtoa prints it."""
+    if x != x:
+        return "null"
+    x = max(-_DBL_MAX, min(_DBL_MAX, x))
+
+    sign = "-" if str(x)[0] == "-" else ""
+    mantissa, _, exp = repr(abs(x)).partition("e")
+    whole, _, frac = mantissa.partition(".")
+    digits = whole + frac
+    decpt = len(whole) + int(exp or 0)
+    stripped = digits.lstrip("0")
+    decpt -= len(digits) - len(stripped)
+    digits = stripped.rstrip("0")
+    if not digits:
+        return sign + "0"
+
+    n = len(digits)
+    if decpt <= -4 or decpt > n + 15:
+        e = decpt - 1
+        body = digits[0] + ("." + digits[1:] if n > 1 else "")
+        return f"{sign}{body}e{'-' if e < 0 else '+'}{abs(e):02d}"
+    if decpt <= 0:
+        return f"{sign}0.{'0' * -decpt}{digits}"
+    if n > decpt:
+        return f"{sign}{digits[:decpt]}.{digits[decpt:]}"
+    return sign + digits + "0" * (decpt - n)
+
+
+def format_string(value):
+    # The stdlib encoder escapes exactly jq's set except DEL.
+    return encode_basestring(value).replace("\x7f", "\\u007f")
+
+
+def iter_dump(doc, indent=2, level=0):
+    """Yield the jq rendering of doc in small pieces (no trailing newline)."""
+    if isinstance(doc, str):
+        yield format_string(doc)
+    elif doc is None:
+        yield "null"
+    elif doc is True:
+        yield "true"
+    elif doc is False:
+        yield "false"
+    elif isinstance(doc, Number):
+        yield format_literal(doc.literal)
+    elif isinstance(doc, int):
+        yield str(doc)
+    elif isinstance(doc, float):
+        yield format_number(doc)
+    elif isinstance(doc, dict):
+        if not doc:
+            yield "{}"
+            return
+        inner = "\n" + " " * (indent * (level + 1))
+        sep = "{" + inner
+        for key, value in doc.items():
+            yield sep + format_string(key) + ": "
+            yield from iter_dump(value, indent, level + 1)
+            sep = "," + inner
+        yield "\n" + " " * (indent * level) + "}"
+    elif isinstance(doc, list):
+        if not doc:
+            yield "[]"
+            return
+        inner = "\n" + " " * (indent * (level + 1))
+        sep = "[" + inner
+        for value in doc:
+            yield sep
+            yield from iter_dump(value, indent, level + 1)
+            sep = "," + inner
+        yield "\n" + " " * (indent * level) + "]"
+    else:
+        raise TypeError(f"not JSON serializable: {type(doc).__name__}")
+
+
+def dump(doc, fh):
+    """Write doc to the text file fh exactly as `jq .` would, streaming."""
+    buf, size = [], 0
+    for piece in iter_dump(doc):
+        buf.append(piece)
+        size += len(piece)
+        if size >= _CHUNK:
+            fh.write("".join(buf))
+            buf, size = [], 0
+    buf.append("\n")
+    fh.write("".join(buf))
+
+
+def dumps(doc):
+    return "".join(iter_dump(doc)) + "\n"
+
+
+def _historical_blobs(path, cwd=None):
+    """Distinct blob ids of every committed version of path, oldest first."""
+    out = subprocess.run(
+        ["git", "log", "--reverse", "--format=", "--raw", "--no-abbrev",
+         "--no-renames", "--", path],
+        cwd=cwd, check=True, capture_output=True, text=True).stdout
+    seen, blobs = set(), []
+    for line in out.splitlines():
+        fields = line.split()
+        # :old_mode new_mode old_sha new_sha status  path
+        if len(fields) >= 5 and fields[4] != "D" and fields[3] not in seen:
+            seen.add(fields[3])
+            blobs.append(fields[3])
+    return blobs
+
+
+def verify_history(paths=SNAPSHOTS, cwd=None):
+    """Re-format every committed version of paths; return the mismatches.
+
+    Versions that are not valid JSON (or were never jq output) are reported
+    too, as (path, blob, reason).
+    """
+    mismatches = []
+    batch = subprocess.Popen(["git", "cat-file", "--batch"], cwd=cwd,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for path in paths:
+            blobs = _historical_blobs(path, cwd=cwd)
+            for blob in blobs:
+                batch.stdin.write(f"{blob}\n".encode())
+                batch.stdin.flush()
+                size = int(batch.stdout.readline().split()[2])
+                raw = batch.stdout.read(size + 1)[:-1]
+                try:
+                    text = raw.decode("utf-8")
+                    ok = dumps(loads(text)) == text
+                    reason = "formatting differs"
+                except ValueError as e:
+                    ok, reason = False, f"unparseable: {e}"
+                if not ok:
+                    mismatches.append((path, blob, reason))
+            print(f"{path}: {len(blobs)} versions checked")
+    finally:
+        batch.stdin.close()
+        batch.wait()
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="jq-compatible JSON formatter.")
+    parser.add_argument("--verify-history", action="store_true",
+                        help="check every committed snapshot version round-trips")
+    parser.add_argument("paths", nargs="*")
+    args = parser.parse_args(argv)
+
+    if args.verify_history:
+        mismatches = verify_history(args.paths or SNAPSHOTS)
+        for path, blob, reason in mismatches:
+            print(f"MISMATCH {path} {blob}: {reason}")
+        return 1 if mismatches else 0
+
+    dump(load(sys.stdin), sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
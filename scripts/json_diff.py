@@ -0,0 +1,108 @@
+"""Structural comparison of two parsed snapshots (stdlib only).
+
+Replaces the line-based `git diff` heuristic: records are matched by id in
+one linear pass and compared field by field, so the result says exactly
+which records were added, removed or updated (and which fields changed),
+and whether the only difference is the top-level updatedAt. Values compare
+strictly: true is not 1, and numbers compare by value (1.0 == 1), so pure
+re-formatting is not a change.
+
+The formatter takes the Changes directly (see format_changes.summarize)
+instead of diffing the same rows again.
+"""
+
+import collections
+
+# top_level: sorted top-level keys (other than the records) that differ.
+# added / removed: records only in new / old.
+# updated: (old, new, fields) for records in both whose values differ, fields
+# being the sorted names of the keys that differ.
+Changes = collections.namedtuple(
+    "Changes", "changed only_updatedat top_level added removed updated")
+
+_MISSING = object()
+_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+def same(a, b):
+    """Strict JSON equality: like ==, but booleans never equal numbers."""
+    ta, tb = type(a), type(b)
+    if ta is not tb:
+        if ta is bool or tb is bool:
+            return False
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return a == b
+        return False
+    if ta is dict:
+        if a.keys() != b.keys():
+            return False
+        for k, v in a.items():
+            w = b[k]
+            # Inline the common scalar case; this runs for every field.
+            if type(v) is type(w) and type(v) in _SCALARS:
+                if v != w:
+                    return False
+            elif not same(v, w):
+                return False
+        return True
+    if ta is list:
+        return len(a) == len(b) and all(map(same, a, b))
+    return a == b
+
+
+def _split(doc):
+    """(records, rest): the record list and the other top-level members."""
+    if isinstance(doc, list):
+        return doc, {}
+    if isinstance(doc, dict) and isinstance(doc.get("rows"), list):
+        return doc["rows"], {k: v for k, v in doc.items() if k != "rows"}
+    return [], {"": doc}
+
+
+def _index(records, key):
+    by_key, unkeyed = {}, []
+    for r in records:
+        k = r.get(key) if isinstance(r, dict) else None
+        if k is None:
+            unkeyed.append(r)
+        else:
+            by_key[k] = r
+    return by_key, unkeyed
+
+
+def changed_fields(old, new):
+    keys = old.keys() | new.keys()
+    return sorted(k for k in keys
+                  if not same(old.get(k, _MISSING), new.get(k, _MISSING)))
+
+
+def compare(old, new, key="id"):
+    """Compare two parsed snapshots (a {"rows": [...]} envelope or a bare
+    list); old None means there is no previous snapshot."""
+    if old is None:
+        records, _ = _split(new)
+        return Changes(True, False, [], list(records), [], [])
+
+    old_records, old_rest = _split(old)
+    new_records, new_rest = _split(new)
+    top_level = sorted(k for k in old_rest.keys() | new_rest.keys()
+                       if not same(old_rest.get(k, _MISSING),
+                                   new_rest.get(k, _MISSING)))
+
+    old_by, old_unkeyed = _index(old_records, key)
+    new_by, new_unkeyed = _index(new_records, key)
+    if not same(old_unkeyed, new_unkeyed):
+        # Records without an id can't be matched; flag them as a whole.
+        top_level.append("rows")
+    added = [r for k, r in new_by.items() if k not in old_by]
+    removed = [r for k, r in old_by.items() if k not in new_by]
+    updated = []
+    for k, n in new_by.items():
+        o = old_by.get(k)
+        if o is not None and not same(o, n):
+            updated.append((o, n, changed_fields(o, n)))
+
+    changed = bool(top_level or added or removed or updated)
+    only_updatedat = (top_level == ["updatedAt"]
+                      and not (added or removed or updated))
+    return Changes(changed, only_updatedat, top_level, added, removed, updated)
@@ -0,0 +1,262 @@
+"""Prometheus text-format metrics for pipeline runs (stdlib only).
+
+Counters, gauges and histograms are collected in memory and written out by
+flush() at the end of each process:
+
+- METRICS_TEXTFILE_DIR: written to <dir>/<METRICS_JOB>.prom for the
+  node-exporter textfile collector. Counters and histograms are added to the
+  totals already in the file, so they keep increasing across runs (and across
+  the pipeline and its compare_airports.py child, which share the file under
+  a lock); gauges are overwritten.
+- METRICS_PUSHGATEWAY_URL: the same text is POSTed to
+  <url>/metrics/job/<METRICS_JOB>.
+
+Every series carries a job_name label (METRICS_JOB, default "skycards") so
+files from several CronJobs can sit in one collector directory. Nothing is
+written when neither variable is set.
+"""
+
+import contextlib
+import fcntl
+import os
+import re
+import threading
+import time
+import urllib.request
+
+TEXTFILE_DIR_ENV = "METRICS_TEXTFILE_DIR"
+PUSHGATEWAY_ENV = "METRICS_PUSHGATEWAY_URL"
+JOB_ENV = "METRICS_JOB"
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "skycards_runs_total": (
+        "counter", "Runs by command and result (success, unchanged, "
+        "failure).", None),
+    "skycards_run_duration_seconds": (
+        "histogram", "Wall time of a run.", LATENCY_BUCKETS),
+    "skycards_last_run_timestamp_seconds": (
+        "gauge", "Unix time the last run finished.", None),
+    "skycards_last_success_timestamp_seconds": (
+        "gauge", "Unix time the last successful (or unchanged) run finished.",
+        None),
+    "skycards_fetch_duration_seconds": (
+        "histogram", "Upstream API download latency.", LATENCY_BUCKETS),
+    "skycards_fetch_response_bytes": (
+        "histogram", "Upstream API body size.", SIZE_BUCKETS),
+    "skycards_fetches_total": (
+        "counter", "Upstream fetches by outcome (upstream_unchanged, unchanged, "
+        "only_updatedat, changed, error).", None),
+    "skycards_push_attempts_total": (
+        "counter", "git push attempts made by push_with_retry.", None),
+    "skycards_push_failures_total": (
+        "counter", "Pushes that failed after every retry, or gave up "
+        "waiting for the push lease.", None),
+    "skycards_push_wait_seconds": (
+        "histogram", "Time a push attempt waited for the push lease or its "
+        "backoff.", LATENCY_BUCKETS),
+    "skycards_fr24_pages_total": (
+        "counter", "Flightradar24 pages by result (ok, or the kind of the "
+        "last failure: permanent, throttled, challenge, transient, deadline).",
+        None),
+    "skycards_fr24_page_retries_total": (
+        "counter", "Flightradar24 page fetch retries.", None),
+    "skycards_fr24_cache_total": (
+        "counter", "Flightradar24 page cache lookups by result (hit, "
+        "revalidated, miss, not_found).", None),
+    "skycards_webhook_post_duration_seconds": (
+        "histogram", "Discord webhook post latency per subscriber.",
+        LATENCY_BUCKETS),
+    "skycards_webhook_posts_total": (
+        "counter", "Discord webhook posts per subscriber and HTTP status.", None),
+}
+
+_SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$")
+_LE = re.compile(r',?le="([^"]*)"')
+_lock = threading.Lock()
+# family name -> {series ("name{labels}") -> value}
+_samples = {}
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _series(name, labels):
+    labels = dict(labels, job_name=os.environ.get(JOB_ENV) or "skycards")
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{body}}}"
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _add(family, series, amount):
+    values = _samples.setdefault(family, {})
+    values[series] = values.get(series, 0) + amount
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        _add(name, _series(name, labels), amount)
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _samples.setdefault(name, {})[_series(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    buckets = METRICS[name][2]
+    with _lock:
+        for le in buckets:
+            # Buckets are cumulative; empty ones are still materialized.
+            _add(name, _series(f"{name}_bucket",
+                               dict(labels, le=_format_value(le))),
+                 1 if value <= le else 0)
+        _add(name, _series(f"{name}_bucket", dict(labels, le="+Inf")), 1)
+        _add(name, _series(f"{name}_sum", labels), value)
+        _add(name, _series(f"{name}_count", labels), 1)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """Observe the enclosed block's wall time in the histogram name."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+
+@contextlib.contextmanager
+def run(command, unchanged_code=None):
+    """Record one run of command (outcome, duration, timestamps), then flush.
+
+    SystemExit(0) counts as success, SystemExit(unchanged_code) as a healthy
+    run that had nothing to do ("unchanged"); any other exit or exception as
+    failure.
+    """
+    t0 = time.perf_counter()
+    result = "failure"
+    try:
+        yield
+        result = "success"
+    except SystemExit as e:
+        if not e.code:
+            result = "success"
+        elif unchanged_code is not None and e.code == unchanged_code:
+            result = "unchanged"
+        raise
+    finally:
+        now = time.time()
+        inc("skycards_runs_total", command=command, result=result)
+        observe("skycards_run_duration_seconds", time.perf_counter() - t0,
+                command=command)
+        set_gauge("skycards_last_run_timestamp_seconds", now, command=command)
+        if result != "failure":
+            set_gauge("skycards_last_success_timestamp_seconds", now,
+                      command=command)
+        flush()
+
+
+def parse(text):
+    """Parse exposition text written by render() into {family: {series: value}}."""
+    families, family = {}, None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+            continue
+        match = _SAMPLE.match(line)
+        if family and match:
+            series = match.group(1) + (match.group(2) or "")
+            families.setdefault(family, {})[series] = float(match.group(3))
+    return families
+
+
+def merge(previous, current):
+    """Fold this process's samples into the totals from an earlier flush."""
+    merged = {family: dict(values) for family, values in previous.items()}
+    for family, values in current.items():
+        kind = METRICS.get(family, ("gauge",))[0]
+        target = merged.setdefault(family, {})
+        for series, value in values.items():
+            if kind == "gauge":
+                target[series] = value
+            else:
+                target[series] = target.get(series, 0) + value
+    return merged
+
+
+def _sort_key(series):
+    # Histogram buckets in ascending le order, +Inf last.
+    match = _LE.search(series)
+    if not match:
+        return series, 0.0
+    return series[:match.start()] + series[match.end():], float(match.group(1))
+
+
+def render(families):
+    lines = []
+    for family in sorted(families):
+        kind, help_text, _ = METRICS.get(family, ("untyped", "", None))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for series in sorted(families[family], key=_sort_key):
+            lines.append(f"{series} {_format_value(families[family][series])}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+def flush():
+    """Write collected samples to the textfile and/or push gateway."""
+    textfile_dir = os.environ.get(TEXTFILE_DIR_ENV)
+    gateway = os.environ.get(PUSHGATEWAY_ENV)
+    with _lock:
+        current = {family: dict(values) for family, values in _samples.items()}
+        _samples.clear()
+    if not current or not (textfile_dir or gateway):
+        return
+    job = os.environ.get(JOB_ENV) or "skycards"
+    text = render(current)
+    if textfile_dir:
+        text = _write_textfile(textfile_dir, job, current)
+    if gateway:
+        try:
+            req = urllib.request.Request(
+                f"{gateway.rstrip('/')}/metrics/job/{job}", data=text.encode(),
+                method="POST",
+                headers={"Content-Type": "text/plain; version=0.0.4"})
+            urllib.request.urlopen(req, timeout=10).close()
+        except OSError as e:
+            print(f"Could not push metrics to {gateway}: {e}")
+
+
+def _write_textfile(textfile_dir, job, current):
+    os.makedirs(textfile_dir, exist_ok=True)
+    path = os.path.join(textfile_dir, f"{job}.prom")
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                previous = parse(fh.read())
+        except FileNotFoundError:
+            previous = {}
+        text = render(merge(previous, current))
+        # The collector must never see a half-written file.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(text)
+        os.replace(tmp, path)
+    return text
@@ -4,32 +4,62 @@
 Subcommands:
   fetch    Fetch one API, diff vs main, commit + push, send Discord webhooks.
            With --compare-after, runs the airport comparison afterward.
-  compare  Run the airport comparison and publish its changes.
+  fetch-all
+           Fetch every configured source concurrently on one clone, commit
+           each separately and push once.
+  compare  Run the airport comparison and publish its changes. With
+           --shard I/N, compare only shard I's countries and hand the partial
+           result over through origin; the last shard to finish merges them
+           and publishes once.
+  daemon   Stay up and run the fetches and comparison on cron schedules,
+           keeping the session, working copy and parsed snapshots warm;
+           serves /healthz.
+
+Set REPO_CACHE_DIR to a mounted volume to keep one warm working copy across
+runs instead of cloning fresh each time, and SPARSE_WORKTREE=1 to check out
+nothing but the files a run updates (see git_sync). Set TRACE_FILE to record each phase
+as a span (see tracing.py), and METRICS_TEXTFILE_DIR / METRICS_PUSHGATEWAY_URL
+to export Prometheus metrics for each run (see metrics.py).
 """
 
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import http.server
+import json
 import os
 import re
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 
+import cron
 import discord_notify as dn
+import format_changes as fc
 import git_sync as gs
+import jq_format
+import json_diff
+import metrics
 import requests
+import tracing
 
 # Kept byte-identical to the previous curl-based requests so the upstream API
 # sees no behavior change.
 HEADERS = {"User-Agent": "GitHub-Actions/1.0", "X-Client-Version": "3.0.0"}
 
 
-def format_json(raw_text, path):
-    """Pretty-print JSON via `jq '.'` — byte-identical to the historical
-    curl|jq commits, so no first-run reformatting diff."""
-    with open(path, "w", encoding="utf-8") as fh:
-        subprocess.run(["jq", "."], input=raw_text, stdout=fh, check=True,
-                       text=True)
+def format_json(doc, path):
+    """Pretty-print a parsed document exactly as `jq '.'` did for the
+    historical curl|jq commits (see jq_format), streaming it to path."""
+    with open(path, "w", encoding="utf-8") as fh, tracing.span("fetch.format"):
+        jq_format.dump(doc, fh)
 
 
 def determine_timestamp(timestamp_url, session=None):
@@ -48,118 +78,514 @@ def routing_key(data_name, is_misc):
     return "misc" if is_misc else data_name
 
 
-def fetch_api(api_url, timestamp_param, timestamp, session):
-    resp = session.get(api_url, params={timestamp_param: timestamp},
-                       headers=HEADERS)
-    return resp.text
+DOWNLOAD_CHUNK = 1 << 16
+
+# Top-level shape each endpoint serves: a {"rows": [...]} envelope, or a bare
+# list (airlines).
+PAYLOAD_SHAPE = {"airports": "rows", "models": "rows", "airlines": "list"}
+
+
+def fetch_api(api_url, timestamp_param, timestamp, session, dest,
+              validators=None):
+    """Stream the raw API body into the file dest; returns (fetched, validators).
+
+    The body goes to disk chunk by chunk and is hashed as it arrives, so
+    memory stays flat however large the payload grows. HTTP errors, HTML
+    error pages and truncated bodies are rejected before anything is parsed.
+    With validators saved by an earlier run the request is conditional
+    (If-None-Match / If-Modified-Since), and fetched is False when the
+    upstream answers 304 or the body hashes the same as last time, so callers
+    can stop right after the download.
+    """
+    validators = validators or {}
+    headers = dict(HEADERS)
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    with tracing.span("fetch.download", url=api_url) as sp:
+        resp = session.get(api_url, params={timestamp_param: timestamp},
+                           headers=headers, stream=True)
+        sp.set(status=resp.status_code)
+        return _stream_body(api_url, resp, dest, validators, sp)
+
+
+def _stream_body(api_url, resp, dest, validators, sp):
+    try:
+        if resp.status_code == 304:
+            return False, validators
+        resp.raise_for_status()
+        if "html" in resp.headers.get("Content-Type", "").lower():
+            raise ValueError(f"{api_url} returned HTML, not JSON")
+        digest, size = hashlib.sha256(), 0
+        with open(dest, "wb") as fh:
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK):
+                if not size and chunk.lstrip()[:1] not in (b"{", b"["):
+                    raise ValueError(f"{api_url} returned a non-JSON body: "
+                                     f"{chunk[:40]!r}")
+                digest.update(chunk)
+                fh.write(chunk)
+                size += len(chunk)
+                sp.add("bytes", len(chunk))
+        expected = resp.headers.get("Content-Length")
+        if (expected and "Content-Encoding" not in resp.headers
+                and int(expected) != size):
+            raise ValueError(f"{api_url} body truncated: {size}/{expected} bytes")
+    finally:
+        resp.close()
+    fresh = {
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "sha256": digest.hexdigest(),
+    }
+    return fresh["sha256"] != validators.get("sha256"), fresh
+
+
+def load_payload(path, data_name):
+    """Parse a downloaded body, checking it has the shape the source serves."""
+    with open(path, encoding="utf-8") as fh, tracing.span("fetch.parse"):
+        try:
+            doc = jq_format.load(fh)
+        except ValueError as e:
+            raise ValueError(f"{data_name} response is not valid JSON: {e}")
+    if PAYLOAD_SHAPE.get(data_name) == "list":
+        ok = isinstance(doc, list)
+    else:
+        ok = isinstance(doc, dict) and isinstance(doc.get("rows"), list)
+    if not ok:
+        raise ValueError(f"{data_name} response has an unexpected shape")
+    return doc
+
+
+def _validators_path(state_dir, data_name, pending=False):
+    suffix = ".pending.json" if pending else ".json"
+    return os.path.join(state_dir, f"{data_name}{suffix}")
+
+
+def load_validators(state_dir, data_name, pending=False):
+    try:
+        with open(_validators_path(state_dir, data_name, pending),
+                  encoding="utf-8") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_validators(state_dir, data_name, validators, pending=False):
+    os.makedirs(state_dir, exist_ok=True)
+    path = _validators_path(state_dir, data_name, pending)
+    with open(path + ".tmp", "w", encoding="utf-8") as fh:
+        json.dump(validators, fh)
+    os.replace(path + ".tmp", path)
 
 
 SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
-FORMAT_CHANGES = os.path.join(SCRIPTS_DIR, "format_changes.py")
 COMPARE_SCRIPT = os.path.join(SCRIPTS_DIR, "..", "compare_airports.py")
 
 
+# Stands in for the commit link in summaries built before the push.
+COMMIT_PLACEHOLDER = "__COMMIT_URL__"
+
+
 def _utc_stamp():
     return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime())
 
 
-def _read(path):
+def _parse(text):
+    """Parse a snapshot; None for a missing/empty one (e.g. the first run)."""
+    return json.loads(text) if text.strip() else None
+
+
+# How many parsed snapshots the daemon keeps warm between ticks: each
+# source's HEAD and previous snapshot, plus the comparison's.
+SNAPSHOT_CACHE_SIZE = 8
+
+
+def load_snapshot(workdir, ref, path, snapshots=None):
+    """Parse path as committed at ref (None if absent).
+
+    snapshots, when given, is an OrderedDict keyed by (path, blob id) that
+    outlives the call (the daemon's); a blob already in it is not re-read.
+    """
+    return load_snapshots(workdir, ref, [path], snapshots)[0]
+
+
+def load_snapshots(workdir, ref, paths, snapshots=None):
+    """load_snapshot for several paths at one ref; the blobs not already in
+    snapshots are read together (one fetch in a partial clone)."""
+    if snapshots is None:
+        return [_parse(text) for text in gs.read_files(ref, paths, cwd=workdir)]
+    blobs = {path: gs.blob_id(ref, path, cwd=workdir) for path in paths}
+    docs = {}
+    for path, blob in blobs.items():
+        if blob and (path, blob) in snapshots:
+            snapshots.move_to_end((path, blob))
+            docs[path] = snapshots[(path, blob)]
+    todo = [path for path, blob in blobs.items() if blob and path not in docs]
+    for path, text in zip(todo, gs.read_files(ref, todo, cwd=workdir) if todo else []):
+        docs[path] = _parse(text)
+        remember_snapshot(snapshots, path, blobs[path], docs[path])
+    return [docs.get(path) for path in paths]
+
+
+def remember_snapshot(snapshots, path, blob, doc):
+    snapshots[(path, blob)] = doc
+    snapshots.move_to_end((path, blob))
+    while len(snapshots) > SNAPSHOT_CACHE_SIZE:
+        snapshots.popitem(last=False)
+
+
+def _load(path):
     try:
         with open(path, encoding="utf-8") as fh:
-            return fh.read()
+            return _parse(fh.read())
     except FileNotFoundError:
-        return ""
-
-
-def run_fetch(args, workdir, session):
+        return None
+
+
+# old and changes are the parsed HEAD snapshot and the json_diff.Changes
+# against it, handed on so the formatter never re-reads or re-diffs them.
+Fetched = collections.namedtuple("Fetched", "only_updatedat doc old changes",
+                                 defaults=(None, None))
+
+
+def fetch_source(args, workdir, session, state_dir=None, snapshots=None):
+    """Fetch and format one source into the working copy.
+
+    Returns None when the data is unchanged, else a Fetched carrying whether
+    only updatedAt moved, the parsed new and HEAD documents and the
+    structural json_diff.Changes between them. With state_dir,
+    upstream validators from the last run make the fetch conditional; the new
+    ones are parked as pending until remember_source() records them against
+    the pushed snapshot.
+    """
+    with tracing.span("fetch", source=args.data_name) as sp:
+        try:
+            fetched = _fetch_source(args, workdir, session, state_dir,
+                                    snapshots)
+        except Exception:
+            metrics.inc("skycards_fetches_total", source=args.data_name,
+                        outcome="error")
+            raise
+        sp.set(changed=fetched is not None,
+               only_updatedat=bool(fetched and fetched.only_updatedat))
+        return fetched
+
+
+def _fetch_source(args, workdir, session, state_dir, snapshots):
     out_path = os.path.join(workdir, args.output_file)
+    cached = {}
+    if state_dir:
+        cached = load_validators(state_dir, args.data_name)
+        # Only trust them while HEAD still holds the snapshot they describe.
+        if cached.get("blob") != gs.blob_id("HEAD", args.output_file, cwd=workdir):
+            cached = {}
     timestamp = determine_timestamp(args.timestamp_url or None, session)
     print(f"Fetching {args.data_name} from {args.api_url} "
           f"({args.timestamp_param}={timestamp})")
-    format_json(fetch_api(args.api_url, args.timestamp_param, timestamp, session),
-                out_path)
-
-    changed, only_updatedat = gs.detect_changes(args.output_file, cwd=workdir)
-    if not changed:
+    fd, raw_path = tempfile.mkstemp(prefix=f"{args.data_name}-", suffix=".raw")
+    os.close(fd)
+    try:
+        with metrics.timer("skycards_fetch_duration_seconds",
+                           source=args.data_name):
+            fetched, validators = fetch_api(args.api_url, args.timestamp_param,
+                                            timestamp, session, raw_path,
+                                            validators=cached)
+        metrics.observe("skycards_fetch_response_bytes",
+                        os.path.getsize(raw_path), source=args.data_name)
+        if not fetched:
+            print(f"Upstream {args.data_name} unchanged since last run.")
+            metrics.inc("skycards_fetches_total", source=args.data_name,
+                        outcome="upstream_unchanged")
+            if state_dir and validators is not cached:
+                save_validators(state_dir, args.data_name,
+                                dict(validators, blob=cached["blob"]))
+            return None
+        doc = load_payload(raw_path, args.data_name)
+    finally:
+        os.remove(raw_path)
+    if state_dir:
+        save_validators(state_dir, args.data_name, validators, pending=True)
+    format_json(doc, out_path)
+
+    changes = None
+    if gs.file_changed(args.output_file, cwd=workdir):
+        old = load_snapshot(workdir, "HEAD", args.output_file, snapshots)
+        with tracing.span("fetch.compare") as sp:
+            changes = json_diff.compare(old, doc)
+            sp.set(added=len(changes.added), removed=len(changes.removed),
+                   updated=len(changes.updated))
+        if not changes.changed:
+            # Same data in different bytes (e.g. key order): keep HEAD's copy.
+            gs.restore_file(args.output_file, cwd=workdir)
+    if changes is None or not changes.changed:
         print(f"No changes for {args.data_name}.")
+        metrics.inc("skycards_fetches_total", source=args.data_name,
+                    outcome="unchanged")
+        remember_source(args, workdir, state_dir)
+        return None
+    metrics.inc("skycards_fetches_total", source=args.data_name,
+                outcome="only_updatedat" if changes.only_updatedat else "changed")
+    return Fetched(changes.only_updatedat, doc, old, changes)
+
+
+def remember_source(args, workdir, state_dir):
+    """Promote pending validators once HEAD holds the snapshot they describe."""
+    if not state_dir:
         return
+    validators = load_validators(state_dir, args.data_name, pending=True)
+    if not validators:
+        return
+    validators["blob"] = gs.blob_id("HEAD", args.output_file, cwd=workdir)
+    save_validators(state_dir, args.data_name, validators)
+    os.remove(_validators_path(state_dir, args.data_name, pending=True))
+
+
+def summarize_source(args, workdir, fetched, snapshots=None):
+    """Summarize a changed source in-process; None if only updatedAt moved.
 
-    msg_file = os.path.join(tempfile.gettempdir(), "webhook_message.md")
-    meta_file = os.path.join(tempfile.gettempdir(), "webhook_meta.txt")
-    caption_file = os.path.join(tempfile.gettempdir(), "webhook_caption.txt")
-    tldr = ""
-    if not only_updatedat:
-        prev = os.path.join(tempfile.gettempdir(), "previous.json")
-        with open(prev, "w", encoding="utf-8") as fh:
-            fh.write(gs.show_file("HEAD", args.output_file, cwd=workdir))
-        tldr = subprocess.run(
-            [sys.executable, FORMAT_CHANGES, "--type", args.data_name,
-             "--old", prev, "--new", out_path, "--link", "__COMMIT_URL__",
-             "--out", msg_file, "--meta-out", meta_file,
-             "--caption-out", caption_file],
-            cwd=workdir, check=True, capture_output=True, text=True).stdout.strip()
-
-    body = tldr or None
+    The message links to a placeholder until the pushed commit is known.
+    """
+    if fetched.only_updatedat:
+        return None
+    with tracing.span("summarize", source=args.data_name):
+        if fetched.changes is not None:
+            old = fetched.old
+        else:
+            old = load_snapshot(workdir, "HEAD", args.output_file, snapshots)
+        return fc.summarize(args.data_name, old, fetched.doc, COMMIT_PLACEHOLDER,
+                            changes=fetched.changes)
+
+
+def commit_source(args, workdir, summary):
     gs.commit([args.output_file],
               f"chore({args.data_name}): update data - {_utc_stamp()}",
-              body=body, cwd=workdir)
-    gs.push_with_retry(cwd=workdir)
+              body=summary.tldr if summary else None, cwd=workdir)
 
-    if only_updatedat:
-        print("Only updatedAt changed - skipping webhooks.")
-        return
 
-    link = gs.COMMIT_URL.format(sha=gs.head_sha(cwd=workdir))
-    _substitute(msg_file, "__COMMIT_URL__", link)
-    is_misc = _read(meta_file).strip() == "true"
-    dn.send_discord(msg_file, tldr=tldr, caption=_read(caption_file),
-                    link=link, username="Skycards",
-                    routing_key=routing_key(args.data_name, is_misc),
+def notify_source(args, workdir, summary, session):
+    if summary is None:
+        print(f"Only updatedAt changed for {args.data_name} - skipping webhooks.")
+        return
+    # Resolved after the push: a rebase onto a concurrent push rewrites shas.
+    sha = gs.last_commit_touching(args.output_file, cwd=workdir)
+    link = gs.COMMIT_URL.format(sha=sha)
+    dn.send_message(summary.message.replace(COMMIT_PLACEHOLDER, link),
+                    tldr=summary.tldr, caption=summary.caption, link=link,
+                    username="Skycards",
+                    routing_key=routing_key(args.data_name, summary.is_misc),
                     session=session)
 
 
-def run_compare(workdir, session):
-    out = "airport_differences.json"
-    subprocess.run([sys.executable, os.path.abspath(COMPARE_SCRIPT)],
-                   cwd=workdir, check=True)
-    changed, _ = gs.detect_changes(out, cwd=workdir)
-    if not changed:
+def run_fetch(args, workdir, session, state_dir=None, snapshots=None):
+    """Fetch, publish and announce one source; returns its parsed document
+    when it changed, else None."""
+    fetched = fetch_source(args, workdir, session, state_dir, snapshots)
+    if fetched is None:
+        return None
+    summary = summarize_source(args, workdir, fetched, snapshots)
+    commit_source(args, workdir, summary)
+    gs.push_with_retry(cwd=workdir)
+    remember_source(args, workdir, state_dir)
+    if snapshots is not None:
+        remember_snapshot(snapshots, args.output_file,
+                          gs.blob_id("HEAD", args.output_file, cwd=workdir),
+                          fetched.doc)
+    notify_source(args, workdir, summary, session)
+    return fetched.doc
+
+
+# Mirrors the per-source CronJob arguments in deploy/ for `fetch-all`.
+SOURCES = {
+    "airports": {
+        "api_url": "https://api.skycards.oldapes.com/airports",
+        "output_file": "airports.json",
+        "timestamp_param": "updatedAt",
+        "timestamp_url": "",
+    },
+    "models": {
+        "api_url": "https://api.skycards.oldapes.com/models",
+        "output_file": "models.json",
+        "timestamp_param": "updatedAt",
+        "timestamp_url": "",
+    },
+    "airlines": {
+        "api_url": "https://api.skycards.oldapes.com/airlines",
+        "output_file": "airlines.json",
+        "timestamp_param": "timestamp",
+        "timestamp_url": "https://api.skycards.oldapes.com/airlines/timestamp",
+    },
+}
+
+
+def source_args(data_name):
+    return argparse.Namespace(data_name=data_name, **SOURCES[data_name])
+
+
+def run_fetch_all(names, workdir, session, state_dir=None):
+    """Fetch several sources on one clone and session, then push once.
+
+    Fetching and summarizing run concurrently; commits stay one per source so
+    history and webhook links look exactly like the single-source jobs. A
+    failing source is restored to HEAD and skipped so the others still
+    publish. Returns (names of failed sources, {name: parsed document} for
+    the sources that changed).
+    """
+    sources = [source_args(name) for name in names]
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        # Each task gets its own copy of the context so its spans nest under
+        # the caller's span.
+        pending = {a.data_name: pool.submit(tracing.propagate(fetch_source), a,
+                                            workdir, session, state_dir)
+                   for a in sources}
+        changed = []
+        for a in sources:
+            try:
+                fetched = pending[a.data_name].result()
+            except Exception as e:
+                print(f"Fetching {a.data_name} failed: {e}")
+                failures.append(a.data_name)
+                gs.restore_file(a.output_file, cwd=workdir)
+                continue
+            if fetched is not None:
+                changed.append((a, fetched))
+        summaries = {a.data_name: pool.submit(tracing.propagate(summarize_source),
+                                              a, workdir, f)
+                     for a, f in changed}
+
+    published = []
+    for a, fetched in changed:
+        try:
+            summary = summaries[a.data_name].result()
+        except Exception as e:
+            print(f"Summarizing {a.data_name} failed: {e}")
+            failures.append(a.data_name)
+            gs.restore_file(a.output_file, cwd=workdir)
+            continue
+        commit_source(a, workdir, summary)
+        published.append((a, fetched, summary))
+
+    if published:
+        gs.push_with_retry(cwd=workdir)
+    for a, _, _ in published:
+        remember_source(a, workdir, state_dir)
+    for a, _, summary in published:
+        notify_source(a, workdir, summary, session)
+    return failures, {a.data_name: f.doc for a, f, _ in published}
+
+
+COMPARE_OUTPUT = "airport_differences.json"
+# compare_airports.EXIT_UNCHANGED: neither side moved since the last clean
+# comparison, so there is nothing to publish.
+COMPARE_UNCHANGED = 3
+
+
+def run_compare(workdir, session, airports=None, snapshots=None, shard=None,
+                run_id=None):
+    """Run the comparison and publish it; airports is the already-parsed
+    airports.json when the caller has it at hand. shard is (index, count)
+    for one pod of a sharded run named run_id."""
+    with tracing.span("compare"):
+        if shard:
+            _run_compare_shard(workdir, session, shard, run_id)
+        else:
+            _run_compare(workdir, session, airports, snapshots)
+
+
+def _compare_script(workdir, *args):
+    """Run compare_airports.py; returns its exit status (0 or COMPARE_UNCHANGED)."""
+    res = subprocess.run([sys.executable, os.path.abspath(COMPARE_SCRIPT), *args],
+                         cwd=workdir, env=tracing.child_env())
+    if res.returncode not in (0, COMPARE_UNCHANGED):
+        raise subprocess.CalledProcessError(res.returncode, res.args)
+    return res.returncode
+
+
+def _run_compare(workdir, session, airports, snapshots):
+    # The script reads both from disk; a sparse copy has neither checked out.
+    gs.checkout_files(["airports.json", COMPARE_OUTPUT], cwd=workdir)
+    with tracing.span("compare.scrape") as sp:
+        # --resume: a run cut off by the deadline or an eviction left a
+        # checkpoint on the cache volume; pick up from it.
+        status = _compare_script(workdir, "--resume")
+        sp.set(unchanged=status == COMPARE_UNCHANGED)
+    if status == COMPARE_UNCHANGED:
+        print("FR24 and our airports unchanged since the last comparison.")
+        return
+    _publish_comparison(workdir, session, airports, snapshots)
+
+
+def _run_compare_shard(workdir, session, shard, run_id):
+    """Compare one shard's countries and push the partial result to a shard
+    ref (see git_sync.SHARD_REF); whichever shard finds all of them there
+    claims, merges and publishes them."""
+    index, count = shard
+    gs.checkout_files(["airports.json", COMPARE_OUTPUT], cwd=workdir)
+    with tempfile.TemporaryDirectory() as tmp:
+        partial = os.path.join(tmp, "partial.json")
+        with tracing.span("compare.scrape", shard=index):
+            _compare_script(workdir, "--resume", "--shard", f"{index}/{count}",
+                            "--output", partial)
+        with open(partial, encoding="utf-8") as fh:
+            gs.push_shard(run_id, index, fh.read(), cwd=workdir)
+        with tracing.span("compare.claim"):
+            parts = gs.claim_shards(run_id, count, cwd=workdir)
+        if parts is None:
+            print(f"Shard {index}/{count} of {run_id} pushed; "
+                  "the last shard to finish publishes.")
+            return
+        paths = []
+        for i, text in enumerate(parts):
+            paths.append(os.path.join(tmp, f"shard-{i}.json"))
+            with open(paths[-1], "w", encoding="utf-8") as fh:
+                fh.write(text)
+        _compare_script(workdir, "--merge", *paths)
+    _publish_comparison(workdir, session, None, None)
+
+
+def _publish_comparison(workdir, session, airports, snapshots):
+    out = COMPARE_OUTPUT
+    if not gs.file_changed(out, cwd=workdir):
         print("No changes in airport comparison.")
         return
 
     last = gs.last_commit_touching(out, cwd=workdir)
-    prev_diff = os.path.join(tempfile.gettempdir(), "previous_differences.json")
-    prev_air = os.path.join(tempfile.gettempdir(), "previous_airports.json")
-    for ref_path, dest in ((out, prev_diff), ("airports.json", prev_air)):
-        with open(dest, "w", encoding="utf-8") as fh:
-            fh.write(gs.show_file(last, ref_path, cwd=workdir) if last else "")
-
-    msg_file = os.path.join(tempfile.gettempdir(), "cmp_message.md")
-    tldr = subprocess.run(
-        [sys.executable, FORMAT_CHANGES, "--type", "comparison",
-         "--old", prev_diff, "--new", os.path.join(workdir, out),
-         "--old-airports", prev_air,
-         "--airports", os.path.join(workdir, "airports.json"),
-         "--link", "__COMMIT_URL__", "--out", msg_file],
-        cwd=workdir, check=True, capture_output=True, text=True).stdout.strip()
+    old_diffs = old_airports = None
+    if last:
+        # Both as of the last comparison, in one round trip to the remote.
+        old_diffs, old_airports = load_snapshots(
+            workdir, last, [out, "airports.json"], snapshots)
+    if airports is None and snapshots is not None:
+        airports = load_snapshot(workdir, "HEAD", "airports.json", snapshots)
+    if airports is None:
+        airports = _load(os.path.join(workdir, "airports.json"))
+    summary = fc.summarize("comparison", old_diffs,
+                           _load(os.path.join(workdir, out)),
+                           COMMIT_PLACEHOLDER, old_airports=old_airports,
+                           airports=airports)
 
     gs.commit([out],
               f"chore(comparison): update airport comparison data - {_utc_stamp()}",
-              body=tldr or None, cwd=workdir)
+              body=summary.tldr or None, cwd=workdir)
     gs.push_with_retry(cwd=workdir)
 
     link = gs.COMMIT_URL.format(sha=gs.head_sha(cwd=workdir))
-    _substitute(msg_file, "__COMMIT_URL__", link)
-    dn.send_discord(msg_file, tldr=tldr, link=link,
+    dn.send_message(summary.message.replace(COMMIT_PLACEHOLDER, link),
+                    tldr=summary.tldr, link=link,
                     username="Skycards Airport Comparison",
                     routing_key="comparison", session=session)
 
 
-def _substitute(path, placeholder, value):
-    text = _read(path)
-    if text:
-        with open(path, "w", encoding="utf-8") as fh:
-            fh.write(text.replace(placeholder, value))
+def _shard(value):
+    """argparse type for --shard I/N."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected I/N, got {value!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"expected 0 <= I < N, got {value!r}")
+    return index, count
 
 
 def build_parser():
@@ -175,26 +601,289 @@ def build_parser():
     f.add_argument("--timestamp-url", default="")
     f.add_argument("--compare-after", action="store_true")
 
-    sub.add_parser("compare")
+    fa = sub.add_parser("fetch-all")
+    fa.add_argument("--sources", nargs="+", choices=list(SOURCES),
+                    default=list(SOURCES))
+    fa.add_argument("--compare-after", action="store_true")
+
+    c = sub.add_parser("compare")
+    c.add_argument("--shard", type=_shard, metavar="I/N",
+                   help="compare shard I of N (e.g. an indexed Job's "
+                        "completion index) and merge once all have run")
+    c.add_argument("--run-id", default=os.environ.get("COMPARE_RUN_ID"),
+                   help="names the sharded run; the same for all its shards "
+                        "(default $COMPARE_RUN_ID)")
+
+    d = sub.add_parser("daemon")
+    d.add_argument("--schedule", action="append", default=[],
+                   metavar="JOB=CRON",
+                   help="override a job's schedule ('off' disables it); "
+                        f"jobs: {', '.join(DAEMON_SCHEDULE)}")
+    d.add_argument("--health-port", type=int, default=8080)
     return parser
 
 
+@contextlib.contextmanager
+def working_copy(token, author_name, author_email, cache_dir=None,
+                 sparse=False):
+    """Yield an up-to-date checkout of the data repo.
+
+    With cache_dir (a mounted volume), one working copy is kept there across
+    runs and refreshed incrementally; an exclusive lock keeps overlapping runs
+    from sharing it. Without it, a throwaway partial clone is made. sparse
+    leaves the working tree empty (see git_sync.clone).
+    """
+    if not cache_dir:
+        with tempfile.TemporaryDirectory() as workdir:
+            repo_dir = os.path.join(workdir, "repo")
+            gs.clone(repo_dir, token, author_name=author_name,
+                     author_email=author_email, sparse=sparse)
+            try:
+                yield repo_dir
+            finally:
+                gs.close_reader(repo_dir)
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        repo_dir = os.path.join(cache_dir, "repo")
+        gs.sync(repo_dir, token, author_name=author_name,
+                author_email=author_email, sparse=sparse)
+        try:
+            yield repo_dir
+        finally:
+            gs.close_reader(repo_dir)
+
+
+# Jobs the daemon runs, in the order they run when due in the same minute (so
+# the comparison follows the airports fetch, as --compare-after does). The
+# defaults mirror the CronJobs in deploy/.
+DAEMON_SCHEDULE = {
+    "airports": "*/30 * * * *",
+    "models": "*/30 * * * *",
+    "airlines": "0 9 * * *",
+    "comparison": "*/30 * * * *",
+}
+# /healthz reports the daemon stuck once a job has run this long (the
+# CronJobs' activeDeadlineSeconds).
+DAEMON_STUCK_SECONDS = 600
+
+
+def daemon_schedule(overrides):
+    """DAEMON_SCHEDULE with JOB=CRON overrides applied, parsed to cron.Cron."""
+    schedule = dict(DAEMON_SCHEDULE)
+    for item in overrides:
+        name, sep, expr = item.partition("=")
+        if not sep or name not in schedule:
+            raise ValueError(f"--schedule expects JOB=CRON with JOB one of "
+                             f"{', '.join(DAEMON_SCHEDULE)}: {item!r}")
+        schedule[name] = expr.strip()
+    return {name: cron.parse(expr) for name, expr in schedule.items()
+            if expr != "off"}
+
+
+def _iso(ts):
+    if ts is None:
+        return None
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()
+
+
+class DaemonStatus:
+    """Per-job bookkeeping shared between the scheduler and /healthz."""
+
+    def __init__(self, stuck_after=DAEMON_STUCK_SECONDS):
+        self.stuck_after = stuck_after
+        self.ready = False
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _job(self, name):
+        return self._jobs.setdefault(name, {
+            "next_run": None, "running_since": None, "last_run": None,
+            "last_success": None, "last_error": None,
+            "consecutive_failures": 0})
+
+    def scheduled(self, name, when):
+        with self._lock:
+            self._job(name)["next_run"] = when.timestamp()
+
+    def started(self, name):
+        with self._lock:
+            self._job(name)["running_since"] = time.time()
+
+    def finished(self, name, error=None):
+        with self._lock:
+            job = self._job(name)
+            job["running_since"] = None
+            job["last_run"] = time.time()
+            job["last_error"] = error
+            if error:
+                job["consecutive_failures"] += 1
+            else:
+                job["last_success"] = job["last_run"]
+                job["consecutive_failures"] = 0
+
+    def report(self):
+        """Return (healthy, JSON-able status). Unhealthy while starting up or
+        when a job has been running longer than stuck_after."""
+        now = time.time()
+        with self._lock:
+            jobs = {name: dict(job) for name, job in self._jobs.items()}
+        stuck = [name for name, job in jobs.items() if job["running_since"]
+                 and now - job["running_since"] > self.stuck_after]
+        for job in jobs.values():
+            for key in ("next_run", "running_since", "last_run", "last_success"):
+                job[key] = _iso(job[key])
+        state = "starting" if not self.ready else "stuck" if stuck else "ok"
+        return state == "ok", {"status": state, "stuck": stuck, "jobs": jobs}
+
+
+def serve_health(status, port):
+    """Serve status.report() as JSON on /healthz from a background thread."""
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/healthz"):
+                self.send_error(404)
+                return
+            healthy, report = status.report()
+            body = json.dumps(report, indent=2).encode()
+            self.send_response(200 if healthy else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # probes every few seconds would drown the job output
+
+    server = http.server.ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_tick(names, ctx, status):
+    """Run the jobs due this minute, in order, on the warm working copy.
+
+    ctx carries what stays warm across ticks: workdir, session, state_dir,
+    snapshots, and refresh() to bring the working copy up to origin/main.
+    One failing job is logged and recorded; the rest still run.
+    """
+    docs, stale = {}, True
+    for name in names:
+        status.started(name)
+        error = None
+        try:
+            with metrics.run(name), tracing.span(f"daemon.{name}"):
+                if stale:
+                    ctx.refresh()
+                    stale = False
+                if name == "comparison":
+                    run_compare(ctx.workdir, ctx.session,
+                                airports=docs.get("airports"),
+                                snapshots=ctx.snapshots)
+                else:
+                    docs[name] = run_fetch(source_args(name), ctx.workdir,
+                                           ctx.session, ctx.state_dir,
+                                           ctx.snapshots)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"Job {name} failed: {error}")
+            # Whatever it left behind is reset before the next job runs.
+            stale = True
+        status.finished(name, error)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def run_daemon(ctx, schedule, status, stop, now=_utcnow):
+    """Run ticks until stop (a threading.Event) is set.
+
+    Missed slots are skipped rather than caught up, like a CronJob with
+    concurrencyPolicy: Forbid.
+    """
+    due = {name: cron.next_time(c, now()) for name, c in schedule.items()}
+    for name, when in due.items():
+        status.scheduled(name, when)
+    while not stop.is_set():
+        wake = min(due.values())
+        if stop.wait(max(0.0, (wake - now()).total_seconds())):
+            break
+        current = now()
+        ready = [name for name in schedule if due[name] <= current]
+        if not ready:
+            continue
+        print(f"Tick {current:%Y-%m-%d %H:%M} UTC: {', '.join(ready)}")
+        run_tick(ready, ctx, status)
+        for name in ready:
+            due[name] = cron.next_time(schedule[name], now())
+            status.scheduled(name, due[name])
+
+
+def daemon(args, token, author_name, author_email, cache_dir, state_dir,
+           session, sparse=False):
+    schedule = daemon_schedule(args.schedule)
+    if not schedule:
+        raise SystemExit("every daemon job is switched off")
+    status = DaemonStatus()
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    server = serve_health(status, args.health_port)
+    try:
+        with working_copy(token, author_name, author_email, cache_dir,
+                          sparse) as repo_dir:
+            ctx = argparse.Namespace(
+                workdir=repo_dir, session=session, state_dir=state_dir,
+                snapshots=collections.OrderedDict(),
+                refresh=lambda: gs.sync(repo_dir, token,
+                                        author_name=author_name,
+                                        author_email=author_email,
+                                        sparse=sparse))
+            status.ready = True
+            print("Daemon schedule: " + "; ".join(
+                f"{name} '{c.expr}'" for name, c in schedule.items()))
+            run_daemon(ctx, schedule, status, stop)
+    finally:
+        server.shutdown()
+    print("Daemon stopped.")
+
+
 def main(argv=None):
-    args = build_parser().parse_args(argv)
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "compare" and args.shard and not args.run_id:
+        parser.error("compare --shard needs --run-id or COMPARE_RUN_ID")
     token = os.environ["GIT_TOKEN"]
     author_name = os.environ.get("GIT_AUTHOR_NAME", "Skycards Changes")
     author_email = os.environ.get("GIT_AUTHOR_EMAIL", "noreply@github.com")
+    cache_dir = os.environ.get("REPO_CACHE_DIR") or None
+    state_dir = os.path.join(cache_dir, "upstream") if cache_dir else None
+    sparse = os.environ.get("SPARSE_WORKTREE") == "1"
     session = requests.Session()
-    with tempfile.TemporaryDirectory() as workdir:
-        repo_dir = os.path.join(workdir, "repo")
-        gs.clone(repo_dir, token, author_name=author_name,
-                 author_email=author_email)
+    if args.command == "daemon":
+        daemon(args, token, author_name, author_email, cache_dir, state_dir,
+               session, sparse)
+        return
+    with metrics.run(args.command), tracing.span(f"pipeline.{args.command}"), \
+            working_copy(token, author_name, author_email, cache_dir,
+                         sparse) as repo_dir:
         if args.command == "fetch":
-            run_fetch(args, repo_dir, session)
+            doc = run_fetch(args, repo_dir, session, state_dir)
+            if args.compare_after:
+                airports = doc if args.data_name == "airports" else None
+                run_compare(repo_dir, session, airports=airports)
+        elif args.command == "fetch-all":
+            failures, docs = run_fetch_all(args.sources, repo_dir, session,
+                                           state_dir)
             if args.compare_after:
-                run_compare(repo_dir, session)
+                run_compare(repo_dir, session, airports=docs.get("airports"))
+            if failures:
+                raise SystemExit(f"fetch-all failed for: {', '.join(failures)}")
         else:
-            run_compare(repo_dir, session)
+            run_compare(repo_dir, session, shard=args.shard, run_id=args.run_id)
 
 
 if __name__ == "__main__":
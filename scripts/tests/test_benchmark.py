@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import benchmark as bm  # noqa: E402
+
+PAYLOADS = {
+    "airports": {"updatedAt": 1, "rows": [
+        {"id": 1, "iata": "AAA", "icao": "NTGA", "name": "Anaa Airport",
+         "placeCode": "PF"}]},
+    "models": {"updatedAt": 1, "rows": [
+        {"id": "PC12", "manufacturer": "PILATUS", "name": "PC-12", "seats": 9}]},
+    "airlines": [{"id": 1, "iata": "LH", "icao": "DLH", "name": "Lufthansa",
+                  "placeCode": "DE", "fleet": []}],
+}
+
+
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(bm.percentile(values, 50), 50)
+        self.assertEqual(bm.percentile(values, 95), 95)
+        self.assertEqual(bm.percentile([7], 95), 7)
+        self.assertEqual(bm.percentile([], 50), 0.0)
+
+    def test_regressions_ignore_noise_and_new_phases(self):
+        baseline = {"phases": {"fetch": {"p95": 100}, "git.log": {"p95": 0.5}}}
+        report = {"phases": {"fetch": {"p95": 130}, "git.log": {"p95": 5},
+                             "new": {"p95": 1000}}}
+        self.assertEqual(bm.regressions(report, baseline, 0.25),
+                         [("fetch", 100, 130)])
+
+
+@unittest.skipUnless(shutil.which("git"), "git not installed")
+class EndToEndTest(unittest.TestCase):
+    def setUp(self):
+        self.recordings = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.recordings)
+        for name, doc in PAYLOADS.items():
+            with open(os.path.join(self.recordings, f"{name}.json"), "w") as fh:
+                fh.write(bm.jq_format.dumps(bm.jq_format.loads(json.dumps(doc))))
+
+    def test_runs_cycles_against_local_stand_ins(self):
+        report = bm.run_benchmark(2, warm=True, pattern=["change", "same"],
+                                  recordings=self.recordings)
+
+        self.assertEqual(report["cycle_ms"]["count"], 2)
+        # One post per changed source; the unchanged cycle is all 304s.
+        self.assertEqual(report["webhook_posts"], 3)
+        self.assertEqual(report["phases"]["fetch.download"]["count"], 6)
+        self.assertEqual(report["phases"]["fetch.parse"]["count"], 3)
+        self.assertEqual(report["phases"]["git.push_with_retry"]["count"], 3)
+        self.assertGreater(report["peak_rss_mib"], 0)
+        self.assertNotIn("GIT_REMOTE_URL", os.environ)
+
+    def test_sparse_working_copy(self):
+        report = bm.run_benchmark(2, mode="fetch-all", warm=True,
+                                  pattern=["change", "updatedat"],
+                                  recordings=self.recordings, sparse=True)
+        self.assertEqual(report["webhook_posts"], 3)
+        # Three changes, then updatedAt for the two sources that have one,
+        # plus the push lease taken for each of the two pushes.
+        self.assertEqual(report["phases"]["git.push_lease"]["count"], 2)
+        self.assertEqual(report["phases"]["git.commit-tree"]["count"], 5 + 2)
+        self.assertNotIn("git.checkout", report["phases"])
+        self.assertNotIn("SPARSE_WORKTREE", os.environ)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,14 @@
+import contextlib
+import email.message
+import io
 import json
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import unittest
+import urllib.error
 from html import escape
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -128,6 +135,12 @@ class ParseCountryAirportsTest(unittest.TestCase):
         with self.assertRaises(ValueError):
             ca.parse_country_airports(html)
 
+    def test_accepts_inertia_json_response(self):
+        payload = {"component": "Data/AirportsByCountry",
+                   "props": {"airports": [{"name": "Oslo", "iata": "OSL", "icao": "ENGM"}]}}
+        self.assertEqual(ca.parse_country_airports(json.dumps(payload)),
+                         [{"name": "Oslo", "iata": "OSL", "icao": "ENGM"}])
+
     def test_raises_on_malformed_payload(self):
         with self.assertRaises(ValueError):
             ca.parse_country_airports('<div id="app" data-page="not json"></div>')
@@ -179,7 +192,7 @@ class OurDataHelpersTest(unittest.TestCase):
             {"name": "No IATA", "iata": "", "icao": "KZZZ", "placeCode": "US-CA"},
             {"name": "Other", "iata": "BBB", "icao": "KBBB", "placeCode": "GB"},
         )
-        got = ca.get_country_airports_from_our_data(data, "US")
+        got = ca.get_country_airports_from_our_data(ca.index_airports(data), "US")
         self.assertEqual([a["iata"] for a in got], ["AAA"])
         self.assertEqual(got[0]["placeCode"], "US-CA")
 
@@ -188,7 +201,7 @@ class OurDataHelpersTest(unittest.TestCase):
             {"name": "A", "iata": "AAA", "placeCode": "US-CA"},
             {"name": "B", "iata": "BBB", "placeCode": "US-TX"},
         )
-        got = ca.get_state_airports_from_our_data(data, "US", "CA")
+        got = ca.get_state_airports_from_our_data(ca.index_airports(data), "US", "CA")
         self.assertEqual([a["iata"] for a in got], ["AAA"])
 
     def test_our_state_counts_group_by_subdivision(self):
@@ -199,7 +212,23 @@ class OurDataHelpersTest(unittest.TestCase):
             {"iata": "", "placeCode": "US-TX"},   # iata-less: excluded
             {"iata": "DDD", "placeCode": "CA-ON"},  # other country
         )
-        self.assertEqual(ca.get_our_state_counts(data, "US"), {"CA": 2, "TX": 1})
+        self.assertEqual(ca.get_our_state_counts(ca.index_airports(data), "US"), {"CA": 2, "TX": 1})
+
+    def test_index_matches_country_counts(self):
+        data = _rows(
+            {"iata": "AAA", "placeCode": "US-CA"},
+            {"iata": "BBB", "placeCode": "US"},
+            {"iata": "", "placeCode": "US-TX"},
+            {"iata": "CCC", "placeCode": ""},
+            {"iata": "DDD", "placeCode": "CA-ON"},
+        )
+        index = ca.index_airports(data)
+        self.assertEqual({cc: len(v) for cc, v in index.by_country.items()},
+                         {"US": 2, "CA": 1})
+        self.assertEqual(index.state_counts, {"US": {"CA": 1}, "CA": {"ON": 1}})
+        # Callers get their own list, not the index's.
+        ca.get_country_airports_from_our_data(index, "US").clear()
+        self.assertEqual(len(index.by_country["US"]), 2)
 
 
 class DiffOneCountryTest(unittest.TestCase):
@@ -221,7 +250,8 @@ class DiffOneCountryTest(unittest.TestCase):
         ca._fetch_html = fake_fetch
         ca.time.sleep = lambda *a, **k: None
         try:
-            rec, err = ca._diff_one_country(iso, country_name, fr24_count, our_count, airports_data)
+            rec, err = ca._diff_one_country(iso, country_name, fr24_count, our_count,
+                                            ca.index_airports(airports_data))
             return rec, err, calls
         finally:
             ca._fetch_html = orig_fetch
@@ -375,5 +405,594 @@ class DiffOneCountryTest(unittest.TestCase):
         self.assertEqual(len(calls), 1)  # flat: single country page
 
 
+class _Clock:
+    """Fake monotonic clock whose sleep() just advances time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_spends_burst_then_paces_to_budget(self):
+        clock = _Clock()
+        limiter = ca.RateLimiter(30, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            limiter.wait("https://www.flightradar24.com/data/airports/x")
+        # Two from the burst, then one every 2 s (30 a minute).
+        self.assertEqual(clock.now, 6.0)
+
+    def test_hosts_have_separate_buckets(self):
+        clock = _Clock()
+        limiter = ca.RateLimiter(6, burst=1, clock=clock, sleep=clock.sleep)
+        self.assertEqual(limiter.wait("https://a.example/1"), 0)
+        self.assertEqual(limiter.wait("https://b.example/1"), 0)
+        self.assertEqual(limiter.wait("https://a.example/2"), 10)
+
+    def test_gives_up_rather_than_wait_past_until(self):
+        clock = _Clock()
+        limiter = ca.RateLimiter(6, burst=1, clock=clock, sleep=clock.sleep)
+        limiter.wait("https://a.example/1")
+        self.assertIsNone(limiter.wait("https://a.example/2", until=5))
+        self.assertEqual(clock.sleeps, [])
+        self.assertEqual(limiter.wait("https://a.example/2", until=10), 10)
+
+    def test_defer_holds_the_whole_host(self):
+        clock = _Clock()
+        limiter = ca.RateLimiter(60, burst=5, clock=clock, sleep=clock.sleep)
+        limiter.defer("https://a.example/page", 30)
+        self.assertEqual(limiter.wait("https://a.example/other"), 30)
+        self.assertEqual(limiter.wait("https://b.example/"), 0)
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds_and_http_date(self):
+        self.assertEqual(ca._retry_after("7"), 7)
+        self.assertEqual(ca._retry_after("100000"), ca.RETRY_AFTER_MAX)
+        self.assertEqual(ca._retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertIsNone(ca._retry_after(None))
+        self.assertIsNone(ca._retry_after("soon"))
+
+
+class _FetchTestCase(unittest.TestCase):
+    """Runs _fetch_html against canned urlopen responses and a fake clock."""
+
+    def setUp(self):
+        self.clock = _Clock()
+        orig = ca._limiter, ca.urllib.request.urlopen
+        orig_version, orig_cache = ca._inertia_version, ca._cache
+        ca._cache = None
+        ca._limiter = ca.RateLimiter(60, burst=1, clock=self.clock, sleep=self.clock.sleep)
+        ca._inertia_version = None
+        self.requests = []
+
+        def restore():
+            ca._limiter, ca.urllib.request.urlopen = orig
+            ca._inertia_version, ca._cache = orig_version, orig_cache
+        self.addCleanup(restore)
+
+    def _serve(self, *responses):
+        responses = list(responses)
+
+        def urlopen(req, timeout):
+            self.requests.append(dict(req.header_items()))
+            r = responses.pop(0)
+            if isinstance(r, Exception):
+                raise r
+            body, headers = r if isinstance(r, tuple) else (r, {})
+            response = io.BytesIO(body)
+            response.headers = email.message.Message()
+            for name, value in headers.items():
+                response.headers[name] = value
+            return response
+        ca.urllib.request.urlopen = urlopen
+
+    def _status(self, code):
+        return urllib.error.HTTPError("https://www.flightradar24.com/x", code,
+                                      "", email.message.Message(), None)
+
+    def _429(self, retry_after):
+        headers = email.message.Message()
+        if retry_after is not None:
+            headers["Retry-After"] = retry_after
+        return urllib.error.HTTPError("https://www.flightradar24.com/x", 429,
+                                      "Too Many Requests", headers, None)
+
+
+class FetchRetryTest(_FetchTestCase):
+    OK = b'{"component": "Data/AirportsByCountry", "props": {"airports": []}}'
+
+    def test_honours_retry_after_on_429(self):
+        self._serve(self._429("42"), self.OK)
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertIsNone(err)
+        self.assertEqual(html, self.OK.decode())
+        self.assertEqual(self.clock.sleeps, [42])
+
+    def test_falls_back_to_backoff_without_retry_after(self):
+        self._serve(self._429(None), OSError("reset"), self.OK)
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertEqual(html, self.OK.decode())
+        self.assertEqual(self.clock.sleeps, [ca.RETRY_DELAYS["throttled"][0],
+                                             ca.RETRY_DELAYS["transient"][1]])
+
+    def test_no_request_past_the_deadline(self):
+        ca._deadline = ca.time.monotonic() + ca.DEADLINE_MARGIN_SECONDS - 1
+        self.addCleanup(setattr, ca, "_deadline", None)
+        self._serve(b"ok")
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertEqual((html, err), (None, ca.DEADLINE_ERROR))
+        self.assertEqual(self.requests, [])
+
+    def test_gives_up_after_four_attempts(self):
+        self._serve(*[OSError("down")] * 4)
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertIsNone(html)
+        self.assertIn("Failed after 4 attempt(s) (transient)", err)
+
+    def test_not_found_is_not_retried(self):
+        self._serve(self._status(404))
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertIsNone(html)
+        self.assertIn("Failed after 1 attempt(s) (permanent)", err)
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_challenge_is_retried_once_after_a_pause(self):
+        headers = email.message.Message()
+        headers["cf-mitigated"] = "challenge"
+        self._serve(b"<html>Just a moment...</html>",
+                    urllib.error.HTTPError("https://www.flightradar24.com/x", 403,
+                                           "Forbidden", headers, None))
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertIn("Failed after 2 attempt(s) (challenge)", err)
+        self.assertEqual(self.clock.sleeps, list(ca.RETRY_DELAYS["challenge"]))
+
+    def test_requests_inertia_json_once_version_known(self):
+        index = _page_html({"airportsByCountry": []}).replace(
+            "&quot;url&quot;", "&quot;version&quot;: &quot;v1&quot;, &quot;url&quot;")
+        page = {"component": "Data/AirportsByCountry", "version": "v1",
+                "props": {"airports": [{"name": "Oslo", "iata": "OSL", "icao": "ENGM"}]}}
+        self._serve(index.encode(), json.dumps(page).encode())
+        self.assertEqual(ca.scrape_flightradar24(), {})
+        html, err = ca._fetch_html("https://www.flightradar24.com/data/airports/norway", "NO")
+
+        self.assertNotIn("X-inertia", self.requests[0])
+        self.assertEqual(self.requests[1]["X-inertia"], "true")
+        self.assertEqual(self.requests[1]["X-inertia-version"], "v1")
+        self.assertEqual([a["iata"] for a in ca.parse_country_airports(html)], ["OSL"])
+
+    def test_stale_version_falls_back_to_html(self):
+        ca._inertia_version = "old"
+        shell = _page_html({"airports": []})
+        self._serve(self._status(409), shell.encode())
+        html, err = ca._fetch_html("https://www.flightradar24.com/x", "X")
+        self.assertEqual(html, shell)
+        self.assertNotIn("X-inertia", self.requests[1])
+        self.assertIsNone(ca._inertia_version)
+        # Only the rate limiter's 1 s spacing: a version refresh is no retry.
+        self.assertEqual(self.clock.sleeps, [1.0])
+
+
+class PageCacheTest(_FetchTestCase):
+    URL = "https://www.flightradar24.com/data/airports/norway"
+
+    def setUp(self):
+        super().setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        ca._cache = ca.PageCache(self.dir)
+        self.page = json.dumps({"component": "Data/AirportsByCountry",
+                                "props": {"airports": []}}).encode()
+
+    def _age(self, seconds):
+        path = ca._cache._path(self.URL)
+        with open(path) as fh:
+            entry = json.load(fh)
+        entry["fetched_at"] -= seconds
+        with open(path, "w") as fh:
+            json.dump(entry, fh)
+
+    def test_fresh_page_needs_no_request(self):
+        self._serve((self.page, {"ETag": '"a"'}))
+        first, _ = ca._fetch_html(self.URL, "NO")
+        second, _ = ca._fetch_html(self.URL, "NO")
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_stale_page_is_revalidated(self):
+        self._serve((self.page, {"ETag": '"a"', "Last-Modified": "Sun, 18 Oct 2026 10:00:00 GMT"}),
+                    self._status(304))
+        first, _ = ca._fetch_html(self.URL, "NO")
+        self._age(ca.PAGE_TTLS["country"] + 1)
+        second, err = ca._fetch_html(self.URL, "NO")
+        self.assertIsNone(err)
+        self.assertEqual(second, first)
+        self.assertEqual(self.requests[1]["If-none-match"], '"a"')
+        self.assertEqual(self.requests[1]["If-modified-since"], "Sun, 18 Oct 2026 10:00:00 GMT")
+        # The 304 restarts the TTL.
+        ca._fetch_html(self.URL, "NO")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_index_is_always_revalidated_and_challenges_not_kept(self):
+        self.assertEqual(ca._page_kind("https://www.flightradar24.com/data/airports"), "index")
+        self.assertEqual(ca._page_kind("https://www.flightradar24.com/data/airports/us/al"), "state")
+        self._serve(*[b"<html>Just a moment...</html>"] * 2)
+        ca._fetch_html(self.URL, "NO")
+        self.assertIsNone(ca._cache.get(self.URL))
+
+    def test_not_found_is_remembered(self):
+        self._serve(self._status(404), self._status(404))
+        for _ in range(2):
+            html, err = ca._fetch_html(self.URL, "NO")
+            self.assertIn("(permanent)", err)
+        self.assertEqual(len(self.requests), 1)
+        # Asked again once NOT_FOUND_TTL is up.
+        self._age(ca.NOT_FOUND_TTL + 1)
+        ca._fetch_html(self.URL, "NO")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = ca.PageCache(self.dir)
+        for i, url in enumerate(("https://h/a", "https://h/b", "https://h/c")):
+            cache.put(url, "x" * 300, None, None)
+            os.utime(cache._path(url), (i, i))
+        # Room for three entries, not four.
+        cache.max_bytes = os.path.getsize(cache._path("https://h/a")) * 7 // 2
+        cache.get("https://h/a")  # a is now the most recently used
+        cache.put("https://h/d", "x" * 300, None, None)
+        self.assertIsNotNone(cache.get("https://h/a"))
+        self.assertIsNone(cache.get("https://h/b"))
+        self.assertIsNotNone(cache.get("https://h/d"))
+
+
+class AnalyzeCountryDifferencesTest(unittest.TestCase):
+    def test_countries_run_concurrently_and_keep_existing_on_failure(self):
+        started, release = [], threading.Event()
+
+        def fake_diff(iso, name, fr24_count, our_count, *rest):
+            started.append(iso)
+            if len(started) == 3:
+                release.set()
+            # Every country waits for the others: only passes if they overlap.
+            self.assertTrue(release.wait(5))
+            if iso == "FR":
+                return None, "HTTP Error 503"
+            return ca._country_record(name, iso, fr24_count, our_count, [], []), None
+
+        orig = ca._diff_one_country
+        ca._diff_one_country = fake_diff
+        try:
+            diffs = ca.analyze_country_differences(
+                {"Norway": 5, "France": 9, "Germany": 2}, {"NO": 4, "FR": 8, "DE": 1},
+                ca.create_country_mapping(), {"rows": []},
+                existing_differences={"FR": {"country_name": "France", "added_count": 1}})
+        finally:
+            ca._diff_one_country = orig
+
+        self.assertEqual(sorted(diffs), ["DE", "FR", "NO"])
+        self.assertEqual(diffs["NO"]["fr24_count"], 5)
+        self.assertEqual(diffs["FR"]["added_count"], 1)
+        self.assertEqual(diffs["FR"]["fetch_error"], "HTTP Error 503")
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_priority_order(self):
+        todo = [("AA", "A", 10, 9), ("BB", "B", 10, 2), ("CC", "C", 5, 4),
+                ("DD", "D", 5, 4), ("EE", "E", 5, 4), ("FF", "F", 1, 4)]
+        existing = {"CC": {}, "DD": {}, "EE": {"fetch_error": "x"}, "FF": {}}
+        schedule = {"CC": {"detailed_at": 200}, "DD": {"detailed_at": 100},
+                    "AA": {"deferred": ca.MAX_DEFERRALS, "detailed_at": 0}}
+        order = [t[0] for t in ca._prioritize(todo, existing, schedule)]
+        # Overdue first; then by gap; never detailed (BB none, EE failed)
+        # before detailed; oldest record first.
+        self.assertEqual(order, ["AA", "BB", "FF", "EE", "DD", "CC"])
+
+    def test_out_of_time_countries_are_carried_over(self):
+        def fake_diff(iso, name, fr24_count, our_count, *rest):
+            if iso == "NO":
+                return ca._country_record(name, iso, fr24_count, our_count, [], []), None
+            return None, ca.DEADLINE_ERROR
+
+        existing = {"FR": {"country_name": "France", "added_count": 1}}
+        fingerprints = {"FR": {"fingerprint": "f", "record": "r", "states": {}}}
+        schedule = {"FR": {"deferred": 1, "detailed_at": 5}}
+        orig = ca._diff_one_country
+        ca._diff_one_country = fake_diff
+        try:
+            diffs = ca.analyze_country_differences(
+                {"Norway": 5, "France": 9, "Germany": 2}, {"NO": 4, "FR": 8, "DE": 1},
+                ca.create_country_mapping(), {"rows": []}, existing, fingerprints,
+                schedule=schedule)
+        finally:
+            ca._diff_one_country = orig
+
+        # FR keeps its record as it was (no fetch_error), DE has none yet.
+        self.assertEqual(sorted(diffs), ["FR", "NO"])
+        self.assertEqual(diffs["FR"], existing["FR"])
+        self.assertEqual(fingerprints["FR"]["fingerprint"], "f")
+        self.assertEqual(schedule["FR"], {"deferred": 2, "detailed_at": 5})
+        self.assertEqual(schedule["DE"], {"deferred": 1})
+        self.assertEqual(schedule["NO"]["deferred"], 0)
+
+
+class ShardTest(unittest.TestCase):
+    FR24 = {"Norway": 5, "France": 9, "Germany": 2, "Spain": 7, "Italy": 3}
+    OURS = {"NO": 4, "FR": 8, "DE": 1, "ES": 6, "IT": 2}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        orig = ca._diff_one_country
+        ca._diff_one_country = lambda iso, name, fr24_count, our_count, *rest: (
+            ca._country_record(name, iso, fr24_count, our_count, [], []), None)
+        self.addCleanup(setattr, ca, "_diff_one_country", orig)
+
+    def _analyze(self, shard=None):
+        return ca.analyze_country_differences(
+            self.FR24, self.OURS, ca.create_country_mapping(), {"rows": []},
+            shard=shard)
+
+    def _partials(self, count):
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(self.tmp, f"shard-{i}-of-{count}.json"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                ca.write_differences(paths[-1], self._analyze((i, count)), (i, count))
+        return paths
+
+    def test_shards_split_the_countries(self):
+        shards = [set(self._analyze((i, 3))) for i in range(3)]
+        self.assertEqual(set().union(*shards), set(self.OURS))
+        self.assertEqual(sum(map(len, shards)), len(self.OURS))
+        self.assertEqual(ca.shard_of("FR", 3), ca.shard_of("FR", 3))
+
+    def test_merge_matches_a_serial_run(self):
+        out = os.path.join(self.tmp, "merged.json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            ca.main(["--merge", *self._partials(3), "--output", out])
+            ca.write_differences(os.path.join(self.tmp, "serial.json"), self._analyze())
+        with open(out) as merged, open(os.path.join(self.tmp, "serial.json")) as serial:
+            self.assertEqual(json.load(merged), json.load(serial))
+
+    def test_merge_refuses_an_incomplete_run(self):
+        paths = self._partials(3)
+        for partials in (paths[:2], [paths[0], paths[0], paths[1]],
+                         paths[:1] + self._partials(2)[1:]):
+            with self.assertRaises(ValueError):
+                ca.merge_partials(partials)
+
+
+class RunGateTest(unittest.TestCase):
+    """A run whose inputs match the last clean run stops after the index."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp)
+        self.calls, self.errors = [], {}
+
+        def fake_diff(iso, name, fr24_count, our_count, *rest):
+            self.calls.append(iso)
+            if iso in self.errors:
+                return None, self.errors[iso]
+            return ca._country_record(name, iso, fr24_count, our_count, [], []), None
+
+        saved = (ca._diff_one_country, ca.scrape_flightradar24,
+                 ca.COMPARE_STATE_DIR, ca._cache)
+        ca._diff_one_country = fake_diff
+        ca.scrape_flightradar24 = lambda: {"Norway": 2, "France": 1}
+        ca.COMPARE_STATE_DIR = os.path.join(self.tmp, "state")
+        ca._cache = None
+
+        def restore():
+            (ca._diff_one_country, ca.scrape_flightradar24,
+             ca.COMPARE_STATE_DIR, ca._cache) = saved
+        self.addCleanup(restore)
+        self._airports(["OSL"])
+
+    def _airports(self, iatas):
+        with open("airports.json", "w") as fh:
+            json.dump({"rows": [{"iata": i, "icao": "", "placeCode": "NO"} for i in iatas]}, fh)
+
+    def _main(self, *argv):
+        self.calls.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                ca.main(list(argv))
+            except SystemExit as e:
+                return e.code
+        return 0
+
+    def test_unchanged_inputs_skip_the_comparison(self):
+        self.assertEqual(self._main(), 0)
+        self.assertEqual(sorted(self.calls), ["FR", "NO"])
+        self.assertEqual(self._main(), ca.EXIT_UNCHANGED)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self._main("--force"), 0)
+        self._airports(["OSL", "BGO"])
+        self.assertEqual(self._main(), 0)
+        with open(ca.DIFFERENCES_FILE) as fh:
+            self.assertEqual(list(json.load(fh)["countries"]), ["FR"])  # NO matches now
+
+    def test_run_with_a_retryable_failure_is_not_trusted(self):
+        self.errors["FR"] = "Failed after 4 attempt(s) (transient). Last error: reset"
+        self._main()
+        self.assertEqual(self._main(), 0)
+        self.errors["FR"] = "Failed after 1 attempt(s) (permanent). Last error: 404"
+        self._main()
+        self.assertEqual(self._main(), ca.EXIT_UNCHANGED)
+
+
+    def test_unpublished_output_is_redone(self):
+        published = '{"summary": {}, "countries": {}}'
+        with open(ca.DIFFERENCES_FILE, "w") as fh:
+            fh.write(published)
+        self.assertEqual(self._main(), 0)
+        with open(ca.DIFFERENCES_FILE) as fh:
+            written = fh.read()
+        # The push failed: the next run's checkout has the published file again.
+        with open(ca.DIFFERENCES_FILE, "w") as fh:
+            fh.write(published)
+        self.assertEqual(self._main(), 0)
+        with open(ca.DIFFERENCES_FILE) as fh:
+            self.assertEqual(fh.read(), written)
+        self.assertEqual(self._main(), ca.EXIT_UNCHANGED)
+
+
+class IncrementalComparisonTest(unittest.TestCase):
+    """Second runs reuse records whose fingerprints haven't moved."""
+
+    US = "/data/airports/united-states"
+
+    def _analyze(self, pages, our, fr24_count, existing, fingerprints, checkpoint=None,
+                 schedule=None):
+        calls = []
+
+        def fake_fetch(url, label):
+            calls.append(url[len("https://www.flightradar24.com"):])
+            page = pages[calls[-1]]
+            # A (None, error) tuple stands for a failed fetch.
+            return page if isinstance(page, tuple) else (page, None)
+
+        orig = ca._fetch_html
+        ca._fetch_html = fake_fetch
+        try:
+            diffs = ca.analyze_country_differences(
+                {"United States": fr24_count}, {"US": len(our["rows"])},
+                ca.create_country_mapping(), our, existing, fingerprints, checkpoint,
+                schedule=schedule)
+        finally:
+            ca._fetch_html = orig
+        # What main() writes and reads back.
+        return json.loads(json.dumps(diffs)), calls
+
+    def _pages(self, ca_total, tx_total):
+        return {
+            self.US: _states_page_html([
+                {"code": "CA", "name": "California", "total": ca_total, "url": self.US + "/ca"},
+                {"code": "TX", "name": "Texas", "total": tx_total, "url": self.US + "/tx"},
+            ]),
+            self.US + "/ca": _country_page_html([
+                {"name": "LA", "iata": "LAX", "icao": "KLAX"},
+                {"name": "San Diego", "iata": "SAN", "icao": "KSAN"},
+            ]),
+            self.US + "/tx": _country_page_html([
+                {"name": "Dallas", "iata": "DFW", "icao": "KDFW"},
+                {"name": "Austin", "iata": "AUS", "icao": "KAUS"},
+            ]),
+        }
+
+    def setUp(self):
+        self.our = _rows({"name": "LA", "iata": "LAX", "placeCode": "US-CA"},
+                         {"name": "Dallas", "iata": "DFW", "placeCode": "US-TX"})
+        self.fingerprints = {}
+        self.first, calls = self._analyze(self._pages(2, 2), self.our, 4, {}, self.fingerprints)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(set(self.fingerprints["US"]["states"]), {"CA", "TX"})
+
+    def test_unchanged_country_fetches_no_state(self):
+        diffs, calls = self._analyze(self._pages(2, 2), self.our, 4, self.first, self.fingerprints)
+        # Only the country page, for FR24's per-state totals.
+        self.assertEqual(calls, [self.US])
+        self.assertEqual(diffs, self.first)
+
+    def test_airports_moving_between_states_are_seen(self):
+        # Same country total, but one of TX's airports is now listed in CA.
+        pages = self._pages(3, 1)
+        pages[self.US + "/ca"] = _country_page_html([
+            {"name": "LA", "iata": "LAX", "icao": "KLAX"},
+            {"name": "San Diego", "iata": "SAN", "icao": "KSAN"},
+            {"name": "Austin", "iata": "AUS", "icao": "KAUS"},
+        ])
+        diffs, calls = self._analyze(pages, self.our, 4, self.first, self.fingerprints)
+        self.assertEqual(calls, [self.US, self.US + "/ca"])
+        self.assertEqual(set(diffs["US"]["states"]), {"CA"})
+        self.assertEqual(sorted(a["iata"] for a in diffs["US"]["added_airports"]),
+                         ["AUS", "SAN"])
+
+    def test_only_moved_states_are_fetched(self):
+        pages = self._pages(2, 3)
+        pages[self.US + "/tx"] = _country_page_html([
+            {"name": "Dallas", "iata": "DFW", "icao": "KDFW"},
+            {"name": "Austin", "iata": "AUS", "icao": "KAUS"},
+            {"name": "Houston", "iata": "IAH", "icao": "KIAH"},
+        ])
+        diffs, calls = self._analyze(pages, self.our, 5, self.first, self.fingerprints)
+        self.assertEqual(calls, [self.US, self.US + "/tx"])
+        self.assertEqual(diffs["US"]["states"]["CA"], self.first["US"]["states"]["CA"])
+        self.assertEqual(sorted(a["iata"] for a in diffs["US"]["added_airports"]),
+                         ["AUS", "IAH", "SAN"])
+
+    def test_deadline_on_a_state_page_carries_the_country_over(self):
+        pages = self._pages(2, 3)
+        pages[self.US + "/tx"] = (None, ca.DEADLINE_ERROR)
+        now = ca.time.time()
+        schedule = {"US": {"deferred": 1, "detailed_at": now}}
+        diffs, calls = self._analyze(pages, self.our, 5, self.first, self.fingerprints,
+                                     schedule=schedule)
+        self.assertEqual(calls, [self.US, self.US + "/tx"])
+        # Kept as it was, not marked as failed; one more deferral.
+        self.assertEqual(diffs["US"], self.first["US"])
+        self.assertEqual(schedule["US"], {"deferred": 2, "detailed_at": now})
+
+    def test_resume_skips_finished_countries_and_states(self):
+        path = os.path.join(tempfile.mkdtemp(), "checkpoint.jsonl")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        pages = self._pages(2, 2)
+        tx = pages.pop(self.US + "/tx")
+        # The first run dies on TX, after CA was checkpointed.
+        with self.assertRaises(KeyError):
+            self._analyze(pages, self.our, 4, {}, {}, ca.Checkpoint(path))
+        with open(path, "a") as fh:
+            fh.write('{"iso": "US", "sta')  # torn by the kill
+
+        pages[self.US + "/tx"] = tx
+        checkpoint = ca.Checkpoint(path, resume=True)
+        diffs, calls = self._analyze(pages, self.our, 4, {}, {}, checkpoint)
+        self.assertEqual(calls, [self.US, self.US + "/tx"])
+        self.assertEqual(diffs, self.first)
+
+        # A third restart finds the whole country done.
+        diffs, calls = self._analyze(pages, self.our, 4, {}, {}, ca.Checkpoint(path, resume=True))
+        self.assertEqual(calls, [])
+        self.assertEqual(diffs, self.first)
+        # Without resume the log starts over.
+        self.assertEqual(ca.Checkpoint(path).countries, {})
+        self.assertFalse(os.path.exists(path))
+
+    def test_finish_keeps_states_of_carried_over_countries(self):
+        path = os.path.join(tempfile.mkdtemp(), "checkpoint.jsonl")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        checkpoint = ca.Checkpoint(path)
+        checkpoint.state_done("US", "CA", "fp", {"added_airports": []})
+        checkpoint.state_done("CA", "ON", "fp", {"added_airports": []})
+        checkpoint.country_done("NO", "fp", {"iso_code": "NO"})
+        checkpoint.finish(keep=("US",))
+        resumed = ca.Checkpoint(path, resume=True)
+        self.assertEqual(resumed.countries, {})
+        self.assertEqual(list(resumed.states), ["US"])
+
+    def test_our_changes_and_edited_records_are_not_trusted(self):
+        our = _rows(*self.our["rows"], {"name": "SD", "iata": "SAN", "placeCode": "US-CA"})
+        diffs, calls = self._analyze(self._pages(2, 2), our, 4, self.first, self.fingerprints)
+        # CA now matches; TX's fingerprint held, so only the country page.
+        self.assertEqual(calls, [self.US])
+        self.assertEqual(list(diffs["US"]["states"]), ["TX"])
+
+        edited = json.loads(json.dumps(diffs))
+        edited["US"]["added_count"] = 99
+        _, calls = self._analyze(self._pages(2, 2), our, 4, edited, self.fingerprints)
+        self.assertEqual(len(calls), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,58 @@
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import cron  # noqa: E402
+
+
+def _at(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class ParseTest(unittest.TestCase):
+    def test_fields(self):
+        c = cron.parse("*/20 9-17/4 1,15 * 7")
+        self.assertEqual(c.minutes, {0, 20, 40})
+        self.assertEqual(c.hours, {9, 13, 17})
+        self.assertEqual(c.days, {1, 15})
+        self.assertEqual(len(c.months), 12)
+        self.assertEqual(c.weekdays, {0})
+
+    def test_rejects_malformed(self):
+        for expr in ("* * * *", "60 * * * *", "* * 0 * *", "5-1 * * * *",
+                     "*/0 * * * *", "a * * * *"):
+            with self.assertRaises(ValueError, msg=expr):
+                cron.parse(expr)
+
+
+class NextTimeTest(unittest.TestCase):
+    def test_every_thirty_minutes(self):
+        c = cron.parse("*/30 * * * *")
+        self.assertEqual(cron.next_time(c, _at(2026, 1, 1, 10, 29, 59)),
+                         _at(2026, 1, 1, 10, 30))
+        self.assertEqual(cron.next_time(c, _at(2026, 1, 1, 10, 30)),
+                         _at(2026, 1, 1, 11, 0))
+
+    def test_daily_rolls_to_next_day_and_year(self):
+        self.assertEqual(cron.next_time(cron.parse("0 9 * * *"), _at(2026, 1, 1, 9, 0)),
+                         _at(2026, 1, 2, 9, 0))
+        self.assertEqual(cron.next_time(cron.parse("59 23 31 12 *"),
+                                        _at(2026, 12, 31, 23, 59)),
+                         _at(2027, 12, 31, 23, 59))
+
+    def test_day_of_month_or_weekday(self):
+        # 2026-10-18 is a Sunday; Monday the 19th matches the weekday.
+        c = cron.parse("15 8 1 * 1")
+        self.assertEqual(cron.next_time(c, _at(2026, 10, 18)), _at(2026, 10, 19, 8, 15))
+
+    def test_leap_day_and_impossible(self):
+        self.assertEqual(cron.next_time(cron.parse("0 0 29 2 *"), _at(2026, 1, 1)),
+                         _at(2028, 2, 29))
+        with self.assertRaises(ValueError):
+            cron.next_time(cron.parse("0 0 30 2 *"), _at(2026, 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
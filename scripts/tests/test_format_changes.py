@@ -4,6 +4,7 @@ import unittest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 import format_changes as fc  # noqa: E402
+import json_diff  # noqa: E402
 
 
 class HelpersTest(unittest.TestCase):
@@ -246,6 +247,18 @@ class AirportsTest(unittest.TestCase):
             "Total airports: 2",
         )
 
+    def test_structural_changes_give_the_same_message(self):
+        # Handing summarize the json_diff result narrows the formatters to the
+        # changed rows; the message (totals included) must not change.
+        same = self._ap(id=1)
+        old = {"rows": [same, self._ap(id=2, iata="AAR", size=100),
+                        self._ap(id=3, iata="ZAJ")]}
+        new = {"rows": [same, self._ap(id=2, iata="AAR", size=fc.AIRPORT_MAJOR_SIZE),
+                        self._ap(id=4, iata="JFK", placeCode="US-NY")]}
+        changes = json_diff.compare(old, new)
+        self.assertEqual(fc.summarize("airports", old, new, "L", changes=changes),
+                         fc.summarize("airports", old, new, "L"))
+
 
 class FleetsTest(unittest.TestCase):
     def _al(self, **kw):
@@ -511,6 +524,28 @@ import tempfile
 from contextlib import redirect_stdout
 
 
+class SummarizeTest(unittest.TestCase):
+    def test_returns_message_tldr_caption_and_misc_flag(self):
+        old = {"rows": [{"id": "AMS", "name": "Schiphol", "iata": "AMS",
+                         "placeCode": "NL", "size": 100}]}
+        new = {"rows": old["rows"] + [{"id": "RTM", "name": "Rotterdam",
+                                       "iata": "RTM", "placeCode": "NL",
+                                       "size": 100}]}
+        summary = fc.summarize("airports", old, new, "L")
+        self.assertIn("RTM", summary.message)
+        self.assertTrue(summary.tldr.startswith("Airports update"))
+        self.assertIn(summary.tldr, summary.caption)
+        self.assertFalse(summary.is_misc)
+
+    def test_first_run_and_comparison_caption_is_tldr(self):
+        first = fc.summarize("models", None, {"rows": []}, "L")
+        self.assertEqual(first.tldr, "Aircraft data published")
+        self.assertEqual(first.caption, first.tldr)
+        cmp = fc.summarize("comparison", None, None, "L",
+                           old_airports=None, airports={"rows": []})
+        self.assertEqual(cmp.caption, cmp.tldr)
+
+
 class CliTest(unittest.TestCase):
     def _run(self, argv):
         out = io.StringIO()
@@ -1,5 +1,8 @@
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
 import unittest
 from unittest import mock
 
@@ -14,59 +17,393 @@ def _completed(returncode=0, stdout=""):
     return m
 
 
-class DetectChangesTest(unittest.TestCase):
-    def test_no_changes(self):
-        with mock.patch.object(gs, "_run", return_value=_completed(0)):
-            self.assertEqual(gs.detect_changes("airports.json", cwd="/x"),
-                             (False, False))
-
-    def test_only_updatedat_changed(self):
-        diff = ('+++ b/airports.json\n--- a/airports.json\n'
-                '-  "updatedAt": 1\n+  "updatedAt": 2\n')
-        calls = [_completed(1), _completed(1, diff)]
-        with mock.patch.object(gs, "_run", side_effect=calls):
-            self.assertEqual(gs.detect_changes("airports.json", cwd="/x"),
-                             (True, True))
-
-    def test_real_change(self):
-        diff = ('+++ b/airports.json\n-  "name": "A"\n+  "name": "B"\n'
-                '+  "updatedAt": 2\n')
-        calls = [_completed(1), _completed(1, diff)]
-        with mock.patch.object(gs, "_run", side_effect=calls):
-            self.assertEqual(gs.detect_changes("airports.json", cwd="/x"),
-                             (True, False))
-
-
-class PushRetryTest(unittest.TestCase):
-    def test_succeeds_first_try(self):
-        with mock.patch.object(gs, "_run", return_value=_completed(0)) as run:
-            gs.push_with_retry(cwd="/x")
-        self.assertEqual(run.call_count, 1)
-
-    def test_rebases_then_succeeds(self):
-        # push fail, pull ok, push ok
-        seq = [_completed(1), _completed(0), _completed(0)]
-        with mock.patch.object(gs, "_run", side_effect=seq) as run:
-            gs.push_with_retry(cwd="/x")
-        self.assertEqual(run.call_count, 3)
-
-    def test_raises_after_exhausting_attempts(self):
-        # every push fails; pulls succeed
-        def fake(args, cwd=None, check=False):
-            return _completed(0 if args[0] == "pull" else 1)
-        with mock.patch.object(gs, "_run", side_effect=fake):
-            with self.assertRaises(RuntimeError):
-                gs.push_with_retry(cwd="/x", attempts=3)
-
-
-class CapturePreviousTest(unittest.TestCase):
-    def test_writes_head_blob(self):
-        with mock.patch.object(gs, "_run",
-                               return_value=_completed(0, '{"a":1}')) as run:
-            content = gs.show_file("HEAD", "airports.json", cwd="/x")
-        run.assert_called_once()
-        self.assertEqual(content, '{"a":1}')
-
-    def test_missing_blob_returns_empty(self):
-        with mock.patch.object(gs, "_run", return_value=_completed(128, "")):
-            self.assertEqual(gs.show_file("HEAD", "missing.json", cwd="/x"), "")
+class FileChangedTest(unittest.TestCase):
+    @unittest.skipUnless(shutil.which("git"), "git not installed")
+    def test_blob_id_matches_git(self):
+        path = os.path.join(tempfile.mkdtemp(), "a.json")
+        with open(path, "wb") as fh:
+            fh.write(b'{\n  "a": 1\n}\n')
+        expected = subprocess.run(["git", "hash-object", path], check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        self.assertEqual(gs.file_blob_id(path), expected)
+
+    def test_compares_against_head_blob(self):
+        workdir = tempfile.mkdtemp()
+        with open(os.path.join(workdir, "a.json"), "w") as fh:
+            fh.write("x")
+        same = gs.file_blob_id(os.path.join(workdir, "a.json"))
+        with mock.patch.object(gs, "blob_id", return_value=same):
+            self.assertFalse(gs.file_changed("a.json", cwd=workdir))
+        with mock.patch.object(gs, "blob_id", return_value=""):
+            self.assertTrue(gs.file_changed("a.json", cwd=workdir))
+
+
+class BackoffTest(unittest.TestCase):
+    def test_full_jitter_doubles_up_to_the_cap(self):
+        with mock.patch.object(gs.random, "uniform", side_effect=lambda a, b: b):
+            self.assertEqual([gs.backoff(n) for n in range(7)],
+                             [1, 2, 4, 8, 16, 30, 30])
+        self.assertLessEqual(gs.backoff(3), 8)
+
+
+def _git(*args, cwd=None):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True,
+                   text=True)
+
+
+@unittest.skipUnless(shutil.which("git"), "git not installed")
+class SyncTest(unittest.TestCase):
+    """Exercise the warm working copy against a local bare remote."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.remote = os.path.join(self.tmp, "remote.git")
+        _git("init", "--bare", "-b", "main", self.remote)
+        # Served over file:// so clones are real partial (blob:none) clones;
+        # a plain path makes git copy everything and ignore the filter.
+        _git("config", "uploadpack.allowFilter", "true", cwd=self.remote)
+        self.seed = os.path.join(self.tmp, "seed")
+        _git("clone", self.remote, self.seed)
+        _git("config", "user.name", "t", cwd=self.seed)
+        _git("config", "user.email", "t@t", cwd=self.seed)
+        self._push_file("airports.json", "1\n")
+        patcher = mock.patch.object(gs, "remote_url",
+                                    return_value="file://" + self.remote)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.work = os.path.join(self.tmp, "cache", "repo")
+
+    def _push_file(self, name, content):
+        with open(os.path.join(self.seed, name), "w") as fh:
+            fh.write(content)
+        _git("add", name, cwd=self.seed)
+        _git("commit", "-m", name, cwd=self.seed)
+        _git("push", "origin", "HEAD:main", cwd=self.seed)
+
+    def _read(self, name):
+        with open(os.path.join(self.work, name)) as fh:
+            return fh.read()
+
+    def test_clones_when_missing(self):
+        gs.sync(self.work, "tok")
+        self.assertEqual(self._read("airports.json"), "1\n")
+
+    def test_reuses_copy_and_discards_local_state(self):
+        gs.sync(self.work, "tok")
+        inode = os.stat(os.path.join(self.work, ".git")).st_ino
+        # Leftovers of a killed run: dirty file, stray file, unpushed commit,
+        # stale index lock.
+        with open(os.path.join(self.work, "airports.json"), "w") as fh:
+            fh.write("dirty\n")
+        with open(os.path.join(self.work, "stray.md"), "w") as fh:
+            fh.write("x")
+        _git("commit", "-am", "unpushed", cwd=self.work)
+        open(os.path.join(self.work, ".git", "index.lock"), "w").close()
+        self._push_file("airports.json", "2\n")
+
+        gs.sync(self.work, "tok")
+        self.assertEqual(os.stat(os.path.join(self.work, ".git")).st_ino, inode)
+        self.assertEqual(self._read("airports.json"), "2\n")
+        self.assertFalse(os.path.exists(os.path.join(self.work, "stray.md")))
+        self.assertEqual(gs.head_sha(cwd=self.work),
+                         gs.head_sha(cwd=self.seed))
+
+    def test_corrupt_copy_is_recloned(self):
+        gs.sync(self.work, "tok")
+        os.remove(os.path.join(self.work, ".git", "HEAD"))
+        gs.sync(self.work, "tok")
+        self.assertEqual(self._read("airports.json"), "1\n")
+
+    def _seed_log(self, fmt):
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        return subprocess.run(["git", "log", f"--format={fmt}"], cwd=self.seed,
+                              capture_output=True, text=True).stdout
+
+    def _write(self, name, content):
+        path = os.path.join(self.work, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fh:
+            fh.write(content)
+
+    def test_sparse_copy_commits_without_a_checkout(self):
+        gs.sync(self.work, "tok", sparse=True)
+        self.assertEqual(os.listdir(self.work), [".git"])
+        self.assertTrue(gs.is_sparse(self.work))
+        self._write("airports.json", "2\n")
+        self._write("sub/new.json", "n\n")
+        gs.commit(["airports.json", "sub/new.json"], "title", body="body",
+                  cwd=self.work)
+        gs.push_with_retry(cwd=self.work)
+        self.assertEqual(self._seed_log("%B").split("\n")[:3],
+                         ["title", "", "body"])
+        with open(os.path.join(self.seed, "sub", "new.json")) as fh:
+            self.assertEqual(fh.read(), "n\n")
+        with open(os.path.join(self.seed, "airports.json")) as fh:
+            self.assertEqual(fh.read(), "2\n")
+
+    def test_sparse_push_replays_onto_concurrent_push(self):
+        gs.sync(self.work, "tok", sparse=True)
+        self._push_file("models.json", "m\n")
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "ours", cwd=self.work)
+        with mock.patch.object(gs.time, "sleep"):
+            gs.push_with_retry(cwd=self.work)
+        self.assertEqual(self._seed_log("%s").split("\n")[:2],
+                         ["ours", "models.json"])
+        self.assertEqual(gs.head_sha(cwd=self.work), gs.head_sha(cwd=self.seed))
+        self.assertEqual(gs.show_file("HEAD", "models.json", cwd=self.work), "m\n")
+
+    def test_sparse_push_refuses_a_file_changed_upstream(self):
+        gs.sync(self.work, "tok", sparse=True)
+        self._push_file("airports.json", "theirs\n")
+        self._write("airports.json", "ours\n")
+        gs.commit(["airports.json"], "ours", cwd=self.work)
+        with self.assertRaises(RuntimeError), mock.patch.object(gs.time, "sleep"):
+            gs.push_with_retry(cwd=self.work)
+
+    def _unfetched(self):
+        """Paths at HEAD whose blobs the partial clone never fetched."""
+        def run(*args):
+            return subprocess.run(["git", *args], cwd=self.work,
+                                  capture_output=True, text=True).stdout
+
+        missing = {line[1:] for line in run("rev-list", "--objects", "--no-walk",
+                                            "--missing=print", "HEAD^{tree}").split()
+                   if line.startswith("?")}
+        listing = run("ls-tree", "-r", "HEAD").splitlines()
+        return {line.split("\t")[1] for line in listing
+                if line.split()[2] in missing}
+
+    def test_sparse_commit_leaves_siblings_unfetched(self):
+        self._push_file("models.json", "m\n")
+        gs.sync(self.work, "tok", sparse=True)
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "ours", cwd=self.work)
+        self.assertEqual(self._unfetched(), {"models.json"})
+        gs.push_with_retry(cwd=self.work)
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        with open(os.path.join(self.seed, "models.json")) as fh:
+            self.assertEqual(fh.read(), "m\n")
+
+    def test_sparse_rebase_leaves_siblings_unfetched(self):
+        self._push_file("airlines.json", "l\n")
+        gs.sync(self.work, "tok", sparse=True)
+        self._push_file("models.json", "m\n")
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "ours", cwd=self.work)
+        with mock.patch.object(gs.time, "sleep"):
+            gs.push_with_retry(cwd=self.work)
+        self.assertEqual(self._seed_log("%s").split("\n")[:2],
+                         ["ours", "models.json"])
+        self.assertEqual(self._unfetched(), {"airlines.json", "models.json"})
+
+    def _ls_remote(self, pattern):
+        out = subprocess.run(["git", "ls-remote", self.remote, pattern],
+                             capture_output=True, text=True).stdout
+        return dict(line.split("\t")[::-1] for line in out.splitlines())
+
+    def test_push_moves_last_refs_with_main(self):
+        gs.sync(self.work, "tok", sparse=True)
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "a", cwd=self.work)
+        self._write("models.json", "m\n")
+        gs.commit(["models.json"], "m", cwd=self.work)
+        gs.push_with_retry(cwd=self.work)
+        head = gs.head_sha(cwd=self.work)
+        previous = subprocess.run(["git", "rev-parse", "HEAD~1"], cwd=self.work,
+                                  capture_output=True, text=True).stdout.strip()
+        self.assertEqual(self._ls_remote("refs/skycards/*"), {
+            "refs/skycards/last/airports.json": previous,
+            "refs/skycards/last/models.json": head})
+        # A fresh copy picks the refs up and resolves through them.
+        other = os.path.join(self.tmp, "other")
+        gs.sync(other, "tok")
+        self.addCleanup(gs.close_reader, other)
+        self.assertEqual(gs.last_commit_touching("models.json", cwd=other), head)
+
+    def test_stale_last_ref_falls_back_to_history(self):
+        gs.sync(self.work, "tok")
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "a", cwd=self.work)
+        gs.push_with_retry(cwd=self.work)
+        # A commit pushed by something else leaves the ref behind.
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        self._push_file("airports.json", "3\n")
+        gs.sync(self.work, "tok")
+        self.addCleanup(gs.close_reader, self.work)
+        self.assertEqual(gs.last_commit_touching("airports.json", cwd=self.work),
+                         gs.head_sha(cwd=self.seed))
+
+    def _hold_lease(self, expires):
+        """Put a lease held by another job on the remote."""
+        tree = subprocess.run(["git", "hash-object", "-t", "tree", "-w", "--stdin"],
+                              cwd=self.seed, input="", capture_output=True,
+                              text=True).stdout.strip()
+        sha = subprocess.run(["git", "commit-tree", tree, "-m",
+                              f"push lease\n\nholder other/1\nexpires {expires:.0f}"],
+                             cwd=self.seed, capture_output=True,
+                             text=True).stdout.strip()
+        _git("push", "origin", f"{sha}:{gs.LEASE_REF}", cwd=self.seed)
+
+    def _commit_change(self):
+        gs.sync(self.work, "tok")
+        self.addCleanup(gs.close_reader, self.work)
+        self._write("airports.json", "2\n")
+        gs.commit(["airports.json"], "a", cwd=self.work)
+
+    def test_push_takes_and_releases_the_lease(self):
+        self._commit_change()
+        with mock.patch.object(gs.time, "sleep") as sleep:
+            gs.push_with_retry(cwd=self.work)
+        sleep.assert_not_called()
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+        self.assertEqual(self._ls_remote("refs/heads/main")["refs/heads/main"],
+                         gs.head_sha(cwd=self.work))
+
+    def test_waits_while_another_job_holds_the_lease(self):
+        self._commit_change()
+        self._hold_lease(gs.time.time() + 60)
+        # The other job finishes while we back off.
+        release = lambda _: _git("push", "origin", f":{gs.LEASE_REF}", cwd=self.seed)
+        with mock.patch.object(gs.time, "sleep", side_effect=release) as sleep:
+            gs.push_with_retry(cwd=self.work)
+        sleep.assert_called_once()
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_expired_lease_is_taken_over(self):
+        self._commit_change()
+        self._hold_lease(gs.time.time() - 1)
+        with mock.patch.object(gs.time, "sleep") as sleep:
+            gs.push_with_retry(cwd=self.work)
+        sleep.assert_not_called()
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_gives_up_on_a_lease_that_never_frees(self):
+        self._commit_change()
+        self._hold_lease(gs.time.time() + 60)
+        with mock.patch.object(gs, "LEASE_WAIT_SECONDS", 0), \
+                mock.patch.object(gs.time, "sleep"), \
+                mock.patch.object(gs.metrics, "inc") as inc:
+            with self.assertRaisesRegex(RuntimeError, "other/1"):
+                gs.push_with_retry(cwd=self.work)
+        inc.assert_called_once_with("skycards_push_failures_total")
+        # Not ours to release.
+        self.assertNotEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_releases_the_lease_after_the_last_attempt(self):
+        self._commit_change()
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        self._push_file("models.json", "m\n")
+        with mock.patch.object(gs, "_catch_up"), \
+                mock.patch.object(gs.time, "sleep"):
+            with self.assertRaisesRegex(RuntimeError, "after 3 attempts"):
+                gs.push_with_retry(cwd=self.work)
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_releases_the_lease_when_catching_up_fails(self):
+        self._commit_change()
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        self._push_file("models.json", "m\n")
+        with mock.patch.object(gs, "_catch_up", side_effect=OSError("boom")), \
+                mock.patch.object(gs.time, "sleep"):
+            with self.assertRaises(OSError):
+                gs.push_with_retry(cwd=self.work)
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_rejected_push_catches_up_and_retries(self):
+        self._commit_change()
+        _git("pull", "-q", "origin", "main", cwd=self.seed)
+        self._push_file("models.json", "m\n")
+        with mock.patch.object(gs.time, "sleep") as sleep:
+            gs.push_with_retry(cwd=self.work)
+        sleep.assert_called_once()
+        self.assertEqual(self._seed_log("%s").split("\n")[:2], ["a", "models.json"])
+        self.assertEqual(self._ls_remote(gs.LEASE_REF), {})
+
+    def test_last_shard_to_finish_claims_the_run(self):
+        gs.sync(self.work, "tok", sparse=True)
+        other = os.path.join(self.tmp, "other")
+        gs.sync(other, "tok", sparse=True)
+        gs.push_shard("run", 0, "zero\n", cwd=self.work)
+        self.assertIsNone(gs.claim_shards("run", 2, cwd=self.work))
+        gs.push_shard("run", 1, "one\n", cwd=other)
+        self.assertEqual(gs.claim_shards("run", 2, cwd=other),
+                         ["zero\n", "one\n"])
+        # Claimed once: the refs are gone and nobody else merges.
+        self.assertEqual(self._ls_remote(f"{gs.SHARD_REF}*"), {})
+        self.assertIsNone(gs.claim_shards("run", 2, cwd=self.work))
+
+    def test_switching_modes(self):
+        gs.sync(self.work, "tok")
+        gs.sync(self.work, "tok", sparse=True)
+        self.assertEqual(os.listdir(self.work), [".git"])
+        gs.checkout_files(["airports.json", "missing.json"], cwd=self.work)
+        self.assertEqual(self._read("airports.json"), "1\n")
+        gs.restore_file("airports.json", cwd=self.work)
+        self.assertEqual(os.listdir(self.work), [".git"])
+        gs.sync(self.work, "tok")
+        self.assertFalse(gs.is_sparse(self.work))
+        self.assertEqual(self._read("airports.json"), "1\n")
+
+
+@unittest.skipUnless(shutil.which("git"), "git not installed")
+class ObjectReaderTest(unittest.TestCase):
+    """Lookups through cat-file --batch in a blob:none partial clone."""
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        remote = os.path.join(tmp, "remote.git")
+        _git("init", "--bare", "-b", "main", remote)
+        _git("config", "uploadpack.allowFilter", "true", cwd=remote)
+        seed = os.path.join(tmp, "seed")
+        _git("clone", remote, seed)
+        for name, content in (("a.json", "a1\n"), ("b.json", "b1\n"),
+                              ("a.json", "a2\n"), ("sub/c.json", "x\n"),
+                              ("b.json", "b2\n")):
+            os.makedirs(os.path.dirname(os.path.join(seed, name)), exist_ok=True)
+            with open(os.path.join(seed, name), "w") as fh:
+                fh.write(content)
+            _git("add", name, cwd=seed)
+            _git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-m",
+                 name, cwd=seed)
+        _git("push", "origin", "HEAD:main", cwd=seed)
+        self.work = os.path.join(tmp, "work")
+        _git("clone", "--filter=blob:none", "file://" + remote, self.work)
+        self.addCleanup(gs.close_reader, self.work)
+
+    def _git_out(self, *args):
+        return subprocess.run(["git", *args], cwd=self.work, capture_output=True,
+                              text=True).stdout.strip()
+
+    def test_lookups_match_git(self):
+        for ref, path in (("HEAD", "a.json"), ("HEAD~3", "a.json"),
+                          ("HEAD", "sub/c.json")):
+            self.assertEqual(gs.blob_id(ref, path, cwd=self.work),
+                             self._git_out("rev-parse", f"{ref}:{path}"))
+        self.assertEqual(gs.show_file("HEAD~1", "sub/c.json", cwd=self.work), "x\n")
+        self.assertEqual(gs.show_file("HEAD", "missing.json", cwd=self.work), "")
+        self.assertEqual(gs.blob_id("HEAD", "sub", cwd=self.work),
+                         self._git_out("rev-parse", "HEAD:sub"))
+        self.assertEqual(gs.blob_id("HEAD", "a.json/x", cwd=self.work), "")
+
+    def test_last_commit_touching_matches_git_log(self):
+        for path in ("a.json", "b.json", "sub/c.json", "missing.json"):
+            self.assertEqual(gs.last_commit_touching(path, cwd=self.work),
+                             self._git_out("log", "-1", "--format=%H", "--", path),
+                             msg=path)
+
+    def test_missing_blobs_fetched_together(self):
+        reader = gs.reader(self.work)
+        oids = [reader.resolve("HEAD~3", p) for p in ("a.json", "b.json")]
+        # Neither old blob is in the partial clone yet (only HEAD's are).
+        self.assertEqual(reader.prefetch("HEAD~3", oids + [oids[0]]), 2)
+        self.assertEqual(reader.prefetch("HEAD~3", oids), 0)
+        self.assertEqual(gs.read_files("HEAD~3", ["a.json", "b.json", "nope"],
+                                       cwd=self.work), ["a1\n", "b1\n", ""])
+
+    def test_reader_restarts_after_close(self):
+        self.assertEqual(gs.show_file("HEAD", "b.json", cwd=self.work), "b2\n")
+        gs.close_reader(self.work)
+        self.assertEqual(gs.show_file("HEAD", "a.json", cwd=self.work), "a2\n")
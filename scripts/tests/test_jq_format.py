@@ -0,0 +1,99 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import jq_format as jf  # noqa: E402
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+
+class LayoutTest(unittest.TestCase):
+    def test_nested_containers(self):
+        text = '{"a":[1,[],{}],"b":{"c":null,"d":true,"e":false}}'
+        self.assertEqual(jf.dumps(jf.loads(text)), (
+            '{\n'
+            '  "a": [\n'
+            '    1,\n'
+            '    [],\n'
+            '    {}\n'
+            '  ],\n'
+            '  "b": {\n'
+            '    "c": null,\n'
+            '    "d": true,\n'
+            '    "e": false\n'
+            '  }\n'
+            '}\n'))
+
+    def test_scalar_document(self):
+        self.assertEqual(jf.dumps(jf.loads('"x"')), '"x"\n')
+
+    def test_keeps_key_order(self):
+        self.assertEqual(jf.dumps(jf.loads('{"b":1,"a":2}')),
+                         '{\n  "b": 1,\n  "a": 2\n}\n')
+
+    def test_dump_streams_same_bytes(self):
+        doc = jf.loads('{"rows":[%s]}' % ",".join(['{"id":"x"}'] * 5000))
+        fh = io.StringIO()
+        jf.dump(doc, fh)
+        self.assertEqual(fh.getvalue(), jf.dumps(doc))
+
+
+class StringTest(unittest.TestCase):
+    def test_escapes_controls_quotes_and_del_only(self):
+        self.assertEqual(jf.format_string('a"\\\n\t\x01\x7f/é😀'),
+                         '"a\\"\\\\\\n\\t\\u0001\\u007f/é😀"')
+
+
+class NumberTest(unittest.TestCase):
+    def test_literals_canonicalized_like_decnumber(self):
+        cases = {
+            "1": "1", "-0": "-0", "-0.0": "-0.0", "1.000": "1.000",
+            "0.000029204718417047183": "0.000029204718417047183",
+            "1e3": "1E+3", "2.5e-7": "2.5E-7", "0.0000001": "1E-7",
+            "1e-6": "0.000001", "12.5E+2": "1.25E+3",
+            "100000000000000000000": "100000000000000000000",
+        }
+        for literal, expected in cases.items():
+            self.assertEqual(jf.dumps(jf.loads(literal)), expected + "\n", literal)
+
+    def test_parsed_numbers_still_behave_as_numbers(self):
+        doc = jf.loads('{"r": 322, "w": 16.3}')
+        self.assertEqual(doc["r"] / 100, 3.22)
+        self.assertEqual(doc["w"], 16.3)
+
+    def test_computed_doubles_use_dtoa_rendering(self):
+        cases = {1.0: "1", 0.1: "0.1", 1e-5: "1e-05", 1e17: "1e+17",
+                 1.2345678901234568e20: "123456789012345680000",
+                 0.0001: "0.0001", -0.0: "-0", float("inf"): "1.7976931348623157e+308",
+                 float("nan"): "null"}
+        for value, expected in cases.items():
+            self.assertEqual(jf.format_number(value), expected, value)
+
+
+class SnapshotTest(unittest.TestCase):
+    """The committed snapshots must round-trip byte for byte."""
+
+    def test_current_snapshots_round_trip(self):
+        for name in jf.SNAPSHOTS:
+            path = os.path.join(REPO_ROOT, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as fh:
+                text = fh.read()
+            self.assertEqual(jf.dumps(jf.loads(text)), text, name)
+
+    @unittest.skipUnless(shutil.which("jq"), "jq not installed")
+    def test_matches_jq_on_strings_and_layout(self):
+        text = ('{"s":"' + "".join(f"\\u{i:04x}" for i in range(0x80))
+                + ' é😀","l":[[],[{}],{"a":[1,2]}],"t":true,"n":null}')
+        expected = subprocess.run(["jq", "."], input=text, capture_output=True,
+                                  text=True, check=True).stdout
+        self.assertEqual(jf.dumps(jf.loads(text)), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import json_diff  # noqa: E402
+
+
+class SameTest(unittest.TestCase):
+    def test_bool_never_equals_number(self):
+        self.assertFalse(json_diff.same(True, 1))
+        self.assertFalse(json_diff.same({"a": [0]}, {"a": [False]}))
+
+    def test_numbers_compare_by_value(self):
+        self.assertTrue(json_diff.same({"a": 1}, {"a": 1.0}))
+        self.assertFalse(json_diff.same(1, "1"))
+        self.assertFalse(json_diff.same(None, 0))
+
+
+class CompareTest(unittest.TestCase):
+    def test_added_removed_updated(self):
+        old = {"updatedAt": 1, "rows": [{"id": 1, "a": 1}, {"id": 2, "a": 2},
+                                        {"id": 3, "a": 3}]}
+        new = {"updatedAt": 2, "rows": [{"id": 3, "a": 3}, {"id": 1, "a": 9, "b": 0},
+                                        {"id": 4, "a": 4}]}
+        c = json_diff.compare(old, new)
+        self.assertTrue(c.changed)
+        self.assertFalse(c.only_updatedat)
+        self.assertEqual(c.top_level, ["updatedAt"])
+        self.assertEqual(c.added, [{"id": 4, "a": 4}])
+        self.assertEqual(c.removed, [{"id": 2, "a": 2}])
+        self.assertEqual(c.updated, [({"id": 1, "a": 1}, {"id": 1, "a": 9, "b": 0},
+                                      ["a", "b"])])
+
+    def test_only_updatedat(self):
+        c = json_diff.compare({"updatedAt": 1, "rows": [{"id": 1}]},
+                              {"updatedAt": 2, "rows": [{"id": 1}]})
+        self.assertEqual((c.changed, c.only_updatedat), (True, True))
+
+    def test_reordering_and_reformatting_is_no_change(self):
+        old = [{"id": 1, "n": 1.0, "x": "a"}, {"id": 2, "n": 2}]
+        new = [{"id": 2, "n": 2}, {"x": "a", "n": 1, "id": 1}]
+        c = json_diff.compare(old, new)
+        self.assertEqual((c.changed, c.only_updatedat), (False, False))
+
+    def test_first_run_adds_everything(self):
+        c = json_diff.compare(None, {"rows": [{"id": 1}]})
+        self.assertTrue(c.changed)
+        self.assertEqual(c.added, [{"id": 1}])
+
+    def test_unkeyed_rows_flagged_as_a_whole(self):
+        c = json_diff.compare({"rows": [{"name": "a"}]}, {"rows": [{"name": "b"}]})
+        self.assertEqual(c.top_level, ["rows"])
+        self.assertEqual((c.added, c.removed, c.updated), ([], [], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import metrics  # noqa: E402
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        patcher = mock.patch.dict(os.environ, {"METRICS_TEXTFILE_DIR": self.dir,
+                                               "METRICS_JOB": "fetch-airports"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop("METRICS_PUSHGATEWAY_URL", None)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def textfile(self):
+        with open(os.path.join(self.dir, "fetch-airports.prom")) as fh:
+            return fh.read()
+
+    def test_histogram_buckets_are_cumulative_and_ordered(self):
+        metrics.observe("skycards_fetch_duration_seconds", 0.3, source="airports")
+        metrics.observe("skycards_fetch_duration_seconds", 7, source="airports")
+        metrics.flush()
+        lines = [l for l in self.textfile().splitlines()
+                 if l.startswith("skycards_fetch_duration_seconds_bucket")]
+        values = [float(l.rsplit(" ", 1)[1]) for l in lines]
+        self.assertEqual(values, [0, 0, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2])
+        self.assertIn('le="+Inf"', lines[-1])
+        self.assertIn("# TYPE skycards_fetch_duration_seconds histogram",
+                      self.textfile())
+        self.assertIn('skycards_fetch_duration_seconds_sum{job_name="fetch-airports",'
+                      'source="airports"} 7.3', self.textfile())
+
+    def test_counters_accumulate_across_flushes_and_gauges_replace(self):
+        metrics.inc("skycards_push_attempts_total", 2)
+        metrics.set_gauge("skycards_last_run_timestamp_seconds", 100, command="fetch")
+        metrics.flush()
+        metrics.inc("skycards_push_attempts_total")
+        metrics.set_gauge("skycards_last_run_timestamp_seconds", 200, command="fetch")
+        metrics.flush()
+        text = self.textfile()
+        self.assertIn('skycards_push_attempts_total{job_name="fetch-airports"} 3', text)
+        self.assertIn('skycards_last_run_timestamp_seconds{command="fetch",'
+                      'job_name="fetch-airports"} 200', text)
+
+    def test_run_records_failure_and_flushes(self):
+        with self.assertRaises(RuntimeError):
+            with metrics.run("fetch"):
+                raise RuntimeError("push failed")
+        text = self.textfile()
+        self.assertIn('skycards_runs_total{command="fetch",job_name="fetch-airports",'
+                      'result="failure"} 1', text)
+        self.assertNotIn("skycards_last_success_timestamp_seconds", text)
+
+    def test_run_counts_clean_exit_as_success(self):
+        with self.assertRaises(SystemExit):
+            with metrics.run("compare"):
+                raise SystemExit(0)
+        self.assertIn('result="success"', self.textfile())
+
+    def test_run_counts_unchanged_exit_as_healthy(self):
+        with self.assertRaises(SystemExit):
+            with metrics.run("compare_airports", unchanged_code=3):
+                raise SystemExit(3)
+        text = self.textfile()
+        self.assertIn('result="unchanged"} 1', text)
+        self.assertIn("skycards_last_success_timestamp_seconds", text)
+        self.assertNotIn('result="failure"', text)
+
+    def test_label_values_escaped_and_round_trip(self):
+        metrics.inc("skycards_webhook_posts_total", webhook='a"b\\c', status=204)
+        metrics.flush()
+        self.assertIn('webhook="a\\"b\\\\c"', self.textfile())
+        metrics.inc("skycards_webhook_posts_total", webhook='a"b\\c', status=204)
+        metrics.flush()
+        self.assertIn('status="204",webhook="a\\"b\\\\c"} 2', self.textfile())
+
+    def test_pushes_to_gateway(self):
+        os.environ["METRICS_PUSHGATEWAY_URL"] = "http://gw:9091/"
+        metrics.inc("skycards_fr24_pages_total", result="ok")
+        with mock.patch.object(metrics.urllib.request, "urlopen") as urlopen:
+            metrics.flush()
+        req = urlopen.call_args[0][0]
+        self.assertEqual(req.full_url, "http://gw:9091/metrics/job/fetch-airports")
+        self.assertEqual(req.get_method(), "POST")
+        self.assertIn(b"skycards_fr24_pages_total", req.data)
+
+    def test_noop_without_destination(self):
+        del os.environ["METRICS_TEXTFILE_DIR"]
+        metrics.inc("skycards_push_attempts_total")
+        metrics.flush()
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,14 +8,11 @@ from unittest import mock
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 import pipeline as pl  # noqa: E402
 
-import shutil
-
 
 class FormatJsonTest(unittest.TestCase):
-    @unittest.skipUnless(shutil.which("jq"), "jq not installed")
-    def test_formats_via_jq_with_trailing_newline(self):
+    def test_formats_like_jq_with_trailing_newline(self):
         path = os.path.join(tempfile.mkdtemp(), "out.json")
-        pl.format_json('{"b":1,"a":[1,2]}', path)
+        pl.format_json(pl.jq_format.loads('{"b":1,"a":[1,2]}'), path)
         with open(path, encoding="utf-8") as fh:
             text = fh.read()
         self.assertTrue(text.endswith("\n"))
@@ -51,14 +48,148 @@ class RoutingKeyTest(unittest.TestCase):
         self.assertEqual(pl.routing_key("airlines", is_misc=True), "misc")
 
 
+def _response(body=b'{"ok": 1}', status=200, headers=None, chunk=4):
+    resp = mock.Mock(status_code=status, headers=headers or {})
+    resp.iter_content.return_value = [body[i:i + chunk]
+                                      for i in range(0, len(body), chunk)]
+    return resp
+
+
 class FetchApiTest(unittest.TestCase):
-    def test_fetches_text_with_timestamp_param(self):
+    def setUp(self):
+        self.dest = os.path.join(tempfile.mkdtemp(), "raw")
+
+    def _fetch(self, resp, validators=None):
         session = mock.Mock()
-        session.get.return_value = mock.Mock(text='{"ok": 1}')
-        text = pl.fetch_api("https://api/airports", "updatedAt", "123", session)
+        session.get.return_value = resp
+        result = pl.fetch_api("https://api/airports", "updatedAt", "123",
+                              session, self.dest, validators=validators)
+        return result, session
+
+    def test_streams_body_to_disk_with_timestamp_param(self):
+        (fetched, validators), session = self._fetch(
+            _response(headers={"ETag": '"v1"'}))
         session.get.assert_called_once_with(
-            "https://api/airports", params={"updatedAt": "123"}, headers=pl.HEADERS)
-        self.assertEqual(text, '{"ok": 1}')
+            "https://api/airports", params={"updatedAt": "123"},
+            headers=pl.HEADERS, stream=True)
+        self.assertTrue(fetched)
+        with open(self.dest, "rb") as fh:
+            self.assertEqual(fh.read(), b'{"ok": 1}')
+        self.assertEqual(validators["etag"], '"v1"')
+        self.assertEqual(len(validators["sha256"]), 64)
+
+    def test_sends_conditional_headers_and_stops_on_304(self):
+        cached = {"etag": '"v1"', "last_modified": "Mon", "sha256": "x"}
+        (fetched, validators), session = self._fetch(_response(b"", status=304),
+                                                     validators=cached)
+        headers = session.get.call_args.kwargs["headers"]
+        self.assertEqual(headers["If-None-Match"], '"v1"')
+        self.assertEqual(headers["If-Modified-Since"], "Mon")
+        self.assertFalse(fetched)
+        self.assertIs(validators, cached)
+
+    def test_identical_body_hash_counts_as_unchanged(self):
+        (_, first), _ = self._fetch(_response())
+        (fetched, _), _ = self._fetch(_response(), validators=first)
+        self.assertFalse(fetched)
+
+    def test_rejects_html_error_page(self):
+        with self.assertRaises(ValueError):
+            self._fetch(_response(b"<html>502</html>"))
+        with self.assertRaises(ValueError):
+            self._fetch(_response(b"{}", headers={"Content-Type": "text/html"}))
+
+    def test_rejects_truncated_body(self):
+        with self.assertRaises(ValueError):
+            self._fetch(_response(b'{"rows": [', headers={"Content-Length": "99"}))
+
+
+class LoadPayloadTest(unittest.TestCase):
+    def _load(self, body, data_name):
+        path = os.path.join(tempfile.mkdtemp(), "raw")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(body)
+        return pl.load_payload(path, data_name)
+
+    def test_accepts_expected_shapes(self):
+        self.assertEqual(self._load('{"rows": []}', "airports"), {"rows": []})
+        self.assertEqual(self._load('[{"id": 1}]', "airlines"), [{"id": 1}])
+
+    def test_rejects_wrong_shape_or_invalid_json(self):
+        for body, name in (('{"error": "x"}', "models"), ('{"rows": []}', "airlines"),
+                           ('[{"id": 1}]', "airports"), ('{"rows": [', "models")):
+            with self.assertRaises(ValueError, msg=body):
+                self._load(body, name)
+
+
+class FetchSourceStateTest(unittest.TestCase):
+    def setUp(self):
+        self.state = tempfile.mkdtemp()
+        self.args = pl.source_args("models")
+
+    def _fetch(self, body, blob="blob1", old=None):
+        def fake_fetch(url, param, ts, session, dest, validators=None):
+            if body is None:
+                return False, {"sha256": "h"}
+            with open(dest, "w", encoding="utf-8") as fh:
+                fh.write(body)
+            return True, {"sha256": "h"}
+
+        with mock.patch.object(pl, "fetch_api", side_effect=fake_fetch) as fetch, \
+                mock.patch.object(pl, "format_json") as fmt, \
+                mock.patch.object(pl.gs, "blob_id", return_value=blob), \
+                mock.patch.object(pl.gs, "file_changed",
+                                  return_value=True) as detect, \
+                mock.patch.object(pl, "load_snapshot", return_value=old):
+            result = pl.fetch_source(self.args, "/repo", mock.Mock(), self.state)
+        return result, fetch, fmt, detect
+
+    def test_unchanged_upstream_skips_format_and_diff(self):
+        pl.save_validators(self.state, "models", {"sha256": "h", "blob": "blob1"})
+        result, fetch, fmt, detect = self._fetch(None)
+        self.assertIsNone(result)
+        self.assertEqual(fetch.call_args.kwargs["validators"]["sha256"], "h")
+        fmt.assert_not_called()
+        detect.assert_not_called()
+
+    def test_validators_ignored_when_head_moved(self):
+        pl.save_validators(self.state, "models", {"sha256": "h", "blob": "old"})
+        _, fetch, _, _ = self._fetch('{"rows": []}')
+        self.assertEqual(fetch.call_args.kwargs["validators"], {})
+
+    def test_validators_pending_until_remembered(self):
+        result, _, fmt, _ = self._fetch('{"rows": []}')
+        self.assertFalse(result.only_updatedat)
+        self.assertEqual(result.doc, {"rows": []})
+        fmt.assert_called_once()
+        self.assertEqual(pl.load_validators(self.state, "models"), {})
+        with mock.patch.object(pl.gs, "blob_id", return_value="blob2"):
+            pl.remember_source(self.args, "/repo", self.state)
+        self.assertEqual(pl.load_validators(self.state, "models"),
+                         {"sha256": "h", "blob": "blob2"})
+        self.assertEqual(pl.load_validators(self.state, "models", pending=True), {})
+
+    def test_invalid_payload_never_reaches_the_working_copy(self):
+        with self.assertRaises(ValueError):
+            self._fetch('{"error": "maintenance"}')
+        self.assertEqual(pl.load_validators(self.state, "models", pending=True), {})
+
+    def test_fetch_outcomes_counted(self):
+        pl.metrics.reset()
+        self.addCleanup(pl.metrics.reset)
+        pl.save_validators(self.state, "models", {"sha256": "h", "blob": "blob1"})
+        self._fetch(None)
+        self._fetch('{"updatedAt": 2, "rows": []}',
+                    old={"updatedAt": 1, "rows": []})
+        with self.assertRaises(ValueError):
+            self._fetch("{}")
+        outcomes = {s.split('outcome="')[1].split('"')[0]: v for s, v in
+                    pl.metrics._samples["skycards_fetches_total"].items()}
+        self.assertEqual(outcomes, {"upstream_unchanged": 1,
+                                    "only_updatedat": 1, "error": 1})
+        durations = pl.metrics._samples["skycards_fetch_duration_seconds"]
+        self.assertEqual(durations['skycards_fetch_duration_seconds_count'
+                                   '{job_name="skycards",source="models"}'], 3)
 
 
 class CliParseTest(unittest.TestCase):
@@ -81,6 +212,278 @@ class CliParseTest(unittest.TestCase):
         self.assertEqual(ns.timestamp_param, "timestamp")
         self.assertEqual(ns.timestamp_url, "https://a/timestamp")
 
+    def test_fetch_all_defaults_to_every_source(self):
+        ns = pl.build_parser().parse_args(["fetch-all"])
+        self.assertEqual(ns.sources, ["airports", "models", "airlines"])
+        self.assertFalse(ns.compare_after)
+        ns = pl.build_parser().parse_args(
+            ["fetch-all", "--sources", "models", "--compare-after"])
+        self.assertEqual(ns.sources, ["models"])
+
+    def test_source_args_match_fetch_namespace(self):
+        a = pl.source_args("airlines")
+        self.assertEqual(a.output_file, "airlines.json")
+        self.assertEqual(a.timestamp_param, "timestamp")
+
     def test_compare_command(self):
         ns = pl.build_parser().parse_args(["compare"])
         self.assertEqual(ns.command, "compare")
+        self.assertIsNone(ns.shard)
+
+    def test_compare_shard(self):
+        ns = pl.build_parser().parse_args(
+            ["compare", "--shard", "2/4", "--run-id", "compare-x"])
+        self.assertEqual((ns.shard, ns.run_id), ((2, 4), "compare-x"))
+        with mock.patch("sys.stderr"):
+            for bad in ("4/4", "1", "a/b"):
+                with self.assertRaises(SystemExit):
+                    pl.build_parser().parse_args(["compare", "--shard", bad])
+
+
+class FetchAllTest(unittest.TestCase):
+    def _run(self, fetch_results):
+        def fake_fetch(args, workdir, session, state_dir=None):
+            result = fetch_results[args.data_name]
+            if isinstance(result, Exception):
+                raise result
+            return None if result is None else pl.Fetched(result, {"rows": []})
+
+        summary = pl.fc.Summary("m", "t", "c", False)
+        with mock.patch.object(pl, "fetch_source", side_effect=fake_fetch), \
+                mock.patch.object(pl, "summarize_source", return_value=summary), \
+                mock.patch.object(pl, "commit_source") as commit, \
+                mock.patch.object(pl, "notify_source") as notify, \
+                mock.patch.object(pl.gs, "push_with_retry") as push, \
+                mock.patch.object(pl.gs, "restore_file") as restore:
+            failures, docs = pl.run_fetch_all(list(fetch_results), "/repo",
+                                              mock.Mock())
+        return failures, docs, commit, notify, push, restore
+
+    def test_commits_each_changed_source_and_pushes_once(self):
+        failures, docs, commit, notify, push, _ = self._run(
+            {"airports": False, "models": None, "airlines": True})
+        self.assertEqual(failures, [])
+        self.assertEqual([c.args[0].data_name for c in commit.call_args_list],
+                         ["airports", "airlines"])
+        push.assert_called_once()
+        self.assertEqual(notify.call_count, 2)
+        self.assertEqual(set(docs), {"airports", "airlines"})
+
+    def test_failed_source_is_restored_and_others_publish(self):
+        failures, _, commit, _, push, restore = self._run(
+            {"airports": RuntimeError("boom"), "models": False})
+        self.assertEqual(failures, ["airports"])
+        restore.assert_called_once_with("airports.json", cwd="/repo")
+        self.assertEqual([c.args[0].data_name for c in commit.call_args_list],
+                         ["models"])
+        push.assert_called_once()
+
+    def test_nothing_changed_no_push(self):
+        _, _, commit, _, push, _ = self._run({"airports": None, "models": None})
+        commit.assert_not_called()
+        push.assert_not_called()
+
+
+class SummarizeSourceTest(unittest.TestCase):
+    def test_uses_parsed_documents_in_process(self):
+        args = pl.source_args("models")
+        old = '{"rows": [{"id": "PC12", "name": "PC-12", "seats": 9}]}'
+        new = {"rows": [{"id": "PC12", "name": "PC-12", "seats": 10}]}
+        with mock.patch.object(pl.gs, "read_files", return_value=[old]):
+            summary = pl.summarize_source(args, "/repo", pl.Fetched(False, new))
+        self.assertIn("Seats: 9", summary.message)
+        self.assertIn(pl.COMMIT_PLACEHOLDER, summary.message)
+        self.assertFalse(summary.is_misc)
+
+    def test_only_updatedat_has_no_summary(self):
+        args = pl.source_args("models")
+        self.assertIsNone(pl.summarize_source(args, "/repo",
+                                              pl.Fetched(True, {"rows": []})))
+
+
+class ShardedCompareTest(unittest.TestCase):
+    def _run(self, claimed):
+        def fake_script(workdir, *args):
+            if "--output" in args:
+                with open(args[args.index("--output") + 1], "w") as fh:
+                    fh.write("partial")
+            else:
+                calls.append([open(p).read() for p in args[1:]])
+
+        calls = []
+        with mock.patch.object(pl, "_compare_script", side_effect=fake_script), \
+                mock.patch.object(pl.gs, "checkout_files"), \
+                mock.patch.object(pl.gs, "push_shard") as push, \
+                mock.patch.object(pl.gs, "claim_shards", return_value=claimed), \
+                mock.patch.object(pl, "_publish_comparison") as publish:
+            pl.run_compare("/repo", None, shard=(1, 2), run_id="r")
+        push.assert_called_once_with("r", 1, "partial", cwd="/repo")
+        return calls, publish
+
+    def test_waits_for_the_other_shards(self):
+        calls, publish = self._run(None)
+        self.assertEqual(calls, [])
+        publish.assert_not_called()
+
+    def test_last_shard_merges_and_publishes(self):
+        calls, publish = self._run(["a", "b"])
+        self.assertEqual(calls, [["a", "b"]])
+        publish.assert_called_once_with("/repo", None, None, None)
+
+
+class CompareGateTest(unittest.TestCase):
+    def test_unchanged_comparison_publishes_nothing(self):
+        with mock.patch.object(pl, "_compare_script",
+                               return_value=pl.COMPARE_UNCHANGED), \
+                mock.patch.object(pl.gs, "checkout_files"), \
+                mock.patch.object(pl, "_publish_comparison") as publish:
+            pl.run_compare("/repo", None)
+        publish.assert_not_called()
+
+    def test_other_failures_raise(self):
+        with mock.patch.object(pl.subprocess, "run",
+                               return_value=mock.Mock(returncode=1, args=[])):
+            with self.assertRaises(pl.subprocess.CalledProcessError):
+                pl._compare_script("/repo", "--resume")
+
+
+class WorkingCopyTest(unittest.TestCase):
+    def test_throwaway_clone_without_cache(self):
+        with mock.patch.object(pl.gs, "clone") as clone, \
+                mock.patch.object(pl.gs, "sync") as sync:
+            with pl.working_copy("tok", "n", "e") as repo_dir:
+                self.assertTrue(repo_dir.endswith("repo"))
+        clone.assert_called_once()
+        sync.assert_not_called()
+
+    def test_syncs_persistent_copy_in_cache_dir(self):
+        cache = tempfile.mkdtemp()
+        with mock.patch.object(pl.gs, "clone") as clone, \
+                mock.patch.object(pl.gs, "sync") as sync:
+            with pl.working_copy("tok", "n", "e", cache) as repo_dir:
+                self.assertEqual(repo_dir, os.path.join(cache, "repo"))
+        sync.assert_called_once_with(os.path.join(cache, "repo"), "tok",
+                                     author_name="n", author_email="e",
+                                     sparse=False)
+        clone.assert_not_called()
+
+
+class SnapshotCacheTest(unittest.TestCase):
+    def test_reuses_parsed_blob_and_evicts_oldest(self):
+        snapshots = pl.collections.OrderedDict()
+        with mock.patch.object(pl.gs, "blob_id", return_value="b1"), \
+                mock.patch.object(pl.gs, "read_files",
+                                  return_value=['{"rows": []}']) as read:
+            first = pl.load_snapshot("/repo", "HEAD", "models.json", snapshots)
+            second = pl.load_snapshot("/repo", "HEAD", "models.json", snapshots)
+        self.assertIs(first, second)
+        read.assert_called_once()
+        for i in range(pl.SNAPSHOT_CACHE_SIZE):
+            pl.remember_snapshot(snapshots, "airports.json", f"a{i}", {})
+        self.assertNotIn(("models.json", "b1"), snapshots)
+        self.assertEqual(len(snapshots), pl.SNAPSHOT_CACHE_SIZE)
+
+    def test_missing_file_is_none(self):
+        with mock.patch.object(pl.gs, "blob_id", return_value=""):
+            self.assertIsNone(pl.load_snapshot("/repo", "HEAD", "x.json", {}))
+
+    def test_several_files_read_in_one_batch(self):
+        snapshots = pl.collections.OrderedDict()
+        pl.remember_snapshot(snapshots, "a.json", "ba", {"cached": True})
+        blobs = {"a.json": "ba", "b.json": "bb", "c.json": ""}
+        with mock.patch.object(pl.gs, "blob_id",
+                               side_effect=lambda ref, path, cwd: blobs[path]), \
+                mock.patch.object(pl.gs, "read_files",
+                                  return_value=['{"b": 1}']) as read:
+            docs = pl.load_snapshots("/repo", "c1", ["a.json", "b.json", "c.json"],
+                                     snapshots)
+        self.assertEqual(docs, [{"cached": True}, {"b": 1}, None])
+        read.assert_called_once_with("c1", ["b.json"], cwd="/repo")
+        self.assertIn(("b.json", "bb"), snapshots)
+
+
+class DaemonTest(unittest.TestCase):
+    def _ctx(self):
+        return pl.argparse.Namespace(workdir="/repo", session=mock.Mock(),
+                                     state_dir=None, snapshots={},
+                                     refresh=mock.Mock())
+
+    def test_schedule_overrides(self):
+        schedule = pl.daemon_schedule(["airlines=15 6 * * *", "comparison=off"])
+        self.assertEqual(list(schedule), ["airports", "models", "airlines"])
+        self.assertEqual(schedule["airlines"].expr, "15 6 * * *")
+        for bad in ("nope=* * * * *", "airports", "models=61 * * * *"):
+            with self.assertRaises(ValueError, msg=bad):
+                pl.daemon_schedule([bad])
+
+    def test_tick_runs_jobs_in_order_and_chains_airports(self):
+        ctx, status = self._ctx(), pl.DaemonStatus()
+        airports = {"rows": [1]}
+
+        def fake_fetch(args, *rest):
+            if args.data_name == "models":
+                raise RuntimeError("boom")
+            return airports
+
+        with mock.patch.object(pl, "run_fetch", side_effect=fake_fetch) as fetch, \
+                mock.patch.object(pl, "run_compare") as compare:
+            pl.run_tick(["airports", "models", "comparison"], ctx, status)
+        self.assertEqual([c.args[0].data_name for c in fetch.call_args_list],
+                         ["airports", "models"])
+        self.assertIs(compare.call_args.kwargs["airports"], airports)
+        self.assertIs(compare.call_args.kwargs["snapshots"], ctx.snapshots)
+        # Once up front, and again after the failed job.
+        self.assertEqual(ctx.refresh.call_count, 2)
+        status.ready = True
+        healthy, report = status.report()
+        self.assertTrue(healthy)
+        self.assertEqual(report["jobs"]["models"]["last_error"],
+                         "RuntimeError: boom")
+        self.assertEqual(report["jobs"]["models"]["consecutive_failures"], 1)
+        self.assertIsNotNone(report["jobs"]["comparison"]["last_success"])
+
+    def test_health_reports_starting_and_stuck(self):
+        status = pl.DaemonStatus(stuck_after=0)
+        self.assertEqual(status.report()[1]["status"], "starting")
+        status.ready = True
+        status.started("airports")
+        pl.time.sleep(0.01)
+        healthy, report = status.report()
+        self.assertFalse(healthy)
+        self.assertEqual(report["stuck"], ["airports"])
+
+    def test_health_endpoint(self):
+        status = pl.DaemonStatus()
+        server = pl.serve_health(status, 0)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}/healthz"
+        with self.assertRaises(pl.requests.HTTPError):
+            pl.requests.get(url, timeout=5).raise_for_status()
+        status.ready = True
+        self.assertEqual(pl.requests.get(url, timeout=5).json()["status"], "ok")
+
+    def test_loop_runs_due_jobs_and_skips_missed_slots(self):
+        start = pl.datetime.datetime(2026, 1, 1, 10, 29, 59,
+                                     tzinfo=pl.datetime.timezone.utc)
+        clock = [start]
+        stop = pl.threading.Event()
+        ticks = []
+
+        def fake_tick(names, ctx, status):
+            ticks.append((f"{clock[0]:%H:%M}", names))
+            # A slow tick runs past the next slot; that slot is skipped.
+            clock[0] += pl.datetime.timedelta(minutes=45)
+            if len(ticks) == 2:
+                stop.set()
+
+        def fake_wait(timeout):
+            clock[0] += pl.datetime.timedelta(seconds=timeout)
+            return stop.is_set()
+
+        schedule = pl.daemon_schedule(["airlines=off", "comparison=off"])
+        with mock.patch.object(pl, "run_tick", side_effect=fake_tick), \
+                mock.patch.object(stop, "wait", side_effect=fake_wait):
+            pl.run_daemon(self._ctx(), schedule, pl.DaemonStatus(), stop,
+                          now=lambda: clock[0])
+        self.assertEqual(ticks, [("10:30", ["airports", "models"]),
+                                 ("11:30", ["airports", "models"])])
@@ -0,0 +1,87 @@
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import tracing  # noqa: E402
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "trace.jsonl")
+        patcher = mock.patch.dict(os.environ, {"TRACE_FILE": self.path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop("TRACE_PARENT", None)
+
+    def spans(self):
+        with open(self.path, encoding="utf-8") as fh:
+            return {s["name"]: s for s in map(json.loads, fh)}
+
+    def test_nested_spans_share_trace_and_link_parent(self):
+        with tracing.span("outer", source="airports") as outer:
+            with tracing.span("inner") as inner:
+                inner.add("bytes", 10)
+                inner.add("bytes", 5)
+                inner.add("retries")
+        spans = self.spans()
+        self.assertEqual(spans["inner"]["parent_id"], outer.span_id)
+        self.assertEqual(spans["inner"]["trace_id"], spans["outer"]["trace_id"])
+        self.assertIsNone(spans["outer"]["parent_id"])
+        self.assertEqual(spans["inner"]["attrs"], {"bytes": 15, "retries": 1})
+        self.assertEqual(spans["outer"]["attrs"], {"source": "airports"})
+        self.assertGreaterEqual(spans["outer"]["duration_ms"], 0)
+
+    def test_error_recorded_and_reraised(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("boom"):
+                raise ValueError("bad body")
+        self.assertEqual(self.spans()["boom"]["attrs"]["error"],
+                         "ValueError: bad body")
+
+    def test_child_process_continues_trace(self):
+        code = ("import sys, tracing\n"
+                "with tracing.span('child'): pass\n")
+        with tracing.span("parent") as parent:
+            env = tracing.child_env()
+            env["PYTHONPATH"] = os.path.dirname(tracing.__file__)
+            subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        spans = self.spans()
+        self.assertEqual(spans["child"]["trace_id"], parent.trace_id)
+        self.assertEqual(spans["child"]["parent_id"], parent.span_id)
+        self.assertNotEqual(spans["child"]["pid"], spans["parent"]["pid"])
+
+    def test_propagate_nests_worker_thread_spans(self):
+        def work():
+            with tracing.span("worker"):
+                pass
+        with tracing.span("root") as root:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+                pool.submit(tracing.propagate(work)).result()
+        self.assertEqual(self.spans()["worker"]["parent_id"], root.span_id)
+
+    def test_rotates_large_file(self):
+        with open(self.path, "w") as fh:
+            fh.write("x")
+        with mock.patch.object(tracing, "MAX_BYTES", 0):
+            with tracing.span("fresh"):
+                pass
+        self.assertTrue(os.path.exists(self.path + ".1"))
+        self.assertEqual(list(self.spans()), ["fresh"])
+
+    def test_noop_without_trace_file(self):
+        del os.environ["TRACE_FILE"]
+        with tracing.span("quiet") as sp:
+            sp.add("bytes", 1)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Span tracing across the pipeline's processes (stdlib only).
+
+Each span is appended as one JSON line to $TRACE_FILE (tracing is a no-op
+when it is unset) with its trace/span/parent ids, start time, duration and
+free-form attributes such as bytes transferred or retry counts. The current
+span travels to child processes in $TRACE_PARENT ("<trace_id>-<span_id>",
+see child_env()), so a compare_airports.py run shows up under the pipeline
+span that started it.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+TRACE_FILE_ENV = "TRACE_FILE"
+TRACE_PARENT_ENV = "TRACE_PARENT"
+# The trace file is rotated to <file>.1 once it grows past this size.
+MAX_BYTES = 20 * 1024 * 1024
+
+_current = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        """Increment a counter attribute (bytes, retries, ...)."""
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+
+def _env_parent():
+    trace_id, _, span_id = os.environ.get(TRACE_PARENT_ENV, "").partition("-")
+    if trace_id and span_id:
+        return trace_id, span_id
+    return uuid.uuid4().hex, None
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a child of the current span."""
+    parent = _current.get()
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = _env_parent()
+    sp = Span(name, trace_id, parent_id, attrs)
+    token = _current.set(sp)
+    start, t0 = time.time(), time.perf_counter()
+    try:
+        yield sp
+    except BaseException as e:
+        sp.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        _emit(sp, start, time.perf_counter() - t0)
+
+
+def current():
+    return _current.get()
+
+
+def child_env(env=None):
+    """Return a copy of env (default os.environ) carrying the current span."""
+    env = dict(os.environ if env is None else env)
+    sp = _current.get()
+    if sp is not None:
+        env[TRACE_PARENT_ENV] = f"{sp.trace_id}-{sp.span_id}"
+    return env
+
+
+def propagate(fn):
+    """Bind fn to the current span so it nests correctly in a worker thread."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def _emit(sp, start, duration):
+    path = os.environ.get(TRACE_FILE_ENV)
+    if not path:
+        return
+    record = {
+        "trace_id": sp.trace_id,
+        "span_id": sp.span_id,
+        "parent_id": sp.parent_id,
+        "name": sp.name,
+        "start": round(start, 6),
+        "duration_ms": round(duration * 1000, 3),
+        "pid": os.getpid(),
+        "attrs": sp.attrs,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    with _write_lock:
+        try:
+            if os.path.getsize(path) > MAX_BYTES:
+                os.replace(path, path + ".1")
+        except FileNotFoundError:
+            pass
+        # O_APPEND keeps concurrent writers (parent + child process) from
+        # interleaving partial lines.
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(line)